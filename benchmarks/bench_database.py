@@ -0,0 +1,202 @@
+"""
+Benchmark suite for the storage layer.
+
+Measures Database operations on generated datasets of increasing size, so
+backends and persistence modes can be compared and regressions caught. The
+datasets are seeded, so runs are reproducible.
+
+Updates only schedule a background save, so their timings leave out the
+write. The save benchmark includes it: a batch of updates and the flush()
+that writes them to disk.
+
+Usage:
+    python benchmarks/bench_database.py [--sizes 1000,10000,100000,1000000]
+        [--backend json] [--json results.json]
+        [--compare baseline.json] [--threshold 0.25]
+
+With --compare, exits with status 1 if any operation got slower than the
+baseline by more than the threshold (a fraction, default 0.25).
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import asyncio
+import logging
+import argparse
+import tempfile
+from typing import Any, Awaitable, Callable, Dict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.database import create_database, new_user
+
+# Users updated before each flush in the save benchmark
+SAVE_BATCH = 100
+
+def generate_data(size: int, seed: int = 0) -> Dict[str, Any]:
+    """Generate a dataset with `size` users who have played a bit."""
+    rng = random.Random(seed)
+    users = {}
+    for index in range(size):
+        user = new_user()
+        wins = rng.randint(0, 500)
+        losses = rng.randint(0, 500)
+        user.update({
+            "cash": rng.randint(0, 10_000_000),
+            "xp": rng.randint(0, 50_000),
+            "games_played": wins + losses,
+            "wins": wins,
+            "losses": losses,
+            "total_cash_won": rng.randint(0, 50_000_000),
+            "total_cash_lost": rng.randint(0, 50_000_000)
+        })
+        user["level"] = user["xp"] // 100
+        if rng.random() < 0.3:
+            user["cooldowns"] = {"work": time.time() + rng.randint(-3600, 3600)}
+        users[str(100_000_000_000 + index)] = user
+    return {
+        "users": users,
+        "guilds": {},
+        "global_stats": {"total_bets": size * 100, "total_cash_won": 0, "total_cash_lost": 0}
+    }
+
+def write_dataset(backend: str, path: str, data: Dict[str, Any]):
+    """Write a dataset in the format the backend loads."""
+    if backend in ("sqlite", "tiered"):
+        from utils.sqlite_store import SQLiteDatabase
+        SQLiteDatabase(path).import_data(data)
+    else:
+        with open(path, 'w') as f:
+            json.dump(data, f, indent=2)
+
+async def measure(func: Callable[[int], Awaitable[Any]], min_time: float, min_iterations: int = 3) -> float:
+    """Run func repeatedly for at least min_time seconds, returning the mean seconds per call."""
+    iterations = 0
+    start = time.perf_counter()
+    while iterations < min_iterations or time.perf_counter() - start < min_time:
+        await func(iterations)
+        iterations += 1
+    return (time.perf_counter() - start) / iterations
+
+async def bench_size(backend: str, size: int, min_time: float, workdir: str) -> Dict[str, float]:
+    path = os.path.join(workdir, f"bench-{size}.{'json' if backend == 'json' else 'sqlite3'}")
+    write_dataset(backend, path, generate_data(size))
+    user_ids = [str(100_000_000_000 + index) for index in range(size)]
+    rng = random.Random(1)
+    results: Dict[str, float] = {}
+
+    start = time.perf_counter()
+    db = create_database(backend, path)
+    await db.wait_until_loaded()
+    results["load"] = time.perf_counter() - start
+
+    async def get_existing(i):
+        await db.get_user(rng.choice(user_ids))
+
+    async def get_new(i):
+        await db.get_user(f"new-{size}-{i}")
+
+    async def update_user(i):
+        user_id = rng.choice(user_ids)
+        user = await db.get_user(user_id)
+        user["cash"] += 1
+        await db.update_user(user_id, user)
+
+    async def update_stats(i):
+        await db.update_stats(100, i % 2 == 0)
+
+    async def save(i):
+        # Saves are written in the background, so time a batch of updates up to the flush that writes them
+        for user_id in rng.sample(user_ids, min(SAVE_BATCH, size)):
+            user = await db.get_user(user_id)
+            user["cash"] += 1
+            await db.update_user(user_id, user)
+        await db.flush()
+
+    async def leaderboard(i):
+        await db.get_leaderboard("cash", 10)
+
+    async def aggregates(i):
+        db.snapshot_aggregates()
+
+    async def set_cooldown(i):
+        await db.set_cooldown(rng.choice(user_ids), "coinflip", time.time() + 5)
+
+    async def check_cooldown(i):
+        cooldowns = await db.get_all_cooldowns(rng.choice(user_ids))
+        cooldowns.get("coinflip", 0) > time.time()
+
+    operations = {
+        "get_user_existing": get_existing,
+        "get_user_new": get_new,
+        "update_user": update_user,
+        "update_stats": update_stats,
+        "save": save,
+        "get_leaderboard": leaderboard,
+        "aggregates": aggregates,
+        "set_cooldown": set_cooldown,
+        "check_cooldown": check_cooldown
+    }
+    for name, func in operations.items():
+        results[name] = await measure(func, min_time)
+        print(f"  {name:<18} {format_seconds(results[name]):>10}", flush=True)
+
+    print(f"  {'load':<18} {format_seconds(results['load']):>10}", flush=True)
+    return results
+
+def format_seconds(seconds: float) -> str:
+    if seconds < 1e-3:
+        return f"{seconds * 1e6:.1f}us"
+    if seconds < 1:
+        return f"{seconds * 1e3:.2f}ms"
+    return f"{seconds:.2f}s"
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> bool:
+    """Print operations that regressed against the baseline. Returns True if none did."""
+    ok = True
+    for size, operations in results["sizes"].items():
+        for name, seconds in operations.items():
+            before = baseline.get("sizes", {}).get(size, {}).get(name)
+            if not before:
+                continue
+            change = seconds / before - 1
+            if change > threshold:
+                ok = False
+                print(f"REGRESSION {size} users {name}: {format_seconds(before)} -> {format_seconds(seconds)} (+{change:.0%})")
+    return ok
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000,10000,100000,1000000", help="Comma separated user counts")
+    parser.add_argument("--backend", default="json", help="Database backend (json, sqlite or tiered)")
+    parser.add_argument("--min-time", type=float, default=0.5, help="Minimum seconds to run each operation")
+    parser.add_argument("--json", help="Write the results to this file")
+    parser.add_argument("--compare", help="Baseline results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.25, help="Allowed slowdown before failing")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    workdir = tempfile.mkdtemp(prefix="bench-db-")
+    results = {"backend": args.backend, "sizes": {}}
+    try:
+        for size in (int(size) for size in args.sizes.split(",")):
+            print(f"{args.backend} backend, {size:,} users", flush=True)
+            results["sizes"][str(size)] = asyncio.run(bench_size(args.backend, size, args.min_time, workdir))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+        if not compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Compare the memory used by user records stored as dicts and as UserRecords
+(including their rows in the shared column store).
+
+Most users only ever run a command or two, so the generated population is
+mostly such users, with a share of active players who have cooldowns set.
+
+Usage:
+    python benchmarks/bench_records.py [--users 100000] [--active 0.2]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.columns import ColumnStore
+from utils.database import new_user
+from utils.records import UserRecord
+
+def play(user, rng: random.Random, active: bool):
+    """Apply what a casual or active player would have done to a user."""
+    user["games_played"] += 1
+    user["xp"] += 1
+    if rng.random() < 0.5:
+        user["wins"] += 1
+        user["cash"] += 100
+        user["total_cash_won"] += 100
+    else:
+        user["losses"] += 1
+        user["cash"] -= 100
+        user["total_cash_lost"] += 100
+    if active:
+        user["games_played"] += rng.randint(10, 1000)
+        user["xp"] += rng.randint(100, 10_000)
+        user["level"] = user["xp"] // 100
+        user["cooldowns"]["work"] = time.time() + 600
+        user["cooldowns"]["daily"] = time.time() + 86400
+
+def new_record_factory():
+    store = ColumnStore()
+    return lambda user_id: UserRecord(store=store, user_id=user_id)
+
+def measure(make_factory, users: int, active_share: float) -> float:
+    """Return the bytes used per user for records made by the factory from make_factory."""
+    rng = random.Random(0)
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    factory = make_factory()
+    records = {}
+    for index in range(users):
+        user_id = str(100_000_000_000 + index)
+        record = factory(user_id)
+        play(record, rng, rng.random() < active_share)
+        records[user_id] = record
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (after - before) / users
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--active", type=float, default=0.2, help="Share of active players")
+    args = parser.parse_args()
+
+    dict_bytes = measure(lambda: lambda user_id: new_user(), args.users, args.active)
+    record_bytes = measure(new_record_factory, args.users, args.active)
+    print(f"{args.users:,} users, {args.active:.0%} active (bytes per user, including its ID key)")
+    print(f"  dict        {dict_bytes:>8.0f}")
+    print(f"  UserRecord  {record_bytes:>8.0f}  ({1 - record_bytes / dict_bytes:.0%} smaller)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Compare data file formats by encode time, decode time and file size.
+
+"legacy" is the original json.dump(..., indent=2) layout of data.json. The
+other formats are the serializers available for DATA_FORMAT (msgpack is
+skipped when the msgpack package isn't installed).
+
+Usage:
+    python benchmarks/bench_serializers.py [--sizes 10000,100000] [--min-time 1]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from typing import Callable, Dict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.bench_database import format_seconds, generate_data
+from utils.columns import ColumnStore
+from utils.database import _encode
+from utils.records import UserRecord
+from utils.serializers import SERIALIZERS, msgpack, orjson
+
+def measure(func: Callable[[], object], min_time: float) -> float:
+    """Run func repeatedly for at least min_time seconds, returning the mean seconds per call."""
+    iterations = 0
+    start = time.perf_counter()
+    while iterations < 2 or time.perf_counter() - start < min_time:
+        func()
+        iterations += 1
+    return (time.perf_counter() - start) / iterations
+
+def bench_size(size: int, min_time: float) -> Dict[str, Dict[str, float]]:
+    data = generate_data(size)
+    # Encode the records the database holds, not plain dicts
+    store = ColumnStore()
+    data["users"] = {
+        user_id: UserRecord.from_dict(user, store, user_id)
+        for user_id, user in data["users"].items()
+    }
+
+    formats = {"legacy": (
+        lambda: json.dumps(data, indent=2, default=_encode).encode(),
+        json.loads
+    )}
+    for name, serializer in SERIALIZERS.items():
+        if name == "msgpack" and msgpack is None:
+            continue
+        formats[name] = (
+            lambda serializer=serializer: serializer.dumps(data, default=_encode),
+            serializer.loads
+        )
+
+    results = {}
+    for name, (dumps, loads) in formats.items():
+        encoded = dumps()
+        results[name] = {
+            "encode": measure(dumps, min_time),
+            "decode": measure(lambda: loads(encoded), min_time),
+            "bytes": len(encoded)
+        }
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10000,100000", help="Comma separated user counts")
+    parser.add_argument("--min-time", type=float, default=1, help="Minimum seconds to run each measurement")
+    args = parser.parse_args()
+
+    print(f"orjson: {'yes' if orjson else 'no'}, msgpack: {'yes' if msgpack else 'no'}")
+    for size in (int(size) for size in args.sizes.split(",")):
+        print(f"{size:,} users")
+        print(f"  {'format':<8} {'encode':>10} {'decode':>10} {'size':>14}")
+        for name, stats in bench_size(size, args.min_time).items():
+            print(
+                f"  {name:<8} {format_seconds(stats['encode']):>10} {format_seconds(stats['decode']):>10} "
+                f"{stats['bytes']:>12,} B"
+            )
+
+if __name__ == "__main__":
+    main()
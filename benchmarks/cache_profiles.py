@@ -0,0 +1,118 @@
+"""
+Compare the memory and startup cost of the gateway cache profiles.
+
+Builds the guild and member caches the way discord.py does from synthetic
+GUILD_CREATE and GUILD_MEMBERS_CHUNK payloads, without connecting to Discord.
+
+Usage:
+    python benchmarks/cache_profiles.py [--guilds 100] [--members 5000]
+"""
+import os
+import sys
+import time
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import discord
+from discord.member import Member
+from bot import cache_profile
+
+# Discord allows 120 gateway commands per minute, and chunking sends one per guild
+GATEWAY_COMMANDS_PER_SECOND = 2
+
+def member_payload(user_id: int):
+    return {
+        "user": {
+            "id": str(user_id),
+            "username": f"user{user_id}",
+            "discriminator": "0",
+            "global_name": None,
+            "avatar": None
+        },
+        "roles": [],
+        "joined_at": "2024-01-01T00:00:00+00:00",
+        "deaf": False,
+        "mute": False,
+        "flags": 0
+    }
+
+def guild_payload(guild_id: int, member_count: int):
+    return {
+        "id": str(guild_id),
+        "name": f"Guild {guild_id}",
+        "member_count": member_count,
+        "large": member_count > 250,
+        "members": [],
+        "channels": [],
+        "roles": [{
+            "id": str(guild_id),
+            "name": "@everyone",
+            "permissions": "0",
+            "position": 0,
+            "color": 0,
+            "hoist": False,
+            "managed": False,
+            "mentionable": False
+        }],
+        "emojis": [],
+        "stickers": [],
+        "features": []
+    }
+
+def measure(profile: str, guilds: int, members: int):
+    options = cache_profile(profile)
+    client = discord.Client(**options)
+    state = client._connection
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    chunked = 0
+
+    for guild_index in range(guilds):
+        guild_id = 10_000_000 + guild_index
+        guild = state._add_guild_from_data(guild_payload(guild_id, members))
+
+        if state._guild_needs_chunking(guild):
+            # The gateway would send every member in GUILD_MEMBERS_CHUNK events
+            chunked += 1
+            base = guild_id * 100_000
+            for member_index in range(members):
+                member = Member(data=member_payload(base + member_index), guild=guild, state=state)
+                if state.member_cache_flags.joined:
+                    guild._add_member(member)
+
+    elapsed = time.perf_counter() - start
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    cached_members = sum(len(guild._members) for guild in state._guilds.values())
+    return {
+        "profile": profile,
+        "memory_mb": current / 1_000_000,
+        "build_seconds": elapsed,
+        "cached_members": cached_members,
+        "chunk_requests": chunked,
+        "min_chunk_seconds": chunked / GATEWAY_COMMANDS_PER_SECOND,
+        "max_messages": options["max_messages"] or 0
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--guilds", type=int, default=100)
+    parser.add_argument("--members", type=int, default=5000, help="Members per guild")
+    args = parser.parse_args()
+
+    print(f"{args.guilds} guilds x {args.members} members")
+    print(f"{'profile':<10} {'memory':>10} {'build':>9} {'members':>10} {'chunks':>7} {'chunk wait':>11} {'msg cache':>10}")
+    for profile in ("minimal", "standard", "full"):
+        result = measure(profile, args.guilds, args.members)
+        print(
+            f"{result['profile']:<10} {result['memory_mb']:>8.1f}MB {result['build_seconds']:>8.2f}s "
+            f"{result['cached_members']:>10,} {result['chunk_requests']:>7} "
+            f"{result['min_chunk_seconds']:>10.0f}s {result['max_messages']:>10}"
+        )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,307 @@
+"""
+Synthetic load generator for the bot's commands.
+
+Drives the cog command callbacks with fake interactions (no Discord
+connection) at a configurable concurrency and user population, and reports
+throughput and latency percentiles per command. Discord's HTTP round trip is
+simulated with a fixed delay.
+
+Usage:
+    python benchmarks/loadgen.py [--users 1000] [--concurrency 50] [--duration 10]
+        [--mix coinflip=40,slots=30,blackjack=10,work=10,daily=5,leaderboard=5]
+        [--rtt 50] [--guilds 0] [--server-economies] [--json results.json]
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+from contextvars import ContextVar
+from itertools import count
+from typing import Any, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DEFAULT_MIX = "coinflip=40,slots=30,blackjack=10,work=10,daily=5,leaderboard=5"
+
+_ids = count(1)
+
+# The fake interaction being handled by the current task
+current_interaction: ContextVar["FakeInteraction"] = ContextVar("current_interaction")
+
+class FakeAsset:
+    url = "https://cdn.discordapp.com/embed/avatars/0.png"
+
+class FakeUser:
+    def __init__(self, user_id: int):
+        self.id = user_id
+        self.name = f"user{user_id}"
+        self.display_name = self.name
+        self.display_avatar = FakeAsset()
+
+class FakeMessage:
+    def __init__(self, rtt: float):
+        self.id = next(_ids)
+        self.rtt = rtt
+
+    async def edit(self, **kwargs):
+        await asyncio.sleep(self.rtt)
+
+class FakeCallbackResponse:
+    def __init__(self, message: FakeMessage):
+        self.resource = message
+
+class FakeResponse:
+    """Stands in for discord.InteractionResponse, counting HTTP requests."""
+
+    def __init__(self, interaction: "FakeInteraction"):
+        self.interaction = interaction
+        self._done = False
+
+    def is_done(self) -> bool:
+        return self._done
+
+    async def _respond(self):
+        if self._done:
+            raise RuntimeError("This interaction has already been responded to before")
+        self._done = True
+        self.interaction.root.http_requests += 1
+        await asyncio.sleep(self.interaction.rtt)
+
+    async def defer(self, **kwargs):
+        await self._respond()
+
+    async def send_message(self, *args, **kwargs):
+        await self._respond()
+        message = FakeMessage(self.interaction.rtt)
+        self.interaction.last_message = message
+        return FakeCallbackResponse(message)
+
+    async def edit_message(self, **kwargs):
+        await self._respond()
+
+class FakeFollowup:
+    def __init__(self, interaction: "FakeInteraction"):
+        self.interaction = interaction
+
+    async def send(self, *args, **kwargs):
+        self.interaction.root.http_requests += 1
+        await asyncio.sleep(self.interaction.rtt)
+        message = FakeMessage(self.interaction.rtt)
+        self.interaction.last_message = message
+        return message
+
+class FakeInteraction:
+    """Stands in for discord.Interaction."""
+
+    def __init__(
+        self,
+        user: FakeUser,
+        rtt: float,
+        data: Dict[str, Any] = None,
+        message: FakeMessage = None,
+        parent: "FakeInteraction" = None,
+        guild_id: int = None
+    ):
+        self.id = next(_ids)
+        # Requests made for button clicks count towards the command that sent the buttons
+        self.root = parent.root if parent else self
+        self.user = user
+        self.rtt = rtt
+        self.data = data or {}
+        self.message = message
+        self.guild_id = parent.guild_id if parent else guild_id
+        self.extras: Dict[Any, Any] = {}
+        self.http_requests = 0
+        self.last_message = None
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
+
+class FakeBot:
+    """Stands in for the bot, answering blackjack buttons with hit or stand."""
+
+    def __init__(self, rtt: float):
+        self.rtt = rtt
+        self.users: Dict[int, FakeUser] = {}
+
+    async def wait_for(self, event: str, check=None, timeout: float = None):
+        interaction = current_interaction.get()
+        # A player takes a moment to click
+        await asyncio.sleep(self.rtt)
+        button = FakeInteraction(
+            interaction.user,
+            self.rtt,
+            data={"custom_id": random.choice(["hit", "stand", "stand"])},
+            message=interaction.last_message,
+            parent=interaction
+        )
+        if check is not None and not check(button):
+            raise asyncio.TimeoutError()
+        return button
+
+    async def fetch_user(self, user_id: int):
+        await asyncio.sleep(self.rtt)
+        return self.users.setdefault(user_id, FakeUser(user_id))
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def build_commands(bot: FakeBot):
+    """Map command names to coroutines taking a fake interaction."""
+    from cogs.economy import Economy
+    from cogs.games import Games
+    from cogs.profile import Profile
+
+    games = Games(bot)
+    economy = Economy(bot)
+    profile = Profile(bot)
+
+    return {
+        "coinflip": lambda i: games.coinflip.callback(games, i, random.choice(["heads", "tails"]), "100", False),
+        "slots": lambda i: games.slots.callback(games, i, "100"),
+        "blackjack": lambda i: games.blackjack.callback(games, i, "100", False, False),
+        "work": lambda i: economy.work.callback(economy, i, False),
+        "daily": lambda i: economy.daily.callback(economy, i, False),
+        "leaderboard": lambda i: profile.leaderboard.callback(profile, i, "cash", False),
+    }
+
+async def run(args) -> Dict[str, Any]:
+    from utils.database import db
+    from utils.events import bus
+    from utils.guilds import guild_economies
+    from utils.subscribers import subscribe_defaults
+    await db.wait_until_loaded()
+    # The bot's subscribers, so the side effects of each command are part of the load
+    subscribe_defaults(bus)
+
+    # Each user plays in one guild (or outside guilds without --guilds)
+    guild_ids = [20_000_000 + index for index in range(args.guilds)]
+    if args.server_economies:
+        for guild_id in guild_ids:
+            partition = await guild_economies.partition(guild_id)
+            await partition.set_economy("server")
+
+    rtt = args.rtt / 1000
+    bot = FakeBot(rtt)
+    commands = build_commands(bot)
+
+    mix = {}
+    for part in args.mix.split(","):
+        name, weight = part.split("=")
+        mix[name.strip()] = float(weight)
+    names = list(mix)
+    weights = [mix[name] for name in names]
+
+    users = [FakeUser(10_000_000 + index) for index in range(args.users)]
+    latencies: Dict[str, List[float]] = {name: [] for name in names}
+    http_requests: Dict[str, int] = {name: 0 for name in names}
+    errors: Dict[str, int] = {name: 0 for name in names}
+    deadline = time.perf_counter() + args.duration
+
+    async def worker():
+        while time.perf_counter() < deadline:
+            name = random.choices(names, weights)[0]
+            user = random.choice(users)
+            guild_id = guild_ids[user.id % len(guild_ids)] if guild_ids else None
+            interaction = FakeInteraction(user, rtt, guild_id=guild_id)
+            current_interaction.set(interaction)
+            start = time.perf_counter()
+            try:
+                await commands[name](interaction)
+            except Exception as e:
+                errors[name] += 1
+                if errors[name] == 1:
+                    print(f"{name} failed: {e!r}", file=sys.stderr)
+                continue
+            latencies[name].append(time.perf_counter() - start)
+            http_requests[name] += interaction.http_requests
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - start
+    await bus.flush()
+
+    results = {
+        "users": args.users,
+        "guilds": args.guilds,
+        "concurrency": args.concurrency,
+        "duration": elapsed,
+        "rtt_ms": args.rtt,
+        "commands": {}
+    }
+    for name in names:
+        values = latencies[name]
+        results["commands"][name] = {
+            "count": len(values),
+            "errors": errors[name],
+            "throughput": len(values) / elapsed,
+            "http_per_command": http_requests[name] / len(values) if values else 0.0,
+            "p50_ms": percentile(values, 0.50) * 1000,
+            "p95_ms": percentile(values, 0.95) * 1000,
+            "p99_ms": percentile(values, 0.99) * 1000,
+            "max_ms": max(values, default=0.0) * 1000
+        }
+    all_values = [value for values in latencies.values() for value in values]
+    results["total"] = {
+        "count": len(all_values),
+        "throughput": len(all_values) / elapsed,
+        "p50_ms": percentile(all_values, 0.50) * 1000,
+        "p95_ms": percentile(all_values, 0.95) * 1000,
+        "p99_ms": percentile(all_values, 0.99) * 1000
+    }
+    return results
+
+def print_results(results: Dict[str, Any]):
+    print(
+        f"{results['users']:,} users, concurrency {results['concurrency']}, "
+        f"{results['duration']:.1f}s, simulated RTT {results['rtt_ms']}ms"
+    )
+    print(f"{'command':<12} {'count':>7} {'err':>4} {'ops/s':>8} {'http':>5} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}")
+    for name, stats in results["commands"].items():
+        print(
+            f"{name:<12} {stats['count']:>7} {stats['errors']:>4} {stats['throughput']:>8.1f} "
+            f"{stats['http_per_command']:>5.1f} {stats['p50_ms']:>6.1f}ms {stats['p95_ms']:>6.1f}ms "
+            f"{stats['p99_ms']:>6.1f}ms {stats['max_ms']:>6.1f}ms"
+        )
+    total = results["total"]
+    print(
+        f"{'total':<12} {total['count']:>7} {'':>4} {total['throughput']:>8.1f} {'':>5} "
+        f"{total['p50_ms']:>6.1f}ms {total['p95_ms']:>6.1f}ms {total['p99_ms']:>6.1f}ms"
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000, help="Size of the simulated user population")
+    parser.add_argument("--concurrency", type=int, default=50, help="Commands in flight at once")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds to run for")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Command weights")
+    parser.add_argument("--rtt", type=float, default=50, help="Simulated Discord HTTP round trip in ms")
+    parser.add_argument("--guilds", type=int, default=0, help="Spread the users over this many guilds")
+    parser.add_argument("--server-economies", action="store_true", help="Give every guild its own economy")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-file", help="Data file to use (default: a fresh temporary file)")
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    # Must be set before the database, ledger and statistics are imported
+    directory = tempfile.mkdtemp()
+    os.environ["DATABASE_FILE"] = args.data_file or os.path.join(directory, "loadgen.json")
+    os.environ["LEDGER_FILE"] = os.path.join(directory, "ledger.sqlite3")
+    os.environ["TIMESERIES_FILE"] = os.path.join(directory, "timeseries.sqlite3")
+    os.environ["GUILD_DATA_DIR"] = os.path.join(directory, "guilds")
+
+    results = asyncio.run(run(args))
+    print_results(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,215 @@
 import os
+import json
+import math
+import time
+import hashlib
 import logging
 import asyncio
+import aiohttp
 import discord
+from discord import app_commands
 from discord.ext import commands
 import traceback
+from typing import Any, Coroutine, Dict, List, Optional, Set
+from utils.database import db
+from utils.guilds import guild_economies
+from utils.ledger import ledger
+from utils.progression import LevelUp
+from utils.events import bus
+from utils.rest_scheduler import rest
+from utils.responder import cancel_defer
+from utils.subscribers import subscribe_defaults
+from utils.timeseries import timeseries
+from utils.loop_monitor import LoopMonitor
+from utils.profiling import InteractionProfiler, record_span
+from utils.metrics import CommandTimer, add_phase_time, counter, current_command, histogram
 
 logger = logging.getLogger(__name__)
 
-class RocketGamblingBot(commands.Bot):
-    def __init__(self):
+APP_COMMAND_SECONDS = histogram(
+    "app_command_seconds",
+    "Time taken by app commands: total, and time spent in db, respond (defer or initial message), send (followups) and rest",
+    ["command", "phase"]
+)
+APP_COMMANDS_TOTAL = counter("app_commands_total", "App commands run, by outcome", ["command", "outcome"])
+DISCORD_HTTP_SECONDS = histogram("discord_http_request_seconds", "Time taken by HTTP requests to Discord", ["kind"])
+
+# Command phase that each kind of Discord HTTP request counts towards
+HTTP_PHASES = {
+    "interaction_response": "respond",
+    "webhook": "send",
+    "rest": "rest"
+}
+
+def _http_kind(path: str) -> str:
+    if "/interactions/" in path:
+        return "interaction_response"
+    if "/webhooks/" in path:
+        return "webhook"
+    return "rest"
+
+def create_http_trace() -> aiohttp.TraceConfig:
+    """
+    Create an aiohttp trace that times every request to Discord.
+    
+    This covers interaction responses and followups too, which don't go through
+    the bot's HTTPClient but share its session.
+    """
+    trace = aiohttp.TraceConfig()
+    
+    async def on_request_start(session, context, params):
+        context.start = time.perf_counter()
+    
+    async def on_request_done(session, context, params):
+        end = time.perf_counter()
+        elapsed = end - context.start
+        kind = _http_kind(params.url.path)
+        DISCORD_HTTP_SECONDS.observe(elapsed, kind)
+        add_phase_time(HTTP_PHASES[kind], elapsed)
+        record_span(f"http.{kind}", context.start, end)
+    
+    trace.on_request_start.append(on_request_start)
+    trace.on_request_end.append(on_request_done)
+    trace.on_request_exception.append(on_request_done)
+    return trace
+
+def record_command(interaction: discord.Interaction, outcome: str):
+    """Record the latency and outcome of a finished app command."""
+    profile = interaction.extras.pop("profile", None)
+    if profile is not None:
+        interaction.client.profiler.finish(profile, outcome)
+    
+    timer = interaction.extras.pop("timer", None)
+    if timer is None:
+        return
+    APP_COMMANDS_TOTAL.inc(timer.command, outcome)
+    APP_COMMAND_SECONDS.observe(timer.elapsed(), timer.command, "total")
+    for phase, seconds in timer.phases.items():
+        APP_COMMAND_SECONDS.observe(seconds, timer.command, phase)
+
+class InstrumentedCommandTree(app_commands.CommandTree):
+    """Command tree that times every app command."""
+    
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        command = interaction.command
+        timer = CommandTimer(command.qualified_name if command else "unknown")
+        interaction.extras["timer"] = timer
+        # The command runs in this task, so database and HTTP time is added to this timer
+        current_command.set(timer)
+        
+        profiler = self.client.profiler
+        if profiler.enabled and profiler.should_profile(timer.command):
+            interaction.extras["profile"] = profiler.start(timer.command, interaction.id)
+        return True
+    
+    async def on_error(self, interaction: discord.Interaction, error: app_commands.AppCommandError):
+        # Deferring now would leave the user looking at "thinking..." until the interaction expires
+        cancel_defer(interaction)
+        record_command(interaction, "error")
+        await super().on_error(interaction, error)
+
+def parse_shard_ids(value: str) -> List[int]:
+    """
+    Parse a shard ID specification such as "0,1,2" or "0-3".
+    
+    Args:
+        value: Comma separated shard IDs and/or inclusive ranges
+    
+    Returns:
+        A sorted list of unique shard IDs
+    """
+    shard_ids = set()
+    for part in value.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            start, end = part.split('-', 1)
+            shard_ids.update(range(int(start), int(end) + 1))
+        else:
+            shard_ids.add(int(part))
+    return sorted(shard_ids)
+
+def cache_profile(name: str) -> Dict[str, Any]:
+    """
+    Get the gateway intents and cache settings for a cache profile.
+    
+    Profiles:
+        minimal: Guilds only, no member or message cache (enough for slash commands)
+        standard: Default non-privileged intents without member chunking
+        full: Privileged member and message content intents with full member chunking
+    
+    Args:
+        name: The name of the profile
+    
+    Returns:
+        Keyword arguments for the bot's constructor
+    """
+    if name == "full":
         intents = discord.Intents.default()
         intents.message_content = True
         intents.members = True
+        return {
+            "intents": intents,
+            "member_cache_flags": discord.MemberCacheFlags.from_intents(intents),
+            "chunk_guilds_at_startup": True,
+            "max_messages": 1000
+        }
+    
+    if name == "standard":
+        intents = discord.Intents.default()
+        return {
+            "intents": intents,
+            "member_cache_flags": discord.MemberCacheFlags.from_intents(intents),
+            "chunk_guilds_at_startup": False,
+            "max_messages": 1000
+        }
+    
+    if name != "minimal":
+        logger.warning(f"Unknown cache profile '{name}', using minimal")
+    
+    # Every command is a slash command, so the bot only needs to know which guilds it is in
+    return {
+        "intents": discord.Intents(guilds=True),
+        "member_cache_flags": discord.MemberCacheFlags.none(),
+        "chunk_guilds_at_startup": False,
+        "max_messages": None
+    }
+
+def cache_options() -> Dict[str, Any]:
+    """
+    Get the cache settings configured in the environment.
+    
+    Environment variables:
+        CACHE_PROFILE: "minimal" (default), "standard" or "full"
+        MAX_MESSAGES: Override the message cache size (0 disables it)
+        CHUNK_GUILDS_AT_STARTUP: Override member chunking ("true" or "false")
+    """
+    options = cache_profile(os.getenv("CACHE_PROFILE", "minimal").lower())
+    
+    max_messages = os.getenv("MAX_MESSAGES")
+    if max_messages is not None:
+        options["max_messages"] = int(max_messages) or None
+    
+    chunk_guilds = os.getenv("CHUNK_GUILDS_AT_STARTUP")
+    if chunk_guilds is not None:
+        options["chunk_guilds_at_startup"] = chunk_guilds.lower() in ("1", "true", "yes")
+    
+    return options
+
+class RocketGamblingBot(commands.Bot):
+    def __init__(self, **options):
+        for key, value in cache_options().items():
+            options.setdefault(key, value)
         
-        # Initialize the bot with slash commands enabled and proper intents
+        # Initialize the bot with slash commands enabled and the configured cache profile
         super().__init__(
             command_prefix=commands.when_mentioned,
-            intents=intents,
             help_command=None,  # We'll implement our own help command
-            description="Rocket Gambling Bot - Play games, win cash, get to the top of the leaderboards!"
+            tree_cls=InstrumentedCommandTree,
+            http_trace=create_http_trace(),
+            description="Rocket Gambling Bot - Play games, win cash, get to the top of the leaderboards!",
+            **options
         )
         
         self.logger = logging.getLogger('bot')
@@ -30,48 +221,293 @@ class RocketGamblingBot(commands.Bot):
             'cogs.profile',
             'cogs.help'
         ]
+        
+        # Time taken by each startup phase, in seconds
+        self._startup_started = time.perf_counter()
+        self.startup_timings: Dict[str, float] = {}
+        
+        # Tasks started by the bot itself, cancelled on close
+        self._background_tasks: Set[asyncio.Task] = set()
+        
+        # Event loop lag monitoring (LOOP_MONITOR=0 disables it)
+        self.loop_monitor: Optional[LoopMonitor] = None
+        if os.getenv("LOOP_MONITOR", "1").lower() not in ("0", "false", "no"):
+            self.loop_monitor = LoopMonitor(threshold=float(os.getenv("LOOP_LAG_THRESHOLD", 0.25)))
+        
+        # Sampled profiling of app commands (see InteractionProfiler)
+        self.profiler = InteractionProfiler.from_env()
+        
+        # Seconds between data compactions (COMPACTION_INTERVAL=0 disables them)
+        self.compaction_interval = float(os.getenv("COMPACTION_INTERVAL", 86400))
+        
+        # Application command sync state
+        self._commands_synced = False
+        self.command_sync_file = os.getenv("COMMAND_SYNC_FILE", ".command_sync.json")
+        dev_guild_id = os.getenv("DEV_GUILD_ID")
+        self.dev_guild = discord.Object(id=int(dev_guild_id)) if dev_guild_id else None
+    
+    async def login(self, token: str):
+        """Log in to Discord, recording how long it took."""
+        start = time.perf_counter()
+        await super().login(token)
+        self.startup_timings["login"] = time.perf_counter() - start
     
     async def setup_hook(self):
         """Setup hook that runs before the bot starts."""
+        if self.loop_monitor:
+            self.loop_monitor.start()
+        
+        # The data file keeps loading in the background while we connect to the gateway
+        db.start_loading()
+        self._start_background(self._record_data_load())
+        if self.compaction_interval > 0 and hasattr(db, "compact"):
+            self._start_background(self._compact_periodically())
+        
+        subscribe_defaults(bus)
+        bus.subscribe(self._announce_level_ups, LevelUp)
+        
         self.logger.info("Loading extensions...")
-        for extension in self.initial_extensions:
+        start = time.perf_counter()
+        await asyncio.gather(*(self._load_extension(extension) for extension in self.initial_extensions))
+        self.startup_timings["extensions"] = time.perf_counter() - start
+    
+    async def close(self):
+        """Stop background monitoring, finish pending saves and close the bot."""
+        if self.loop_monitor:
+            self.loop_monitor.stop()
+        tasks = list(self._background_tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        try:
+            # Deliver the waiting events first, their subscribers write to the stores below.
+            # A store that fails to save mustn't stop the others from saving.
+            for name, flush in (
+                ("events", bus.flush),
+                ("user data", db.flush),
+                ("guild data", guild_economies.flush),
+                ("ledger", ledger.flush),
+                ("gameplay statistics", timeseries.flush)
+            ):
+                try:
+                    await flush()
+                except Exception as e:
+                    self.logger.error(f"Failed to save {name} on close: {e}")
+        finally:
+            await super().close()
+    
+    async def _load_extension(self, extension: str):
+        start = time.perf_counter()
+        try:
+            await self.load_extension(extension)
+            self.logger.info(f"Loaded extension: {extension} ({(time.perf_counter() - start) * 1000:.1f}ms)")
+        except Exception as e:
+            self.logger.error(f"Failed to load extension {extension}: {e}")
+            traceback.print_exc()
+    
+    def _start_background(self, coro: Coroutine) -> asyncio.Task:
+        """Run a coroutine in a task that is kept until it finishes and cancelled on close."""
+        task = asyncio.create_task(coro)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+        return task
+    
+    async def _record_data_load(self):
+        try:
+            await db.wait_until_loaded()
+        except RuntimeError:
+            # Already logged by the database, and every command that uses it reports the error
+            return
+        self.startup_timings["data_load"] = db.load_seconds
+        self.startup_timings["data_ready"] = time.perf_counter() - self._startup_started
+    
+    async def _compact_periodically(self):
+        """Archive idle users and drop expired cooldowns every compaction_interval seconds."""
+        while not self.is_closed():
+            await asyncio.sleep(self.compaction_interval)
+            # Interrupting a compaction could archive users without removing them, so close() waits for it
+            compaction = asyncio.ensure_future(self._compact())
             try:
-                await self.load_extension(extension)
-                self.logger.info(f"Loaded extension: {extension}")
-            except Exception as e:
-                self.logger.error(f"Failed to load extension {extension}: {e}")
-                traceback.print_exc()
+                await asyncio.shield(compaction)
+            except asyncio.CancelledError:
+                await compaction
+                raise
+    
+    async def _compact(self):
+        try:
+            await db.compact()
+            await guild_economies.compact()
+        except Exception as e:
+            self.logger.error(f"Error compacting data: {e}")
+    
+    async def _announce_level_ups(self, level_ups: List[LevelUp]):
+        """Queue each level-up for its guild's level-up channel, where queued ones are posted together."""
+        for level_up in level_ups:
+            if level_up.guild_id is None:
+                continue
+            partition = await guild_economies.partition(level_up.guild_id)
+            channel_id = partition.settings.get("level_up_channel")
+            if not channel_id:
+                continue
+            channel_id = int(channel_id)
+            rest.submit_batched(
+                ("level_ups", channel_id),
+                f"🎉 <@{level_up.user_id}> reached level {level_up.new_level}!",
+                lambda lines, channel_id=channel_id: self._send_level_ups(channel_id, lines),
+                bucket=("channel_messages", channel_id)
+            )
+    
+    async def _send_level_ups(self, channel_id: int, lines: List[str]):
+        # A partial channel needs no cache, which may be disabled
+        await self.get_partial_messageable(channel_id).send(
+            "\n".join(lines)[:2000],
+            allowed_mentions=discord.AllowedMentions.none()
+        )
     
     async def on_ready(self):
         """Event triggered when the bot is ready."""
         if self.user:
+            if "ready" not in self.startup_timings:
+                self.startup_timings["ready"] = time.perf_counter() - self._startup_started
+                phases = ", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in self.startup_timings.items())
+                self.logger.info(f"Startup timings: {phases}")
+            
             self.logger.info(f"Logged in as {self.user} (ID: {self.user.id})")
             self.logger.info(f"Connected to {len(self.guilds)} guilds")
             await self.change_presence(activity=discord.Game(name="/help for commands"))
             
-            # Sync slash commands with Discord (with rate limit handling)
-            self.logger.info("Syncing application commands...")
-            try:
-                # Try to sync, catch rate limits
-                try:
-                    await self.tree.sync()
-                except discord.HTTPException as e:
-                    # Check if this is a rate limit error (code 429)
-                    if hasattr(e, 'code') and e.code == 429 and hasattr(e, 'retry_after'):
-                        wait_time = getattr(e, 'retry_after', 30)  # Default to 30 seconds if retry_after not available
-                        self.logger.warning(f"Rate limited, waiting {wait_time:.2f} seconds")
-                        await asyncio.sleep(wait_time + 1.0)
-                        # Try again with a more conservative approach
-                        await self.tree.sync()
-                    else:
-                        raise
-                
-                self.logger.info("Application commands synced!")
-            except Exception as e:
-                self.logger.error(f"Failed to sync application commands: {e}")
+            # on_ready also fires after reconnects, but commands only need syncing once
+            # (the flag is set while syncing so a reconnect meanwhile doesn't sync too)
+            if not self._commands_synced:
+                self._commands_synced = True
+                self._commands_synced = await self.sync_commands()
         else:
             self.logger.error("Bot user is None in on_ready, something went wrong with login")
     
+    async def on_guild_remove(self, guild: discord.Guild):
+        """Save and unload the guild's data when the bot leaves a guild."""
+        await guild_economies.unload(guild.id)
+    
+    async def on_app_command_completion(self, interaction: discord.Interaction, command):
+        """Event triggered when an app command finishes without errors."""
+        cancel_defer(interaction)
+        record_command(interaction, "success")
+    
+    def command_tree_hash(self, guild: Optional[discord.abc.Snowflake] = None) -> str:
+        """
+        Hash the local application command tree.
+        
+        Args:
+            guild: Hash the commands for this guild instead of the global commands
+        
+        Returns:
+            A hex digest that changes whenever a command, option or description changes
+        """
+        payload = sorted(
+            (command.to_dict(self.tree) for command in self.tree.get_commands(guild=guild)),
+            key=lambda command: (command.get("type", 1), command["name"])
+        )
+        encoded = json.dumps(payload, sort_keys=True, default=str).encode()
+        return hashlib.sha256(encoded).hexdigest()
+    
+    def _load_sync_state(self) -> Dict[str, str]:
+        try:
+            with open(self.command_sync_file, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+    
+    def _save_sync_state(self, state: Dict[str, str]):
+        try:
+            with open(self.command_sync_file, 'w') as f:
+                json.dump(state, f, indent=2)
+        except OSError as e:
+            self.logger.error(f"Failed to save command sync state: {e}")
+    
+    async def sync_commands(self, force: bool = False) -> bool:
+        """
+        Sync application commands with Discord if they changed since the last sync.
+        
+        When DEV_GUILD_ID is set, the commands are synced to that guild only, which
+        Discord applies instantly.
+        
+        Args:
+            force: Sync even if the command tree hash is unchanged
+        
+        Returns:
+            False if the sync failed, so it can be retried
+        """
+        force = force or os.getenv("FORCE_COMMAND_SYNC", "").lower() in ("1", "true", "yes")
+        
+        if self.dev_guild:
+            self.tree.copy_global_to(guild=self.dev_guild)
+            scope = f"{self.application_id}:guild:{self.dev_guild.id}"
+        else:
+            scope = f"{self.application_id}:global"
+        
+        state = self._load_sync_state()
+        tree_hash = self.command_tree_hash(guild=self.dev_guild)
+        if not force and state.get(scope) == tree_hash:
+            self.logger.info("Application commands unchanged, skipping sync")
+            return True
+        
+        # Sync slash commands with Discord (with rate limit handling)
+        self.logger.info("Syncing application commands...")
+        try:
+            # Try to sync, catch rate limits
+            try:
+                await self.tree.sync(guild=self.dev_guild)
+            except discord.HTTPException as e:
+                # Check if this is a rate limit error (code 429)
+                if hasattr(e, 'code') and e.code == 429 and hasattr(e, 'retry_after'):
+                    wait_time = getattr(e, 'retry_after', 30)  # Default to 30 seconds if retry_after not available
+                    self.logger.warning(f"Rate limited, waiting {wait_time:.2f} seconds")
+                    await asyncio.sleep(wait_time + 1.0)
+                    # Try again with a more conservative approach
+                    await self.tree.sync(guild=self.dev_guild)
+                else:
+                    raise
+            
+            state[scope] = tree_hash
+            self._save_sync_state(state)
+            self.logger.info("Application commands synced!")
+            return True
+        except Exception as e:
+            self.logger.error(f"Failed to sync application commands: {e}")
+            return False
+    
+    def shard_status(self) -> List[Dict[str, Any]]:
+        """
+        Get the latency and guild count of every shard run by this process.
+        
+        Returns:
+            One entry per shard with its ID, latency in milliseconds and guild count
+        """
+        guild_counts: Dict[int, int] = {}
+        for guild in self.guilds:
+            guild_counts[guild.shard_id] = guild_counts.get(guild.shard_id, 0) + 1
+        
+        shards = getattr(self, 'shards', None)
+        if shards is None:
+            # Single gateway connection
+            shard_id = self.shard_id or 0
+            return [{
+                "id": shard_id,
+                "latency_ms": _latency_ms(self.latency),
+                "guilds": guild_counts.get(shard_id, 0),
+                "closed": self.is_closed()
+            }]
+        
+        return [
+            {
+                "id": shard_id,
+                "latency_ms": _latency_ms(shard.latency),
+                "guilds": guild_counts.get(shard_id, 0),
+                "closed": shard.is_closed()
+            }
+            for shard_id, shard in sorted(shards.items())
+        ]
+    
     async def on_error(self, event_method, *args, **kwargs):
         """Global error handler for bot events."""
         self.logger.error(f"Error in {event_method}: {traceback.format_exc()}")
@@ -95,3 +531,45 @@ class RocketGamblingBot(commands.Bot):
         
         self.logger.error(f"Command error in {ctx.command}: {error}")
         await ctx.send("An error occurred while executing the command.")
+
+
+class ShardedRocketGamblingBot(RocketGamblingBot, commands.AutoShardedBot):
+    """Rocket Gambling Bot running one gateway connection per shard."""
+    
+    async def on_shard_ready(self, shard_id: int):
+        """Event triggered when a single shard is ready."""
+        self.logger.info(f"Shard {shard_id} ready")
+
+def _latency_ms(latency: float) -> Optional[float]:
+    """Convert a gateway latency in seconds to milliseconds, or None if unknown."""
+    if latency is None or not math.isfinite(latency):
+        return None
+    return round(latency * 1000, 2)
+
+def create_bot() -> RocketGamblingBot:
+    """
+    Create the bot, using sharding if it is enabled in the environment.
+    
+    Environment variables:
+        SHARDING: Set to "auto" to let Discord decide the shard count
+        SHARD_COUNT: Total number of shards across all processes
+        SHARD_IDS: Shards run by this process, e.g. "0,1" or "0-3" (default: all)
+    
+    Returns:
+        A RocketGamblingBot, or a ShardedRocketGamblingBot when sharding is enabled
+    """
+    shard_count = os.getenv("SHARD_COUNT")
+    shard_ids = os.getenv("SHARD_IDS")
+    
+    if shard_count:
+        options: Dict[str, Any] = {"shard_count": int(shard_count)}
+        if shard_ids:
+            options["shard_ids"] = parse_shard_ids(shard_ids)
+        logger.info(f"Starting with {shard_count} shards (running: {options.get('shard_ids', 'all')})")
+        return ShardedRocketGamblingBot(**options)
+    
+    if os.getenv("SHARDING", "").lower() == "auto":
+        logger.info("Starting with automatic sharding")
+        return ShardedRocketGamblingBot()
+    
+    return RocketGamblingBot()
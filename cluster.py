@@ -0,0 +1,267 @@
+import os
+import sys
+import json
+import time
+import signal
+import logging
+import threading
+import subprocess
+import urllib.request
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger("cluster")
+
+# How long a bot process must stay up before its restart backoff resets
+STABLE_AFTER = 300
+# Status files older than this are reported as stale
+STATUS_STALE_AFTER = 30
+
+def recommended_shard_count(token: str) -> Optional[int]:
+    """Ask Discord how many shards the bot should use."""
+    request = urllib.request.Request(
+        "https://discord.com/api/v10/gateway/bot",
+        headers={"Authorization": f"Bot {token}", "User-Agent": "RocketGamblingBot (cluster)"}
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return json.load(response)["shards"]
+    except Exception as e:
+        logger.warning(f"Could not fetch recommended shard count: {e}")
+        return None
+
+def split_shards(shard_count: int, clusters: int) -> List[List[int]]:
+    """
+    Split shard IDs into contiguous ranges, one per cluster.
+
+    Args:
+        shard_count: Total number of shards
+        clusters: Number of bot processes
+
+    Returns:
+        A list of shard ID lists (empty clusters are dropped)
+    """
+    per_cluster, remainder = divmod(shard_count, clusters)
+    ranges = []
+    start = 0
+    for cluster_id in range(clusters):
+        size = per_cluster + (1 if cluster_id < remainder else 0)
+        if size:
+            ranges.append(list(range(start, start + size)))
+        start += size
+    return ranges
+
+class ClusterProcess:
+    """A bot process running a range of shards."""
+
+    def __init__(self, cluster_id: int, shard_ids: List[int], shard_count: int, status_dir: str):
+        self.cluster_id = cluster_id
+        self.shard_ids = shard_ids
+        self.shard_count = shard_count
+        self.status_file = os.path.join(status_dir, f"cluster-{cluster_id}.json")
+        self.process: Optional[subprocess.Popen] = None
+        self.started_at = 0.0
+        self.restarts = 0
+        self.next_start = 0.0
+
+    def start(self):
+        env = dict(os.environ)
+        env.update({
+            "SHARD_COUNT": str(self.shard_count),
+            "SHARD_IDS": ",".join(str(shard_id) for shard_id in self.shard_ids),
+            "CLUSTER_ID": str(self.cluster_id),
+            "CLUSTER_STATUS_FILE": self.status_file,
+            "DATABASE_BACKEND": "sqlite"
+        })
+        self.process = subprocess.Popen([sys.executable, "main.py", "bot-only"], env=env)
+        self.started_at = time.time()
+        logger.info(f"Started cluster {self.cluster_id} (PID {self.process.pid}, shards {self.shard_ids})")
+
+    def is_alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def stop(self, timeout: float = 10):
+        if not self.is_alive():
+            return
+        self.process.terminate()
+        try:
+            self.process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+    def read_status(self) -> Optional[Dict[str, Any]]:
+        """Read the last status written by the bot process, if it is recent."""
+        try:
+            with open(self.status_file, 'r') as f:
+                status = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not self.is_alive() or status.get("pid") != self.process.pid:
+            return None
+        if time.time() - status.get("updated_at", 0) > STATUS_STALE_AFTER:
+            status["status"] = "Stale"
+        return status
+
+class ClusterSupervisor:
+    """
+    Runs the bot as several processes, each owning a range of shards.
+
+    Crashed processes are restarted with exponential backoff, and the status of
+    every process is combined for the dashboard.
+    """
+
+    def __init__(self, clusters: int, shard_count: int, status_dir: str = "cluster"):
+        os.makedirs(status_dir, exist_ok=True)
+        self.shard_count = shard_count
+        self.processes = [
+            ClusterProcess(cluster_id, shard_ids, shard_count, status_dir)
+            for cluster_id, shard_ids in enumerate(split_shards(shard_count, clusters))
+        ]
+        self.started_at = time.time()
+        self._stopping = threading.Event()
+
+    def run(self, poll_interval: float = 1.0):
+        """Start every process and restart them when they exit, until stop() is called."""
+        for process in self.processes:
+            process.start()
+
+        while not self._stopping.wait(poll_interval):
+            now = time.time()
+            for process in self.processes:
+                if process.is_alive() or now < process.next_start:
+                    continue
+
+                if process.process is not None and process.next_start <= process.started_at:
+                    # Just noticed the exit, so schedule a restart
+                    if now - process.started_at > STABLE_AFTER:
+                        process.restarts = 0
+                    delay = min(60, 2 ** process.restarts)
+                    process.restarts += 1
+                    process.next_start = now + delay
+                    logger.warning(
+                        f"Cluster {process.cluster_id} exited with code {process.process.returncode}, "
+                        f"restarting in {delay}s"
+                    )
+                    continue
+
+                process.start()
+
+    def stop(self):
+        """Stop supervising and terminate every process."""
+        self._stopping.set()
+        for process in self.processes:
+            process.stop()
+
+    def metrics(self) -> str:
+        """
+        Combine the metrics every process published with its status, for /metrics.
+
+        Each sample has a cluster label. They are as old as the last status
+        (up to a few seconds), and a stopped process's metrics are left out.
+        """
+        # Imported here so the dashboard can be loaded without the supervisor
+        from utils.metrics import render_families
+
+        return render_families(
+            status.get("metrics", [])
+            for status in (process.read_status() or {} for process in self.processes)
+        )
+
+    def status(self) -> Dict[str, Any]:
+        """Combine the status of every process for the dashboard."""
+        # Imported here so the dashboard can be loaded without the supervisor
+        from main import format_uptime
+
+        clusters = []
+        shards = []
+        connected_guilds = 0
+        for process in self.processes:
+            status = process.read_status() or {}
+            connected_guilds += status.get("connected_guilds", 0)
+            for shard in status.get("shards", []):
+                shards.append({**shard, "cluster": process.cluster_id})
+            clusters.append({
+                "id": process.cluster_id,
+                "pid": process.process.pid if process.is_alive() else None,
+                "status": status.get("status", "Starting" if process.is_alive() else "Stopped"),
+                "shard_ids": process.shard_ids,
+                "restarts": process.restarts
+            })
+
+        states = {cluster["status"] for cluster in clusters}
+        if states == {"Running"}:
+            overall = "Running"
+        elif "Running" in states:
+            overall = "Degraded"
+        elif "Starting" in states:
+            overall = "Starting"
+        else:
+            overall = "Stopped"
+
+        return {
+            "status": overall,
+            "connected_guilds": connected_guilds,
+            "uptime": format_uptime(time.time() - self.started_at),
+            "shard_count": self.shard_count,
+            "shards": sorted(shards, key=lambda shard: shard["id"]),
+            "clusters": clusters
+        }
+
+def migrate_json_data(json_file: str, sqlite_file: str):
+    """Copy data.json (in any supported format) into the shared SQLite database the first time the cluster runs."""
+    if os.path.exists(sqlite_file) or not os.path.exists(json_file):
+        return
+    from utils.serializers import load_file
+    from utils.sqlite_store import SQLiteDatabase
+    SQLiteDatabase(sqlite_file).import_data(load_file(json_file))
+
+def main():
+    """
+    Run the bot as a cluster of processes with the dashboard in this process.
+
+    Environment variables:
+        CLUSTERS: Number of bot processes (default: number of CPUs)
+        SHARD_COUNT: Total number of shards (default: Discord's recommendation)
+        DATABASE_FILE: Shared SQLite database (default: data.sqlite3)
+        TIMESERIES_FILE: Shared SQLite file for the gameplay statistics (default: timeseries.sqlite3)
+    """
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    token = os.getenv("DISCORD_TOKEN")
+    if not token:
+        logger.error("No Discord token found. Set the DISCORD_TOKEN environment variable.")
+        sys.exit(1)
+
+    clusters = int(os.getenv("CLUSTERS", os.cpu_count() or 1))
+    shard_count = int(os.getenv("SHARD_COUNT", 0)) or recommended_shard_count(token) or clusters
+
+    # Every bot process shares one SQLite database
+    os.environ.setdefault("DATABASE_FILE", "data.sqlite3")
+    migrate_json_data("data.json", os.environ["DATABASE_FILE"])
+    # Every bot process adds its gameplay statistics to one file, which the dashboard
+    # reads (up to TIMESERIES_FLUSH_INTERVAL behind, since this process has no counters of its own)
+    os.environ["TIMESERIES_FILE"] = os.path.abspath(os.getenv("TIMESERIES_FILE", "timeseries.sqlite3"))
+
+    supervisor = ClusterSupervisor(clusters, shard_count)
+    logger.info(f"Running {shard_count} shards across {len(supervisor.processes)} processes")
+
+    def handle_signal(signum, frame):
+        logger.info("Shutting down cluster...")
+        supervisor.stop()
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+
+    threading.Thread(target=supervisor.run, daemon=True).start()
+
+    # Serve the dashboard from the supervisor, using the shared database
+    os.environ["DATABASE_BACKEND"] = "sqlite"
+    import main as dashboard
+    dashboard.cluster_supervisor = supervisor
+    dashboard.app.run(host="0.0.0.0", port=int(os.getenv("PORT", 8080)))
+
+if __name__ == "__main__":
+    main()
@@ -3,10 +3,14 @@ import logging
 import time
 from discord import app_commands
 from discord.ext import commands
-from typing import Optional
+from typing import Optional, Literal
 from utils.database import db
 from utils.cooldowns import cooldown
 from utils.formatting import format_cash, format_time
+from utils.events import RewardClaimed, bus
+from utils.guilds import guild_economies, ledger_account
+from utils.progression import progression
+from utils.responder import Responder
 
 logger = logging.getLogger(__name__)
 
@@ -22,36 +26,20 @@ class Economy(commands.Cog):
     )
     async def work(self, interaction: discord.Interaction, hidden: bool = False):
         """Work to earn some cash (available every 10 minutes)"""
-        await interaction.response.defer(ephemeral=hidden)
+        respond = Responder(interaction, ephemeral=hidden)
         
         user_id = str(interaction.user.id)
-        user = await db.get_user(user_id)
-        
-        # Calculate earnings based on level
-        base_earnings = 100
-        level_bonus = user['level'] * 50
-        earnings = base_earnings + level_bonus
-        
-        # Update user's cash
-        user['cash'] += earnings
-        user['total_cash_won'] += earnings
-        
-        # Add some XP
-        xp_gained = 5
-        user['xp'] += xp_gained
+        economy = await guild_economies.economy(interaction.guild_id, user_id)
+        user = await economy.get_user(user_id)
         
-        # Check for level up
-        old_level = user['level']
-        new_level = int(user['xp'] / 100)  # Simple level formula: 100 XP per level
-        
-        if new_level > old_level:
-            user['level'] = new_level
-            level_up_message = f"\n🎉 Level up! You are now level {new_level}!"
-        else:
-            level_up_message = ""
+        # Give the cash (based on level) and XP
+        earnings, level_up = progression.reward(user, user_id, "work", interaction.guild_id)
+        level_up_message = f"\n{level_up.message}" if level_up else ""
         
+        balance = user['cash']  # Read before the await, while no other command can have changed it
         # Save user data
-        await db.update_user(user_id, user)
+        await economy.update_user(user_id, user)
+        bus.publish(RewardClaimed(user_id, interaction.guild_id, economy, ledger_account(economy, user_id), "work", earnings, balance))
         
         # Create and send the message
         embed = discord.Embed(
@@ -64,7 +52,7 @@ class Economy(commands.Cog):
         embed.add_field(name="Level", value=f"{user['level']} ({user['xp']} XP)", inline=True)
         embed.set_footer(text="You can work again in 10 minutes")
         
-        await interaction.followup.send(embed=embed, ephemeral=hidden)
+        await respond.send(embed=embed, ephemeral=hidden)
     
     @app_commands.command(name="daily", description="Collect your daily cash reward")
     @app_commands.describe(
@@ -72,36 +60,20 @@ class Economy(commands.Cog):
     )
     async def daily(self, interaction: discord.Interaction, hidden: bool = False):
         """Collect your daily cash reward"""
-        await interaction.response.defer(ephemeral=hidden)
+        respond = Responder(interaction, ephemeral=hidden)
         
         user_id = str(interaction.user.id)
-        user = await db.get_user(user_id)
+        economy = await guild_economies.economy(interaction.guild_id, user_id)
+        user = await economy.get_user(user_id)
         
-        # Calculate earnings based on level
-        base_earnings = 1000
-        level_bonus = user['level'] * 500
-        earnings = base_earnings + level_bonus
-        
-        # Update user's cash
-        user['cash'] += earnings
-        user['total_cash_won'] += earnings
-        
-        # Add some XP
-        xp_gained = 20
-        user['xp'] += xp_gained
-        
-        # Check for level up
-        old_level = user['level']
-        new_level = int(user['xp'] / 100)  # Simple level formula: 100 XP per level
-        
-        if new_level > old_level:
-            user['level'] = new_level
-            level_up_message = f"\n🎉 Level up! You are now level {new_level}!"
-        else:
-            level_up_message = ""
+        # Give the cash (based on level) and XP
+        earnings, level_up = progression.reward(user, user_id, "daily", interaction.guild_id)
+        level_up_message = f"\n{level_up.message}" if level_up else ""
         
+        balance = user['cash']
         # Save user data
-        await db.update_user(user_id, user)
+        await economy.update_user(user_id, user)
+        bus.publish(RewardClaimed(user_id, interaction.guild_id, economy, ledger_account(economy, user_id), "daily", earnings, balance))
         
         # Create and send the message
         embed = discord.Embed(
@@ -114,7 +86,7 @@ class Economy(commands.Cog):
         embed.add_field(name="Level", value=f"{user['level']} ({user['xp']} XP)", inline=True)
         embed.set_footer(text="You can collect your daily reward again tomorrow")
         
-        await interaction.followup.send(embed=embed, ephemeral=hidden)
+        await respond.send(embed=embed, ephemeral=hidden)
     
     @app_commands.command(name="vote", description="Vote for the bot to earn cash and credit")
     async def vote(self, interaction: discord.Interaction):
@@ -172,7 +144,7 @@ class Economy(commands.Cog):
     )
     async def cooldowns(self, interaction: discord.Interaction, hidden: bool = True):
         """Check when your commands will be available again"""
-        await interaction.response.defer(ephemeral=hidden)
+        respond = Responder(interaction, ephemeral=hidden)
         
         user_id = str(interaction.user.id)
         cooldowns = await db.get_all_cooldowns(user_id)
@@ -198,7 +170,47 @@ class Economy(commands.Cog):
                 
                 embed.add_field(name=f"/{command}", value=status, inline=True)
         
-        await interaction.followup.send(embed=embed, ephemeral=hidden)
+        await respond.send(embed=embed, ephemeral=hidden)
+    
+    @app_commands.command(name="servereconomy", description="Choose whether this server uses the global economy or its own")
+    @app_commands.describe(
+        mode="global: share cash and levels with every server, server: separate cash and levels for this server"
+    )
+    @app_commands.guild_only()
+    @app_commands.default_permissions(manage_guild=True)
+    async def servereconomy(self, interaction: discord.Interaction, mode: Literal["global", "server"]):
+        """Switch this server between the global economy and its own economy"""
+        respond = Responder(interaction, ephemeral=True)
+        
+        partition = await guild_economies.partition(interaction.guild_id)
+        await partition.set_economy(mode)
+        
+        if mode == "server":
+            message = "This server now has its own economy. Everyone starts with fresh cash, levels and stats here."
+        else:
+            message = "This server now uses the global economy. Server economy progress is kept in case you switch back."
+        
+        await respond.send(message, ephemeral=True)
+    
+    @app_commands.command(name="levelupchannel", description="Choose a channel where level-ups in this server are announced")
+    @app_commands.describe(
+        channel="The channel to announce level-ups in (leave empty to stop announcing)"
+    )
+    @app_commands.guild_only()
+    @app_commands.default_permissions(manage_guild=True)
+    async def levelupchannel(self, interaction: discord.Interaction, channel: Optional[discord.TextChannel] = None):
+        """Choose where level-ups in this server are announced"""
+        respond = Responder(interaction, ephemeral=True)
+        
+        partition = await guild_economies.partition(interaction.guild_id)
+        await partition.set_setting("level_up_channel", str(channel.id) if channel else None)
+        
+        if channel:
+            message = f"Level-ups in this server will be announced in {channel.mention}."
+        else:
+            message = "Level-ups in this server won't be announced anymore."
+        
+        await respond.send(message, ephemeral=True)
 
 async def setup(bot):
     await bot.add_cog(Economy(bot))
@@ -9,6 +9,12 @@ from typing import Optional, Literal
 from utils.database import db
 from utils.cooldowns import cooldown
 from utils.formatting import format_cash, parse_bet_amount
+from utils.events import BetSettled, bus
+from utils.guilds import guild_economies, ledger_account
+from utils.progression import progression
+from utils.rest_scheduler import Priority, rest
+from utils.responder import Responder
+from utils.profiling import span
 
 logger = logging.getLogger(__name__)
 
@@ -21,12 +27,16 @@ class BlackjackAction(Enum):
     STAND = "stand"
     DOUBLE = "double"
 
+def blackjack_outcome(winnings: int) -> str:
+    if winnings > 0:
+        return "win"
+    return "loss" if winnings < 0 else "push"
+
 class Games(commands.Cog):
     """Casino games to play and win cash"""
     
     def __init__(self, bot):
         self.bot = bot
-        self.active_games = {}
     
     @app_commands.command(name="coinflip", description="Flip a coin and bet on the outcome")
     @app_commands.describe(
@@ -42,20 +52,22 @@ class Games(commands.Cog):
         hidden: Optional[bool] = False
     ):
         """Flip a coin and bet on the outcome"""
-        await interaction.response.defer(ephemeral=hidden)
+        respond = Responder(interaction, ephemeral=hidden)
         
         user_id = str(interaction.user.id)
-        user = await db.get_user(user_id)
+        economy = await guild_economies.economy(interaction.guild_id, user_id)
+        user = await economy.get_user(user_id)
         
         # Parse the bet amount
-        bet_amount = parse_bet_amount(bet, user['cash'])
+        with span("parse_bet"):
+            bet_amount = parse_bet_amount(bet, user['cash'])
         
         # Validate the bet
         if bet_amount <= 0:
-            return await interaction.followup.send("You need to bet at least 1 cash!", ephemeral=True)
+            return await respond.send("You need to bet at least 1 cash!", ephemeral=True)
         
         if bet_amount > user['cash']:
-            return await interaction.followup.send(f"You don't have enough cash! You have {format_cash(user['cash'])}.", ephemeral=True)
+            return await respond.send(f"You don't have enough cash! You have {format_cash(user['cash'])}.", ephemeral=True)
         
         # Flip the coin
         result = random.choice(["heads", "tails"])
@@ -64,58 +76,51 @@ class Games(commands.Cog):
         # Calculate winnings
         winnings = bet_amount if won else -bet_amount
         
-        # Update user cash
-        user['cash'] += winnings
-        user['games_played'] += 1
+        with span("mutate"):
+            # Update user cash
+            user['cash'] += winnings
+            user['games_played'] += 1
         
-        if won:
-            user['wins'] += 1
-            user['total_cash_won'] += bet_amount
-        else:
-            user['losses'] += 1
-            user['total_cash_lost'] += bet_amount
+            if won:
+                user['wins'] += 1
+                user['total_cash_won'] += bet_amount
+            else:
+                user['losses'] += 1
+                user['total_cash_lost'] += bet_amount
         
-        # Add XP
-        xp_gained = 1
-        user['xp'] += xp_gained
+            # Add XP
+            level_up = progression.play(user, user_id, "coinflip", interaction.guild_id)
+            level_up_message = f"\n{level_up.message}" if level_up else ""
         
-        # Check for level up
-        old_level = user['level']
-        new_level = int(user['xp'] / 100)  # Simple level formula: 100 XP per level
+        balance = user['cash']  # Read before the await, while no other command can have changed it
+        # Save user data
+        await economy.update_user(user_id, user)
         
-        if new_level > old_level:
-            user['level'] = new_level
-            level_up_message = f"\n🎉 Level up! You are now level {new_level}!"
-        else:
-            level_up_message = ""
+        # Stats, ledger and activity are updated by the event bus subscribers
+        bus.publish(BetSettled(user_id, interaction.guild_id, economy, ledger_account(economy, user_id), "coinflip", bet_amount, winnings, balance, "win" if won else "loss"))
         
-        # Save user data
-        await db.update_user(user_id, user)
-        
-        # Update global stats
-        await db.update_stats(bet_amount, won)
-        
-        # Create the embed
-        if won:
-            color = discord.Color.green()
-            title = "You Won!"
-            description = f"The coin landed on **{result}**. You won {format_cash(bet_amount)} cash!{level_up_message}"
-        else:
-            color = discord.Color.red()
-            title = "You Lost!"
-            description = f"The coin landed on **{result}**. You lost {format_cash(bet_amount)} cash!{level_up_message}"
-        
-        embed = discord.Embed(
-            title=title,
-            description=description,
-            color=color
-        )
-        
-        embed.add_field(name="Your Choice", value=choice.capitalize(), inline=True)
-        embed.add_field(name="Result", value=result.capitalize(), inline=True)
-        embed.add_field(name="Cash", value=format_cash(user['cash']), inline=True)
-        
-        await interaction.followup.send(embed=embed, ephemeral=hidden)
+        with span("build_embed"):
+            # Create the embed
+            if won:
+                color = discord.Color.green()
+                title = "You Won!"
+                description = f"The coin landed on **{result}**. You won {format_cash(bet_amount)} cash!{level_up_message}"
+            else:
+                color = discord.Color.red()
+                title = "You Lost!"
+                description = f"The coin landed on **{result}**. You lost {format_cash(bet_amount)} cash!{level_up_message}"
+        
+            embed = discord.Embed(
+                title=title,
+                description=description,
+                color=color
+            )
+        
+            embed.add_field(name="Your Choice", value=choice.capitalize(), inline=True)
+            embed.add_field(name="Result", value=result.capitalize(), inline=True)
+            embed.add_field(name="Cash", value=format_cash(user['cash']), inline=True)
+        
+        await respond.send(embed=embed, ephemeral=hidden)
     
     @app_commands.command(name="blackjack", description="Play a game of blackjack")
     @app_commands.describe(
@@ -132,33 +137,33 @@ class Games(commands.Cog):
     ):
         """Play a game of blackjack"""
         user_id = str(interaction.user.id)
+        economy = await guild_economies.economy(interaction.guild_id, user_id)
         
-        # Check if the user already has an active game
-        if user_id in self.active_games:
+        # Mark this user as having an active game (shared by every bot process)
+        if not await db.claim_session(user_id, "blackjack"):
             return await interaction.response.send_message(
                 "You already have an active blackjack game! Finish it before starting a new one.",
                 ephemeral=True
             )
         
-        user = await db.get_user(user_id)
+        user = await economy.get_user(user_id)
         
         # Parse the bet amount
         bet_amount = parse_bet_amount(bet, user['cash'])
         
         # Validate the bet
         if bet_amount <= 0:
+            await db.release_session(user_id, "blackjack")
             return await interaction.response.send_message("You need to bet at least 1 cash!", ephemeral=True)
         
         if bet_amount > user['cash']:
+            await db.release_session(user_id, "blackjack")
             return await interaction.response.send_message(
                 f"You don't have enough cash! You have {format_cash(user['cash'])}.",
                 ephemeral=True
             )
         
-        # Mark this user as having an active game
-        self.active_games[user_id] = True
-        
-        await interaction.response.defer(ephemeral=hidden)
+        respond = Responder(interaction, ephemeral=hidden)
         
         # Initialize game state
         suits = ["♠️", "♥️", "♦️", "♣️"]
@@ -289,7 +294,7 @@ class Games(commands.Cog):
                 winnings = -bet_amount
             
             embed = await create_game_embed()
-            await interaction.followup.send(embed=embed, ephemeral=hidden)
+            await respond.send(embed=embed, ephemeral=hidden)
             
             # Update user stats
             if winnings > 0:
@@ -301,26 +306,24 @@ class Games(commands.Cog):
             
             user['cash'] += winnings
             user['games_played'] += 1
-            user['xp'] += 5
             
-            # Check for level up
-            old_level = user['level']
-            new_level = int(user['xp'] / 100)
+            # Add XP
+            level_up = progression.play(user, user_id, "blackjack", interaction.guild_id)
+            if level_up:
+                # The result is already shown, so the reply doesn't wait for this
+                rest.submit(lambda: respond.send(level_up.message, ephemeral=hidden), Priority.BACKGROUND)
             
-            if new_level > old_level:
-                user['level'] = new_level
-                await interaction.followup.send(f"🎉 Level up! You are now level {new_level}!", ephemeral=hidden)
-            
-            await db.update_user(user_id, user)
-            await db.update_stats(bet_amount, winnings > 0)
+            balance = user['cash']
+            await economy.update_user(user_id, user)
+            bus.publish(BetSettled(user_id, interaction.guild_id, economy, ledger_account(economy, user_id), "blackjack", bet_amount, winnings, balance, blackjack_outcome(winnings)))
             
             # Remove active game flag
-            del self.active_games[user_id]
+            await db.release_session(user_id, "blackjack")
             return
         
         # Create view with buttons
         view = await create_action_row()
-        message = await interaction.followup.send(embed=embed, view=view, ephemeral=hidden)
+        message = await respond.send(embed=embed, view=view, ephemeral=hidden)
         
         # Wait for button clicks
         def check(i):
@@ -434,7 +437,7 @@ class Games(commands.Cog):
                     await button_interaction.response.edit_message(embed=embed, view=None)
             
             # Game is over, update stats
-            user = await db.get_user(user_id)  # Get fresh user data
+            user = await economy.get_user(user_id)  # Get fresh user data
             
             if winnings > 0:
                 user['wins'] += 1
@@ -447,19 +450,14 @@ class Games(commands.Cog):
             user['games_played'] += 1
             
             # Add XP (more for blackjack since it's more complex)
-            xp_gained = 5
-            user['xp'] += xp_gained
-            
-            # Check for level up
-            old_level = user['level']
-            new_level = int(user['xp'] / 100)
+            level_up = progression.play(user, user_id, "blackjack", interaction.guild_id)
+            if level_up:
+                # The result is already shown, so the reply doesn't wait for this
+                rest.submit(lambda: respond.send(level_up.message, ephemeral=hidden), Priority.BACKGROUND)
             
-            if new_level > old_level:
-                user['level'] = new_level
-                await interaction.followup.send(f"🎉 Level up! You are now level {new_level}!", ephemeral=hidden)
-            
-            await db.update_user(user_id, user)
-            await db.update_stats(bet_amount, winnings > 0)
+            balance = user['cash']
+            await economy.update_user(user_id, user)
+            bus.publish(BetSettled(user_id, interaction.guild_id, economy, ledger_account(economy, user_id), "blackjack", bet_amount, winnings, balance, blackjack_outcome(winnings)))
         
         except asyncio.TimeoutError:
             # If the player doesn't respond in time, they forfeit
@@ -469,41 +467,43 @@ class Games(commands.Cog):
                 winnings = -bet_amount
                 
                 # Update user stats
-                user = await db.get_user(user_id)
+                user = await economy.get_user(user_id)
                 user['losses'] += 1
                 user['total_cash_lost'] += bet_amount
                 user['cash'] -= bet_amount
                 user['games_played'] += 1
                 
-                await db.update_user(user_id, user)
-                await db.update_stats(bet_amount, False)
+                balance = user['cash']
+                await economy.update_user(user_id, user)
+                bus.publish(BetSettled(user_id, interaction.guild_id, economy, ledger_account(economy, user_id), "blackjack", bet_amount, -bet_amount, balance, "timeout"))
                 
                 embed = await create_game_embed()
                 await message.edit(embed=embed, view=None)
         
         finally:
             # Always remove the active game flag
-            if user_id in self.active_games:
-                del self.active_games[user_id]
+            await db.release_session(user_id, "blackjack")
 
     @app_commands.command(name="slots", description="Try your luck in the slots!")
     @app_commands.describe(bet="The amount to bet. Use `m` for max and `a` for all in")
     async def slots(self, interaction: discord.Interaction, bet: str):
         """Try your luck in the slots!"""
-        await interaction.response.defer()
+        respond = Responder(interaction)
 
         user_id = str(interaction.user.id)
-        user = await db.get_user(user_id)
+        economy = await guild_economies.economy(interaction.guild_id, user_id)
+        user = await economy.get_user(user_id)
 
         # Parse the bet amount
-        bet_amount = parse_bet_amount(bet, user['cash'])
+        with span("parse_bet"):
+            bet_amount = parse_bet_amount(bet, user['cash'])
 
         # Validate the bet
         if bet_amount <= 0:
-            return await interaction.followup.send("You need to bet at least 1 cash!", ephemeral=True)
+            return await respond.send("You need to bet at least 1 cash!", ephemeral=True)
 
         if bet_amount > user['cash']:
-            return await interaction.followup.send(f"You don't have enough cash! You have {format_cash(user['cash'])}.", ephemeral=True)
+            return await respond.send(f"You don't have enough cash! You have {format_cash(user['cash'])}.", ephemeral=True)
 
         # Define slot machine items and their probabilities
         slot_items = {
@@ -552,49 +552,42 @@ class Games(commands.Cog):
 
         payout = calculate_payout(slot_result)
 
-        # Update user cash
-        user['cash'] += payout
-        user['games_played'] += 1
-        if payout > 0:
-            user['wins'] += 1
-            user['total_cash_won'] += payout
-        else:
-            user['losses'] += 1
-            user['total_cash_lost'] += bet_amount
-
-        # Add XP
-        xp_gained = 3
-        user['xp'] += xp_gained
-
-        # Check for level up
-        old_level = user['level']
-        new_level = int(user['xp'] / 100)
+        with span("mutate"):
+            # Update user cash
+            user['cash'] += payout
+            user['games_played'] += 1
+            if payout > 0:
+                user['wins'] += 1
+                user['total_cash_won'] += payout
+            else:
+                user['losses'] += 1
+                user['total_cash_lost'] += bet_amount
 
-        if new_level > old_level:
-            user['level'] = new_level
-            level_up_message = f"\n🎉 Level up! You are now level {new_level}!"
-        else:
-            level_up_message = ""
+            # Add XP
+            level_up = progression.play(user, user_id, "slots", interaction.guild_id)
+            level_up_message = f"\n{level_up.message}" if level_up else ""
 
+        balance = user['cash']
         # Save user data
-        await db.update_user(user_id, user)
+        await economy.update_user(user_id, user)
 
-        # Update global stats
-        await db.update_stats(bet_amount, payout > 0)
+        # Stats, ledger and activity are updated by the event bus subscribers
+        bus.publish(BetSettled(user_id, interaction.guild_id, economy, ledger_account(economy, user_id), "slots", bet_amount, payout, balance, "win" if payout > 0 else "loss"))
 
-        # Create embed
-        embed = discord.Embed(title="Slot Machine", color=discord.Color.purple())
-        slot_emojis = [slot_items[item]["emoji"] for item in slot_result]
-        embed.add_field(name="Result", value=" ".join(slot_emojis), inline=False)
+        with span("build_embed"):
+            # Create embed
+            embed = discord.Embed(title="Slot Machine", color=discord.Color.purple())
+            slot_emojis = [slot_items[item]["emoji"] for item in slot_result]
+            embed.add_field(name="Result", value=" ".join(slot_emojis), inline=False)
 
-        if payout > 0:
-            embed.add_field(name="Payout", value=f"You won {format_cash(payout)} cash!{level_up_message}", inline=False)
-        else:
-            embed.add_field(name="Payout", value=f"You lost {format_cash(bet_amount)} cash!{level_up_message}", inline=False)
+            if payout > 0:
+                embed.add_field(name="Payout", value=f"You won {format_cash(payout)} cash!{level_up_message}", inline=False)
+            else:
+                embed.add_field(name="Payout", value=f"You lost {format_cash(bet_amount)} cash!{level_up_message}", inline=False)
 
-        embed.add_field(name="Cash", value=format_cash(user['cash']), inline=False)
+            embed.add_field(name="Cash", value=format_cash(user['cash']), inline=False)
 
-        await interaction.followup.send(embed=embed)
+        await respond.send(embed=embed)
 
 async def setup(bot):
     await bot.add_cog(Games(bot))
@@ -68,6 +68,8 @@ class Help(commands.Cog):
             • `/daily` - Get your daily cash reward
             • `/vote` - Vote for the bot to get cash rewards
             • `/cooldowns` - Check when commands will be available again
+            • `/servereconomy <global|server>` - Give this server its own economy (server managers)
+            • `/levelupchannel [channel]` - Announce level-ups in a channel (server managers)
             """,
             inline=False
         )
@@ -77,7 +79,8 @@ class Help(commands.Cog):
             name="Profile Commands",
             value="""
             • `/profile [user]` - View your or another user's profile
-            • `/leaderboard [category]` - View the global leaderboard
+            • `/leaderboard [category] [server]` - View the global or server leaderboard
+            • `/history [entries]` - View your recent cash transactions
             """,
             inline=False
         )
@@ -178,18 +181,54 @@ class Help(commands.Cog):
                     "/cooldowns - Check your command cooldowns"
                 ]
             },
+            "levelupchannel": {
+                "usage": "/levelupchannel [channel]",
+                "description": "Announce level-ups of this server's players in a channel. Needs the Manage Server permission.",
+                "arguments": [
+                    {"name": "channel", "description": "The channel to announce level-ups in (leave empty to stop announcing)", "required": False}
+                ],
+                "examples": [
+                    "/levelupchannel #general - Announce level-ups in #general",
+                    "/levelupchannel - Stop announcing level-ups"
+                ]
+            },
+            "servereconomy": {
+                "usage": "/servereconomy <global|server>",
+                "description": "Choose whether this server shares the global economy or has its own cash, levels and stats. Needs the Manage Server permission.",
+                "arguments": [
+                    {"name": "mode", "description": "global to share the global economy, server for a separate economy", "required": True}
+                ],
+                "examples": [
+                    "/servereconomy server - Give this server its own economy",
+                    "/servereconomy global - Go back to the global economy"
+                ]
+            },
             "leaderboard": {
-                "usage": "/leaderboard [category] [hidden]",
-                "description": "View the global leaderboard.",
+                "usage": "/leaderboard [category] [server] [hidden]",
+                "description": "View the global leaderboard, or the leaderboard of this server's players.",
                 "arguments": [
                     {"name": "category", "description": "The stat to rank players by (default: cash)", "required": False},
+                    {"name": "server", "description": "Only rank players of this server (always on for servers with their own economy)", "required": False},
                     {"name": "hidden", "description": "Send the response only to you (default: False)", "required": False}
                 ],
                 "examples": [
                     "/leaderboard - View the cash leaderboard",
                     "/leaderboard level - View the level leaderboard",
                     "/leaderboard wins - View the wins leaderboard",
-                    "/leaderboard profit - View the profit leaderboard"
+                    "/leaderboard profit - View the profit leaderboard",
+                    "/leaderboard cash True - View the cash leaderboard of this server"
+                ]
+            },
+            "history": {
+                "usage": "/history [entries] [hidden]",
+                "description": "View your most recent cash transactions: what changed your cash, by how much, and your balance after.",
+                "arguments": [
+                    {"name": "entries", "description": "Number of transactions to show, up to 25 (default: 10)", "required": False},
+                    {"name": "hidden", "description": "Send the response only to you (default: True)", "required": False}
+                ],
+                "examples": [
+                    "/history - View your last 10 transactions",
+                    "/history 25 - View your last 25 transactions"
                 ]
             },
             "help": {
@@ -5,6 +5,11 @@ from discord.ext import commands
 from typing import Optional, Literal
 from utils.database import db
 from utils.formatting import format_cash
+from utils.guilds import guild_economies, ledger_account
+from utils.ledger import ledger
+from utils.progression import progression
+from utils.rest_scheduler import rest
+from utils.responder import Responder
 
 logger = logging.getLogger(__name__)
 
@@ -26,14 +31,15 @@ class Profile(commands.Cog):
         hidden: bool = False
     ):
         """View your or another user's profile"""
-        await interaction.response.defer(ephemeral=hidden)
+        respond = Responder(interaction, ephemeral=hidden)
         
         # If no user is specified, use the command invoker
         target_user = user or interaction.user
         target_id = str(target_user.id)
         
-        # Get user data
-        user_data = await db.get_user(target_id)
+        # Get user data from this server's economy
+        economy = await guild_economies.economy(interaction.guild_id)
+        user_data = await economy.get_user(target_id)
         
         # Create embed
         embed = discord.Embed(
@@ -53,7 +59,7 @@ class Profile(commands.Cog):
         
         embed.add_field(
             name="Level",
-            value=f"{user_data['level']} ({user_data['xp']} XP)",
+            value=f"{user_data['level']} ({user_data['xp']} XP, {format_cash(progression.curve.xp_for(user_data['level'] + 1) - user_data['xp'])} to next)",
             inline=True
         )
         
@@ -109,21 +115,23 @@ class Profile(commands.Cog):
                 inline=True
             )
         
-        await interaction.followup.send(embed=embed, ephemeral=hidden)
+        await respond.send(embed=embed, ephemeral=hidden)
     
     @app_commands.command(name="leaderboard", description="View the global leaderboard")
     @app_commands.describe(
         category="The stat to rank players by (default: cash)",
+        server="Only rank players of this server (default: False, always on for servers with their own economy)",
         hidden="Send the response only to you (default: False)"
     )
     async def leaderboard(
         self, 
         interaction: discord.Interaction, 
         category: Literal["cash", "level", "wins", "profit"] = "cash",
+        server: bool = False,
         hidden: bool = False
     ):
         """View the global leaderboard"""
-        await interaction.response.defer(ephemeral=hidden)
+        respond = Responder(interaction, ephemeral=hidden)
         
         field_mapping = {
             "cash": "cash",
@@ -134,30 +142,37 @@ class Profile(commands.Cog):
         
         field = field_mapping[category]
         
-        # Get leaderboard data
-        leaderboard = await db.get_leaderboard(field, 10)
+        # Get leaderboard data (a server leaderboard only touches the server's members)
+        scope = "Global"
+        if interaction.guild_id is not None:
+            partition = await guild_economies.partition(interaction.guild_id)
+            if server or partition.server_economy:
+                scope = "Server"
+        
+        if scope == "Server":
+            leaderboard = await guild_economies.get_leaderboard(interaction.guild_id, field, 10)
+        else:
+            leaderboard = await db.get_leaderboard(field, 10)
         
         if not leaderboard:
-            return await interaction.followup.send("No users found for the leaderboard!", ephemeral=hidden)
+            return await respond.send("No users found for the leaderboard!", ephemeral=hidden)
         
         # Create embed
         category_title = category.capitalize() if category else "Cash"
         embed = discord.Embed(
-            title=f"Global {category_title} Leaderboard",
+            title=f"{scope} {category_title} Leaderboard",
             description="Top 10 players:",
             color=discord.Color.gold()
         )
         
+        # Fetch the names together (cached, and coalesced with other leaderboards)
+        names = await rest.user_names(self.bot, [entry['id'] for entry in leaderboard])
+        
         # Add leaderboard entries
         for i, entry in enumerate(leaderboard, 1):
             user_id = entry['id']
             value_str = ""
-            
-            try:
-                user = await self.bot.fetch_user(int(user_id))
-                username = user.display_name
-            except:
-                username = f"User {user_id}"
+            username = names.get(user_id, f"User {user_id}")
             
             if category == "profit":
                 value = entry['total_cash_won'] - entry['total_cash_lost']
@@ -175,7 +190,45 @@ class Profile(commands.Cog):
                 inline=False
             )
         
-        await interaction.followup.send(embed=embed, ephemeral=hidden)
+        await respond.send(embed=embed, ephemeral=hidden)
+    
+    @app_commands.command(name="history", description="View your recent cash transactions")
+    @app_commands.describe(
+        entries="Number of transactions to show (default: 10)",
+        hidden="Send the response only to you (default: True)"
+    )
+    async def history(
+        self,
+        interaction: discord.Interaction,
+        entries: app_commands.Range[int, 1, 25] = 10,
+        hidden: bool = True
+    ):
+        """View your recent cash transactions"""
+        respond = Responder(interaction, ephemeral=hidden)
+        
+        economy = await guild_economies.economy(interaction.guild_id)
+        transactions = await ledger.history(ledger_account(economy, str(interaction.user.id)), entries)
+        
+        if not transactions:
+            return await respond.send("You don't have any transactions yet!", ephemeral=hidden)
+        
+        lines = []
+        for entry in transactions:
+            amount = entry['amount']
+            amount_str = f"+{format_cash(amount)}" if amount >= 0 else f"-{format_cash(abs(amount))}"
+            details = f" on a {format_cash(entry['bet'])} bet ({entry['outcome']})" if entry['bet'] is not None else ""
+            lines.append(
+                f"<t:{int(entry['ts'])}:R> **{entry['source']}** {amount_str}{details} → {format_cash(entry['balance'])}"
+            )
+        
+        embed = discord.Embed(
+            title=f"{interaction.user.display_name}'s Transactions",
+            description="\n".join(lines),
+            color=discord.Color.blue()
+        )
+        embed.set_footer(text=f"Last {len(transactions)} transactions, newest first")
+        
+        await respond.send(embed=embed, ephemeral=hidden)
 
 async def setup(bot):
     await bot.add_cog(Profile(bot))
@@ -1,15 +1,18 @@
 import os
 import sys
+import json
 import logging
 import asyncio
 import threading
 import time
 from datetime import datetime
 from functools import wraps
-from flask import Flask, render_template, jsonify, redirect, url_for, request, make_response
+from flask import Flask, Response, render_template, jsonify, redirect, url_for, request, make_response
 from flask_cors import CORS
-from bot import RocketGamblingBot
+from bot import create_bot
 from utils.database import db
+from utils.metrics import REGISTRY, gauge
+from utils.timeseries import RESOLUTIONS, timeseries
 
 # Configure logging
 logging.basicConfig(
@@ -18,6 +21,9 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Load the data file in the background so the web server and bot can start meanwhile
+db.start_loading()
+
 # Create Flask app
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET", "rocket-gambling-bot-secret")
@@ -33,59 +39,128 @@ bot_instance = None
 bot_thread = None
 bot_status = "Stopped"
 
+# Set by cluster.py when this process supervises several bot processes
+cluster_supervisor = None
+
+def gateway_latencies():
+    """Get the gateway latency of each shard in seconds, for /metrics"""
+    if not bot_instance:
+        return {}
+    return {
+        (str(shard["id"]),): shard["latency_ms"] / 1000
+        for shard in bot_instance.shard_status()
+        if shard["latency_ms"] is not None
+    }
+
+GATEWAY_LATENCY = gauge("discord_gateway_latency_seconds", "Gateway heartbeat latency", ["shard"])
+GATEWAY_LATENCY.set_function(gateway_latencies)
+
 @app.route('/')
 def index():
     """Home page route"""
     global bot_status
     return render_template('index.html', bot_status=bot_status)
 
-@app.route('/api/status')
-def api_status():
-    """API endpoint to get bot status"""
+def format_uptime(uptime_seconds: float) -> str:
+    """Format an uptime in seconds for the dashboard"""
+    days, remainder = divmod(uptime_seconds, 86400)
+    hours, remainder = divmod(remainder, 3600)
+    minutes, seconds = divmod(remainder, 60)
+    
+    if days > 0:
+        return f"{int(days)}d {int(hours)}h {int(minutes)}m"
+    elif hours > 0:
+        return f"{int(hours)}h {int(minutes)}m {int(seconds)}s"
+    else:
+        return f"{int(minutes)}m {int(seconds)}s"
+
+def build_status():
+    """Build the status of the bot running in this process"""
     global bot_status, bot_instance, bot_start_time
     
     connected_guilds = 0
+    shards = []
     if bot_instance and hasattr(bot_instance, 'guilds'):
         connected_guilds = len(bot_instance.guilds)
+        shards = bot_instance.shard_status()
     
     # Calculate uptime if the bot is running
     uptime_str = "N/A"
     if bot_start_time and bot_status == "Running":
-        uptime_seconds = time.time() - bot_start_time
-        
-        # Format uptime
-        days, remainder = divmod(uptime_seconds, 86400)
-        hours, remainder = divmod(remainder, 3600)
-        minutes, seconds = divmod(remainder, 60)
-        
-        if days > 0:
-            uptime_str = f"{int(days)}d {int(hours)}h {int(minutes)}m"
-        elif hours > 0:
-            uptime_str = f"{int(hours)}h {int(minutes)}m {int(seconds)}s"
-        else:
-            uptime_str = f"{int(minutes)}m {int(seconds)}s"
-    
-    status_data = {
+        uptime_str = format_uptime(time.time() - bot_start_time)
+    
+    return {
         "status": bot_status,
         "connected_guilds": connected_guilds,
-        "uptime": uptime_str
+        "uptime": uptime_str,
+        "shard_count": bot_instance.shard_count if bot_instance else None,
+        "shards": shards,
+        "startup": bot_instance.startup_timings if bot_instance else {},
+        "data_loaded": db.loaded,
+        "event_loop": bot_instance.loop_monitor.snapshot() if bot_instance and bot_instance.loop_monitor else None
     }
+
+@app.route('/api/status')
+def api_status():
+    """API endpoint to get bot status"""
+    if cluster_supervisor is not None:
+        # The dashboard is run by cluster.py, so report on all bot processes
+        return jsonify(cluster_supervisor.status())
     
-    response = jsonify(status_data)
+    response = jsonify(build_status())
     return response
 
 @app.route('/api/stats')
 def api_stats():
     """API endpoint to get global stats"""
-    global_stats = db.data.get("global_stats", {
-        "total_bets": 0,
-        "total_cash_won": 0,
-        "total_cash_lost": 0
-    })
+    global_stats = db.snapshot_stats()
     
     response = jsonify(global_stats)
     return response
 
+@app.route('/api/stats/users')
+def api_user_stats():
+    """API endpoint to get totals over all users"""
+    response = jsonify(db.snapshot_aggregates())
+    return response
+
+@app.route('/api/stats/distribution/<field>')
+def api_distribution(field):
+    """API endpoint to get the distribution of a numeric user field"""
+    if field not in ["cash", "level", "xp", "games_played", "wins", "losses", "total_cash_won", "total_cash_lost"]:
+        return jsonify({"error": f"Unknown field: {field}"}), 404
+
+    bins = min(max(request.args.get('bins', 10, type=int), 1), 100)
+    response = jsonify(db.snapshot_histogram(field, bins))
+    return response
+
+def timeseries_response(game=None):
+    """Build a timeseries response from the resolution and points query arguments"""
+    resolution = request.args.get('resolution', 'minute')
+    if resolution not in RESOLUTIONS:
+        return jsonify({"error": f"Unknown resolution: {resolution}"}), 400
+
+    points = min(max(request.args.get('points', 60, type=int), 1), 1440)
+    response = jsonify({
+        "resolution": resolution,
+        "bucket_seconds": RESOLUTIONS[resolution],
+        "game": game,
+        "buckets": timeseries.snapshot(resolution, points, game)
+    })
+    return response
+
+@app.route('/api/stats/timeseries')
+def api_timeseries():
+    """API endpoint to get bets, volume, house profit and active users per time bucket"""
+    return timeseries_response()
+
+@app.route('/api/stats/timeseries/<game>')
+def api_game_timeseries(game):
+    """API endpoint to get bets, volume and house profit of one game per time bucket"""
+    if game not in ["coinflip", "slots", "blackjack"]:
+        return jsonify({"error": f"Unknown game: {game}"}), 404
+    return timeseries_response(game)
+
 @app.route('/api/leaderboard/<category>')
 def api_leaderboard(category):
     """API endpoint to get leaderboard data"""
@@ -101,25 +176,20 @@ def api_leaderboard(category):
     
     field = field_mapping[category]
     
-    # This is a synchronous route handler, but we need to access async code
-    # For a proper implementation, we'd use quart or another async-compatible framework
-    leaderboard = []
-    
-    # As a workaround, we'll just access the data directly
-    if "users" in db.data:
-        # Sort users by the specified field
-        sorted_users = sorted(
-            [(user_id, user_data) for user_id, user_data in db.data["users"].items()],
-            key=lambda x: x[1].get(field, 0),
-            reverse=True
-        )[:10]
-        
-        # Format the leaderboard data
-        leaderboard = [{"id": user_id, **user_data} for user_id, user_data in sorted_users]
+    # This is a synchronous route handler, so read a snapshot instead of awaiting the database
+    leaderboard = db.snapshot_leaderboard(field, 10)
     
     response = jsonify(leaderboard)
     return response
 
+@app.route('/metrics')
+def metrics():
+    """Prometheus metrics endpoint"""
+    if cluster_supervisor is not None:
+        # This process only serves the dashboard, so report the metrics the bot processes published
+        return Response(cluster_supervisor.metrics(), mimetype='text/plain; version=0.0.4')
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
 # Helper method to ensure all API responses have proper CORS headers
 @app.after_request
 def after_request(response):
@@ -130,6 +200,28 @@ def after_request(response):
     response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE,OPTIONS')
     return response
 
+async def publish_cluster_status(status_file: str, interval: float = 5.0):
+    """Periodically write this process's status and metrics for the cluster supervisor"""
+    cluster_label = f'cluster="{os.getenv("CLUSTER_ID", "0")}"'
+    while True:
+        status = build_status()
+        status["pid"] = os.getpid()
+        status["updated_at"] = time.time()
+        status["metrics"] = REGISTRY.families(cluster_label)
+        try:
+            # Encoding and writing the metrics would block the loop they measure
+            await asyncio.to_thread(write_status_file, status_file, status)
+        except OSError as e:
+            logger.error(f"Failed to write cluster status: {e}")
+        await asyncio.sleep(interval)
+
+def write_status_file(status_file: str, status: dict):
+    """Atomically replace the status file"""
+    tmp_file = f"{status_file}.tmp"
+    with open(tmp_file, 'w') as f:
+        json.dump(status, f)
+    os.replace(tmp_file, status_file)
+
 async def run_bot():
     """Run the Discord bot asynchronously"""
     global bot_instance, bot_status
@@ -143,7 +235,7 @@ async def run_bot():
         return
     
     # Initialize the bot and add a listener for the ready event
-    bot_instance = RocketGamblingBot()
+    bot_instance = create_bot()
     
     # Add a method to update status when the bot is ready
     original_on_ready = bot_instance.on_ready
@@ -161,6 +253,12 @@ async def run_bot():
     # Replace the on_ready method
     bot_instance.on_ready = on_ready_with_status_update
     
+    # When run by cluster.py, report status back to the supervisor
+    status_task = None
+    status_file = os.getenv("CLUSTER_STATUS_FILE")
+    if status_file:
+        status_task = asyncio.create_task(publish_cluster_status(status_file))
+    
     try:
         logger.info("Starting Rocket Gambling Bot...")
         bot_status = "Starting"
@@ -173,6 +271,9 @@ async def run_bot():
         logger.error(f"Error starting bot: {e}")
         bot_status = f"Error: {str(e)}"
         await bot_instance.close()
+    finally:
+        if status_task:
+            status_task.cancel()
 
 def bot_thread_function():
     """Function to run the bot in a separate thread"""
@@ -0,0 +1,177 @@
+import heapq
+import threading
+from array import array
+from bisect import bisect_right
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+try:
+    import numpy
+except ImportError:  # NumPy is optional, the columns work without it
+    numpy = None
+
+# Numeric user fields and their array type codes: money is float64
+# (slots pays fractional multiples), counters are int64
+NUMERIC_COLUMNS: Dict[str, str] = {
+    "cash": "d",
+    "level": "q",
+    "xp": "q",
+    "games_played": "q",
+    "wins": "q",
+    "losses": "q",
+    "total_cash_won": "d",
+    "total_cash_lost": "d",
+    "vote_streak": "q",
+    "last_active": "d"  # Unix time of the last change, 0 if unknown
+}
+
+COLUMN_DEFAULTS: Dict[str, int] = {
+    "cash": 1000,
+    "level": 0,
+    "xp": 0,
+    "games_played": 0,
+    "wins": 0,
+    "losses": 0,
+    "total_cash_won": 0,
+    "total_cash_lost": 0,
+    "vote_streak": 0,
+    "last_active": 0
+}
+
+# Columns that are user stats, as opposed to bookkeeping (for totals and distributions)
+STAT_COLUMNS = tuple(name for name in NUMERIC_COLUMNS if name != "last_active")
+
+# Integers beyond this can't be stored exactly in a float64 column
+MAX_EXACT_FLOAT = 2 ** 53
+
+class ColumnStore:
+    """
+    Numeric user fields stored column by column in compact arrays.
+
+    Each user owns a row, and each field is an array of 8-byte numbers, so
+    scans over a field (leaderboards, sums, histograms) run over contiguous
+    memory instead of visiting one object per user. When NumPy is installed,
+    those scans are vectorized over zero-copy views of the arrays.
+
+    Only adding rows resizes the arrays, and that is not allowed while NumPy
+    has a view of them, so both hold the store's lock. This also lets the
+    dashboard thread scan the columns while the bot adds users.
+    """
+
+    def __init__(self):
+        self.columns: Dict[str, array] = {name: array(code) for name, code in NUMERIC_COLUMNS.items()}
+        self.ids: List[Optional[str]] = []  # row -> user ID
+        self._layout = [(name, column, column.typecode, COLUMN_DEFAULTS[name]) for name, column in self.columns.items()]
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def add_row(self, user_id: Optional[str], values: Optional[Dict[str, Any]] = None) -> int:
+        """
+        Add a row for a user, returning the row index.
+
+        Args:
+            user_id: The ID of the user
+            values: Initial values of the numeric fields (defaults for missing ones)
+        """
+        row = []
+        for name, column, typecode, default in self._layout:
+            value = values.get(name, default) if values else default
+            if typecode == "q" and type(value) is not int:
+                value = int(value)
+            row.append(value)
+
+        with self._lock:
+            appended = []
+            try:
+                for (_, column, _, _), value in zip(self._layout, row):
+                    column.append(value)
+                    appended.append(column)
+            except BaseException:
+                # Keep the columns the same length
+                for column in appended:
+                    column.pop()
+                raise
+            self.ids.append(user_id)
+            return len(self.ids) - 1
+
+    def take(self, rows: List[int]) -> "ColumnStore":
+        """
+        Build a new store holding only the given rows, in that order.
+
+        Returns:
+            The new store, where rows[i] of this store is row i
+        """
+        store = ColumnStore()
+        with self._lock:
+            for name, column in self.columns.items():
+                store.columns[name].extend([column[row] for row in rows])
+            store.ids.extend([self.ids[row] for row in rows])
+        return store
+
+    def top_k(self, field: str, k: int, rows: Optional[Iterable[int]] = None) -> List[Tuple[str, float]]:
+        """
+        Get the users with the highest values of a field.
+
+        Args:
+            field: The field to rank by
+            k: Number of users
+            rows: Only rank these rows (e.g. a guild's members), touching no others
+
+        Returns:
+            Up to k (user ID, value) pairs, highest first
+        """
+        column = self.columns[field]
+        with self._lock:
+            size = len(self.ids)
+            if size == 0 or k <= 0:
+                return []
+            if rows is not None:
+                rows = heapq.nlargest(k, (row for row in rows if row < size), key=column.__getitem__)
+            elif numpy is not None:
+                values = numpy.frombuffer(column, dtype=numpy.float64 if column.typecode == "d" else numpy.int64)
+                if k < size:
+                    rows = numpy.argpartition(values, size - k)[size - k:]
+                else:
+                    rows = numpy.arange(size)
+                rows = rows[numpy.argsort(values[rows])[::-1]].tolist()
+                del values
+            else:
+                rows = heapq.nlargest(k, range(size), key=column.__getitem__)
+            return [(self.ids[row], column[row]) for row in rows if self.ids[row] is not None]
+
+    def sum(self, field: str) -> float:
+        """Sum a field over every user."""
+        column = self.columns[field]
+        if numpy is not None:
+            with self._lock:
+                values = numpy.frombuffer(column, dtype=numpy.float64 if column.typecode == "d" else numpy.int64)
+                total = values.sum().item()
+                del values
+            return total
+        return sum(column)
+
+    def histogram(self, field: str, bins: int = 10) -> Dict[str, List[float]]:
+        """
+        Count users by value of a field in equal-width bins.
+
+        Returns:
+            {"edges": bins + 1 bin edges, "counts": users per bin}
+        """
+        column = self.columns[field]
+        if len(column) == 0:
+            return {"edges": [], "counts": []}
+        if numpy is not None:
+            with self._lock:
+                values = numpy.frombuffer(column, dtype=numpy.float64 if column.typecode == "d" else numpy.int64)
+                counts, edges = numpy.histogram(values, bins=bins)
+                del values
+            return {"edges": edges.tolist(), "counts": counts.tolist()}
+
+        low, high = min(column), max(column)
+        width = (high - low) / bins or 1
+        edges = [low + width * index for index in range(bins + 1)]
+        counts = [0] * bins
+        for value in column:
+            counts[min(bins - 1, bisect_right(edges, value) - 1)] += 1
+        return {"edges": edges, "counts": counts}
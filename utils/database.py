@@ -1,21 +1,177 @@
+import gc
 import os
+import gzip
+import weakref
 import json
+import time
+import shutil
 import logging
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Iterable, Optional, List
 import asyncio
+import contextvars
+import threading
+from contextlib import asynccontextmanager
+from functools import wraps
+from utils.metrics import add_phase_time, counter, histogram
+from utils.profiling import span
+from utils.columns import NUMERIC_COLUMNS, STAT_COLUMNS, ColumnStore
+from utils.records import UserRecord
+from utils.serializers import Serializer, get_serializer, load_file
 
 logger = logging.getLogger(__name__)
 
+DB_OPERATION_SECONDS = histogram(
+    "db_operation_seconds", "Time taken by database operations, including lock waits", ["operation"]
+)
+DB_LOCK_WAIT_SECONDS = histogram("db_lock_wait_seconds", "Time spent waiting for the database lock")
+DB_SAVE_SECONDS = histogram("db_save_seconds", "Time taken to encode and write the data file (off the event loop)")
+DB_SNAPSHOT_SECONDS = histogram("db_snapshot_seconds", "Time the event loop spent copying data (or forking) for a save")
+DB_SAVE_STALENESS_SECONDS = histogram(
+    "db_save_staleness_seconds", "Age of the oldest change in a save when the save is written (the data a crash could lose)"
+)
+DB_SNAPSHOT_FAILURES = counter("db_snapshot_failures_total", "Snapshots that failed to be written", ["strategy"])
+
+SNAPSHOT_STRATEGIES = ("thread", "fork")
+
+# Longest wait before retrying a failed save
+SAVE_RETRY_MAX_SECONDS = 60
+
+def timed(func):
+    """Record the duration of a database operation, and count it as DB time for the current command."""
+    operation = func.__name__
+    
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            with span(f"db.{operation}"):
+                return await func(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            DB_OPERATION_SECONDS.observe(elapsed, operation)
+            add_phase_time("db", elapsed)
+    
+    return wrapper
+
+def new_user() -> Dict[str, Any]:
+    """Create the default data for a new user."""
+    return UserRecord().to_dict(sparse=False)
+
+def _encode(obj: Any) -> Any:
+    """Encoder for values the serializers can't handle."""
+    if isinstance(obj, UserRecord):
+        return obj.to_dict()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+def _copy_value(value: Any) -> Any:
+    """Copy the containers in a value (much faster than copy.deepcopy for small JSON-like values)."""
+    if isinstance(value, dict):
+        return {key: _copy_value(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_copy_value(item) for item in value]
+    return value
+
+def _detach(user_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Copy a user dict so that it shares no containers with the live record."""
+    return _copy_value(user_data)
+
+def _fsync_directory(directory: str):
+    """Make a rename in a directory durable (not supported on every platform)."""
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+class _UserSnapshot:
+    """
+    The users at the time of a snapshot, turned into dicts by the thread that encodes them.
+    
+    The numeric fields come from copies of the columns. Users changed since the
+    previous snapshot are copied whole, since a command may still hold their
+    containers. The other users' remaining fields are read from the live
+    records: their containers are only ever replaced, and if that happens
+    during the save the user is dirty and saved again by the next one.
+    """
+    
+    __slots__ = ("records", "changed", "columns", "ids")
+    
+    def __init__(self, records: Dict[str, UserRecord], changed: Dict[str, Dict[str, Any]], store: ColumnStore):
+        self.records = records
+        self.changed = changed
+        self.columns = {name: column[:] for name, column in store.columns.items()}
+        self.ids = store.ids[:]
+    
+    def to_dicts(self) -> Dict[str, Dict[str, Any]]:
+        # A user's last row is their current one (earlier rows belong to removed records)
+        rows = {user_id: row for row, user_id in enumerate(self.ids)}
+        users = {}
+        for user_id, record in self.records.items():
+            data = self.changed.get(user_id)
+            if data is None:
+                data = record.to_dict(columns=self.columns, row=rows[user_id])
+            users[user_id] = data
+        return users
+
 class Database:
     """
     Simple in-memory database with file persistence.
     
     For a production bot, you'd want to use a real database system,
     but this will work for the initial implementation.
+    
+    Saves never write on the event loop. The loop only copies the numeric
+    columns (one memcpy each) and the users changed since the last save, then
+    a worker thread builds the other users' dicts from those columns, encodes
+    the snapshot and writes it to a temporary file, which is fsynced and
+    renamed over the data file, so a crash leaves either the old or the new
+    file. No second copy of the users is kept between saves. Saves requested while one is being written are
+    combined into the next one.
+    
+    Changes are committed in memory and the command replies straight away:
+    saves are group commits, written at most SAVE_INTERVAL seconds after the
+    first change they contain, so a crash loses at most the last
+    SAVE_INTERVAL seconds (plus the time taken to write a save). With
+    WAIT_FOR_SAVE=1 updates wait until their change is written instead, and
+    saves start as soon as they are requested.
+    
+    With the fork strategy, the process forks for each save instead, and the
+    child writes the data as it was at the fork from its copy-on-write image
+    (like Redis BGSAVE), so even the copy stays off the event loop. This suits
+    very large datasets on Unix. If forking fails, the save is written from a
+    thread.
+    
+    Users who are only looked up get a record that isn't stored until they
+    are first updated, so the data grows with players rather than lookups.
+    Users idle for a long time are moved to a compressed archive by compact,
+    and restored from it when they are next looked up.
+    
+    Environment variables:
+        SNAPSHOT_KEEP: Number of previous data files to keep as data.json.1, .2, ... (default: 0)
+        SNAPSHOT_STRATEGY: How saves are written, thread or fork (default: thread)
+        COMPACTION_IDLE_DAYS: Days without changes after which compact archives a user (default: 90)
+        SAVE_INTERVAL: Maximum seconds a change waits to be saved, shared by the changes made meanwhile (default: 1)
+        WAIT_FOR_SAVE: Set to 1 to make updates wait until their change is saved (default: 0)
     """
     
-    def __init__(self, file_path: str = "data.json"):
+    def __init__(self, file_path: str = "data.json", serializer: Optional[Serializer] = None):
         self.file_path = file_path
+        self.serializer = serializer or get_serializer()
+        self.snapshot_keep = int(os.getenv("SNAPSHOT_KEEP", "0"))
+        self.snapshot_strategy = os.getenv("SNAPSHOT_STRATEGY", "thread").lower()
+        self.save_interval = float(os.getenv("SAVE_INTERVAL", "1"))
+        self.wait_for_save = os.getenv("WAIT_FOR_SAVE", "0") == "1"
+        if self.snapshot_strategy not in SNAPSHOT_STRATEGIES:
+            logger.warning(f"Unknown SNAPSHOT_STRATEGY '{self.snapshot_strategy}', using thread")
+            self.snapshot_strategy = "thread"
+        if self.snapshot_strategy == "fork" and not hasattr(os, "fork"):
+            logger.warning("SNAPSHOT_STRATEGY=fork isn't supported on this platform, using thread")
+            self.snapshot_strategy = "thread"
         self.data = {
             "users": {},
             "guilds": {},
@@ -26,87 +182,420 @@ class Database:
             }
         }
         self.lock = asyncio.Lock()  # Thread-safe operations
-        self._load_data()
+        self.columns = ColumnStore()  # Numeric user fields, shared by the UserRecords
+        self.sessions: Dict[tuple, float] = {}  # (user_id, kind) -> expiry time
+        
+        # Records of users who were looked up but never updated, while something uses them
+        self._virtual_users: "weakref.WeakValueDictionary[str, UserRecord]" = weakref.WeakValueDictionary()
+        
+        # Idle users moved out of the data file by compact
+        self.archive_path = os.path.splitext(file_path)[0] + ".archive.jsonl.gz"
+        self.archived_ids: set = set()
+        
+        # Users changed since the last snapshot
+        self._dirty_users: set = set()
+        self._next_save: Optional[asyncio.Future] = None  # Completes when the next snapshot is written
+        self._unsaved_since: Optional[float] = None  # When the oldest change not in a snapshot was made
+        self._save_now = asyncio.Event()  # Set by flush to write without waiting for the save interval
+        self._save_failures = 0  # Consecutive failed saves, for the retry backoff
+        self._writer: Optional[asyncio.Task] = None
+        
+        # The data file is loaded in the background (see start_loading)
+        self.load_seconds: Optional[float] = None
+        # Set if a data file exists but couldn't be loaded, so nothing overwrites it
+        self.load_error: Optional[Exception] = None
+        self._loaded = threading.Event()
+        self._load_thread: Optional[threading.Thread] = None
+    
+    def _snapshot_paths(self) -> List[str]:
+        """Get the data file and the rotated snapshots that exist, newest first."""
+        paths = [self.file_path] if os.path.exists(self.file_path) else []
+        index = 1
+        while os.path.exists(f"{self.file_path}.{index}"):
+            paths.append(f"{self.file_path}.{index}")
+            index += 1
+        return paths
     
     def _load_data(self):
-        """Load data from the JSON file if it exists."""
+        """
+        Load data from the data file (in any supported format) if it exists.
+        
+        Falls back to the rotated snapshots, but if files exist and none of them
+        loads, load_error is set instead of starting fresh, since the first save
+        would replace the file.
+        """
+        start = time.perf_counter()
         try:
-            if os.path.exists(self.file_path):
-                with open(self.file_path, 'r') as f:
-                    self.data = json.load(f)
-                logger.info(f"Loaded data from {self.file_path}")
-            else:
+            paths = self._snapshot_paths()
+            if not paths:
                 logger.info(f"No data file found at {self.file_path}, starting fresh")
+            for path in paths:
+                try:
+                    data = load_file(path)
+                except Exception as e:
+                    # Fall back to the previous snapshot
+                    logger.error(f"Error loading data from {path}: {e}")
+                    continue
+                columns = ColumnStore()
+                users = data.get("users", {})
+                data["users"] = {
+                    user_id: UserRecord.from_dict(user_data, columns, user_id)
+                    for user_id, user_data in users.items()
+                }
+                self.columns = columns
+                # Users in both were restored, and possibly saved before the archive was updated
+                self.archived_ids = set(data.get("archived_users", ())).difference(data["users"])
+                self.data = data
+                logger.info(f"Loaded data from {path}")
+                break
+            else:
+                if paths:
+                    self.load_error = RuntimeError(
+                        f"Couldn't load any of {', '.join(paths)}, refusing to start with empty data"
+                    )
         except Exception as e:
-            logger.error(f"Error loading data: {e}")
+            self.load_error = e
+        finally:
+            if self.load_error is not None:
+                logger.critical(f"Error loading data: {self.load_error}")
+            self.load_seconds = time.perf_counter() - start
+            self._loaded.set()
+    
+    def start_loading(self):
+        """Start loading the data file in a background thread, so startup can continue meanwhile."""
+        if self._load_thread is None:
+            self._load_thread = threading.Thread(target=self._load_data, name="database-load", daemon=True)
+            self._load_thread.start()
+    
+    @property
+    def loaded(self) -> bool:
+        """Whether the data file has been loaded."""
+        return self._loaded.is_set()
     
-    async def _save_data(self):
-        """Save data to the JSON file."""
+    async def wait_until_loaded(self):
+        """
+        Wait until the data file is loaded, starting the load if needed.
+        
+        Raises:
+            The load error, if the data file exists but couldn't be loaded
+        """
+        if not self._loaded.is_set():
+            self.start_loading()
+            await asyncio.to_thread(self._loaded.wait)
+        if self.load_error is not None:
+            raise RuntimeError(f"The data file couldn't be loaded: {self.load_error}")
+    
+    @asynccontextmanager
+    async def _locked(self):
+        """Hold the lock, recording how long it took to acquire."""
+        start = time.perf_counter()
         async with self.lock:
+            DB_LOCK_WAIT_SECONDS.observe(time.perf_counter() - start)
+            yield
+    
+    def _request_save(self) -> asyncio.Future:
+        """
+        Schedule a save of the current data.
+        
+        Returns:
+            A future that completes once a snapshot including the current data is written
+        """
+        if self.load_error is not None:
+            # Saving would replace the data file that failed to load
+            raise RuntimeError(f"The data file couldn't be loaded: {self.load_error}")
+        if self._next_save is None:
+            self._next_save = asyncio.get_running_loop().create_future()
+            self._unsaved_since = time.monotonic()
+        if self._writer is None or self._writer.done():
+            self._start_writer()
+        return self._next_save
+    
+    def _start_writer(self):
+        # A fresh context, so the saves aren't timed as part of the command that requested the first one
+        self._writer = asyncio.create_task(self._write_snapshots(), context=contextvars.Context())
+    
+    async def _commit(self, saved: asyncio.Future):
+        """Wait for a requested save only with WAIT_FOR_SAVE, otherwise the change is already committed in memory."""
+        if self.wait_for_save:
+            await asyncio.shield(saved)
+    
+    async def _write_snapshots(self):
+        """Write snapshots until no more saves are requested, each including the changes of one save interval."""
+        while self._next_save is not None:
+            delay = self._unsaved_since + self.save_interval - time.monotonic()
+            if delay > 0 and not self.wait_for_save and not self._save_now.is_set():
+                try:
+                    await asyncio.wait_for(self._save_now.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+            saved, self._next_save = self._next_save, None
+            unsaved_since, self._unsaved_since = self._unsaved_since, None
             try:
-                with open(self.file_path, 'w') as f:
-                    json.dump(self.data, f, indent=2)
-                logger.debug(f"Saved data to {self.file_path}")
+                if self.snapshot_strategy == "fork":
+                    await self._fork_snapshot()
+                else:
+                    await self._thread_snapshot()
             except Exception as e:
-                logger.error(f"Error saving data: {e}")
+                DB_SNAPSHOT_FAILURES.inc(self.snapshot_strategy)
+                self._save_failures += 1
+                retry_delay = min(SAVE_RETRY_MAX_SECONDS, max(self.save_interval, 1) * 2 ** (self._save_failures - 1))
+                logger.error(f"Error saving data (attempt {self._save_failures}, retrying in {retry_delay:g}s): {e}")
+                # Updates waiting for this save get the error (and nobody else has to look at it)
+                saved.set_exception(e)
+                saved.exception()
+                # The changes are still unsaved, so save them again
+                if self._next_save is None:
+                    self._next_save = asyncio.get_running_loop().create_future()
+                self._unsaved_since = min(unsaved_since, self._unsaved_since or unsaved_since)
+                if self._save_now.is_set():
+                    # Flushing, so report the failure instead of retrying forever
+                    raise
+                try:
+                    await asyncio.wait_for(self._save_now.wait(), retry_delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self._save_failures = 0
+            logger.debug(f"Saved data to {self.file_path}")
+            DB_SAVE_STALENESS_SECONDS.observe(time.monotonic() - unsaved_since)
+            saved.set_result(None)
     
+    async def _thread_snapshot(self):
+        """Copy the data on the loop, then encode and write it in a worker thread."""
+        with DB_SNAPSHOT_SECONDS.time(), span("db.snapshot"):
+            snapshot = self._snapshot()
+        await asyncio.to_thread(self._write_snapshot, snapshot)
+    
+    async def _fork_snapshot(self):
+        """Fork a child process that writes the data, and wait for it to exit."""
+        start = time.perf_counter()
+        with DB_SNAPSHOT_SECONDS.time(), span("db.snapshot"):
+            # The child reports an error through the pipe, since it can't log
+            error_read, error_write = os.pipe()
+            try:
+                pid = os.fork()
+            except OSError as e:
+                pid = None
+                os.close(error_read)
+                os.close(error_write)
+                logger.warning(f"Couldn't fork to save data ({e}), saving from a thread instead")
+        if pid is None:
+            await self._thread_snapshot()
+            return
+        if pid == 0:
+            os.close(error_read)
+            self._write_forked_snapshot(error_write)
+        
+        os.close(error_write)
+        # The child has the changes made so far
+        self._dirty_users.clear()
+        try:
+            _, status = await asyncio.to_thread(os.waitpid, pid, 0)
+            error = os.read(error_read, 4096).decode(errors="replace")
+        finally:
+            os.close(error_read)
+        exit_code = os.waitstatus_to_exitcode(status)
+        if exit_code != 0:
+            raise RuntimeError(f"Snapshot process {pid} exited with status {exit_code}: {error or 'no error reported'}")
+        DB_SAVE_SECONDS.observe(time.perf_counter() - start)
+    
+    def _write_forked_snapshot(self, error_fd: int):
+        """
+        Write the data from a forked child process, then exit it. Never returns.
+        
+        Other threads of the parent may have held locks at the fork (logging's,
+        the metrics'), and taking one would hang the child forever. So the child
+        only encodes and writes, with every logger silenced, and reports an error
+        through error_fd and its exit status.
+        """
+        status = 1
+        try:
+            # A collection would touch every object, copying the whole heap
+            gc.disable()
+            # Disabling a logger is a plain attribute (logging.disable() would take logging's lock)
+            logging.root.disabled = True
+            for child_logger in list(logging.root.manager.loggerDict.values()):
+                if isinstance(child_logger, logging.Logger):
+                    child_logger.disabled = True
+            self._write_file(self.data)
+            status = 0
+        except BaseException as e:
+            try:
+                os.write(error_fd, f"{type(e).__name__}: {e}".encode(errors="replace")[:4096])
+            except BaseException:
+                pass
+        finally:
+            os._exit(status)
+    
+    def _snapshot(self) -> Dict[str, Any]:
+        """Take a consistent copy of the data, which can be encoded in another thread."""
+        users = self.data["users"]
+        changed = {}
+        for user_id in self._dirty_users:
+            record = users.get(user_id)
+            if record is not None:
+                changed[user_id] = _detach(record.to_dict())
+        self._dirty_users.clear()
+        
+        snapshot = {"users": _UserSnapshot(dict(users), changed, self.columns)}
+        for key, value in self.data.items():
+            if key != "users":
+                snapshot[key] = _copy_value(value)
+        return snapshot
+    
+    def _write_snapshot(self, snapshot: Dict[str, Any]):
+        """Encode a snapshot and atomically replace the data file with it (off the event loop)."""
+        with DB_SAVE_SECONDS.time():
+            if isinstance(snapshot["users"], _UserSnapshot):
+                snapshot = {**snapshot, "users": snapshot["users"].to_dicts()}
+            self._write_file(snapshot)
+    
+    def _write_file(self, data: Dict[str, Any]):
+        """Encode data and atomically replace the data file with it. Takes no locks, so a forked child can call it."""
+        encoded = self.serializer.dumps(data, default=_encode)
+        temp_path = f"{self.file_path}.tmp"
+        try:
+            with open(temp_path, 'wb') as f:
+                f.write(encoded)
+                f.flush()
+                os.fsync(f.fileno())
+            if self.snapshot_keep > 0:
+                self._rotate_snapshots()
+            os.replace(temp_path, self.file_path)
+        except BaseException:
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
+            raise
+        _fsync_directory(os.path.dirname(os.path.abspath(self.file_path)))
+    
+    def _rotate_snapshots(self):
+        """Keep the current data file as data.json.1, shifting older snapshots up to SNAPSHOT_KEEP."""
+        if not os.path.exists(self.file_path):
+            return
+        for index in range(self.snapshot_keep - 1, 0, -1):
+            older = f"{self.file_path}.{index}"
+            if os.path.exists(older):
+                os.replace(older, f"{self.file_path}.{index + 1}")
+        newest = f"{self.file_path}.1"
+        if os.path.exists(newest):
+            os.unlink(newest)
+        try:
+            # The data file is replaced (not modified) by the next save, so a hard link is enough
+            os.link(self.file_path, newest)
+        except OSError:
+            shutil.copy2(self.file_path, newest)
+    
+    async def flush(self):
+        """
+        Write every requested save now, and wait until they have been written.
+        
+        Raises the error if a save fails (the changes stay unsaved, and are retried by the next save).
+        """
+        self._save_now.set()
+        try:
+            if self._next_save is not None and (self._writer is None or self._writer.done()):
+                # Changes left unsaved by a failed flush
+                self._start_writer()
+            while self._writer is not None and not self._writer.done():
+                await asyncio.shield(self._writer)
+        finally:
+            self._save_now.clear()
+    
+    @timed
     async def get_user(self, user_id: str) -> Dict[str, Any]:
-        """Get user data or create a new user if they don't exist."""
+        """Get user data, with default values if they don't exist."""
+        await self.wait_until_loaded()
         user_id = str(user_id)  # Ensure ID is a string
-        async with self.lock:
-            if user_id not in self.data["users"]:
-                # Initialize new user with default values
-                self.data["users"][user_id] = {
-                    "cash": 1000,
-                    "level": 0,
-                    "xp": 0,
-                    "games_played": 0,
-                    "wins": 0,
-                    "losses": 0,
-                    "total_cash_won": 0,
-                    "total_cash_lost": 0,
-                    "items": [],
-                    "boosts": [],
-                    "cooldowns": {},
-                    "vote_streak": 0,
-                    "last_vote": None,
-                    "mine": None
-                }
-                await self._save_data()
-            
-            return self.data["users"][user_id]
+        user = self.data["users"].get(user_id)
+        if user is not None:
+            return user
+        
+        if user_id in self.archived_ids:
+            user = await self._restore_user(user_id)
+            if user is not None:
+                return user
+        
+        # Users who are only looked up aren't stored until they are updated
+        user = self._virtual_users.get(user_id)
+        if user is None:
+            user = self._virtual_users[user_id] = UserRecord()
+        return user
     
+    @timed
     async def update_user(self, user_id: str, data: Dict[str, Any]):
-        """Update user data."""
+        """Update user data, storing the user if they are new."""
+        await self.wait_until_loaded()
         user_id = str(user_id)  # Ensure ID is a string
-        async with self.lock:
-            self.data["users"][user_id].update(data)
-            await self._save_data()
+        if user_id not in self.data["users"] and user_id in self.archived_ids:
+            await self._restore_user(user_id)
+        async with self._locked():
+            user = self.data["users"].get(user_id)
+            if user is None:
+                user = self._virtual_users.pop(user_id, None)
+                if user is None:
+                    user = UserRecord()
+                user.move_to(self.columns, user_id)
+                self.data["users"][user_id] = user
+            user.update(data)
+            user["last_active"] = time.time()
+            self._dirty_users.add(user_id)
+            saved = self._request_save()
+        
+        await self._commit(saved)
     
-    async def get_leaderboard(self, field: str = "cash", limit: int = 10) -> List[Dict[str, Any]]:
-        """Get a sorted leaderboard based on a specific field."""
-        async with self.lock:
-            # Sort users by the specified field
-            sorted_users = sorted(
-                [(user_id, user_data) for user_id, user_data in self.data["users"].items()],
-                key=lambda x: x[1].get(field, 0),
-                reverse=True
-            )[:limit]
-            
-            # Format the leaderboard data
-            return [{"id": user_id, **user_data} for user_id, user_data in sorted_users]
+    @timed
+    async def get_leaderboard(self, field: str = "cash", limit: int = 10, user_ids: Optional[Iterable[str]] = None) -> List[Dict[str, Any]]:
+        """
+        Get a sorted leaderboard based on a specific field.
+        
+        Args:
+            field: The field to rank by
+            limit: Number of users
+            user_ids: Only rank these users (e.g. a guild's members)
+        """
+        await self.wait_until_loaded()
+        async with self._locked():
+            return self._leaderboard(field, limit, user_ids)
+    
+    def _leaderboard(self, field: str, limit: int, user_ids: Optional[Iterable[str]] = None) -> List[Dict[str, Any]]:
+        """Get the top users by a field, using the column store for numeric fields."""
+        users = self.data.get("users", {})
+        candidates = users if user_ids is None else [user_id for user_id in user_ids if user_id in users]
+        if field in NUMERIC_COLUMNS:
+            rows = None if user_ids is None else [users[user_id].row for user_id in candidates]
+            user_ids = [user_id for user_id, _ in self.columns.top_k(field, limit, rows)]
+        else:
+            user_ids = sorted(candidates, key=lambda user_id: users[user_id].get(field, 0), reverse=True)[:limit]
+        
+        # Format the leaderboard data (the dashboard thread may see users being archived)
+        leaderboard = []
+        for user_id in user_ids:
+            user = users.get(user_id)
+            if user is not None:
+                leaderboard.append({"id": user_id, **user.to_dict(sparse=False)})
+        return leaderboard
     
     async def update_stats(self, bet_amount: int, result: bool):
-        """Update global stats for bets."""
-        async with self.lock:
-            self.data["global_stats"]["total_bets"] += 1
-            
-            if result:  # Win
-                self.data["global_stats"]["total_cash_won"] += bet_amount
-            else:  # Loss
-                self.data["global_stats"]["total_cash_lost"] += bet_amount
-            
-            await self._save_data()
+        """Update global stats for a bet."""
+        if result:  # Win
+            await self.add_stats(1, bet_amount, 0)
+        else:  # Loss
+            await self.add_stats(1, 0, bet_amount)
+    
+    @timed
+    async def add_stats(self, bets: int, cash_won: int, cash_lost: int):
+        """Add a batch of bets to the global stats."""
+        await self.wait_until_loaded()
+        async with self._locked():
+            global_stats = self.data["global_stats"]
+            global_stats["total_bets"] += bets
+            global_stats["total_cash_won"] += cash_won
+            global_stats["total_cash_lost"] += cash_lost
+            saved = self._request_save()
+        
+        await self._commit(saved)
     
     async def get_all_cooldowns(self, user_id: str) -> Dict[str, Any]:
         """Get all cooldowns for a user."""
@@ -117,11 +606,236 @@ class Database:
         """Set a cooldown for a specific command."""
         user = await self.get_user(user_id)
         
-        if "cooldowns" not in user:
-            user["cooldowns"] = {}
-        
-        user["cooldowns"][command] = expiry_time
+        # Replaced rather than modified, since a save thread may be reading it
+        user["cooldowns"] = {**user.get("cooldowns", {}), command: expiry_time}
         await self.update_user(user_id, user)
 
+    async def claim_session(self, user_id: str, kind: str, ttl: float = 600) -> bool:
+        """
+        Claim an exclusive session (e.g. an active blackjack game) for a user.
+        
+        Args:
+            user_id: The ID of the user
+            kind: The kind of session
+            ttl: Seconds after which an unreleased session expires
+        
+        Returns:
+            True if the session was claimed, False if the user already has one
+        """
+        await self.wait_until_loaded()
+        key = (str(user_id), kind)
+        now = time.time()
+        if self.sessions.get(key, 0) > now:
+            return False
+        self.sessions[key] = now + ttl
+        return True
+    
+    async def release_session(self, user_id: str, kind: str):
+        """Release a session claimed with claim_session."""
+        self.sessions.pop((str(user_id), kind), None)
+    
+    async def compact(self, idle_days: Optional[float] = None) -> Dict[str, int]:
+        """
+        Archive idle users and drop expired cooldowns, to shrink the data file and memory use.
+        
+        Archived users are appended to a gzip-compressed JSON lines file next to
+        the data file before they are removed, and their IDs are kept so they can
+        be restored when they are next looked up.
+        
+        Args:
+            idle_days: Days without changes after which a user is archived (default: COMPACTION_IDLE_DAYS)
+        
+        Returns:
+            The number of users archived, cooldowns dropped and users left
+        """
+        await self.wait_until_loaded()
+        if idle_days is None:
+            idle_days = float(os.getenv("COMPACTION_IDLE_DAYS", "90"))
+        now = time.time()
+        cutoff = now - idle_days * 86400
+        users = self.data["users"]
+        
+        async with self._locked():
+            cooldowns_dropped = self._drop_expired_cooldowns(now)
+            last_active = self.columns.columns["last_active"]
+            ids = self.columns.ids
+            idle = {}
+            for row, seen in enumerate(last_active):
+                if seen == 0:
+                    # Saved before last_active existed, so start the clock now
+                    last_active[row] = now
+                    self._dirty_users.add(ids[row])
+                elif seen < cutoff:
+                    idle[ids[row]] = _detach(users[ids[row]].to_dict())
+        
+        # The archive has to be written before the users are removed from the data file
+        if idle:
+            await asyncio.to_thread(self._append_archive, idle)
+        
+        async with self._locked():
+            # Users who became active while the archive was written stay
+            archived = [
+                user_id for user_id in idle
+                if user_id in users and users[user_id]["last_active"] < cutoff
+            ]
+            for user_id in archived:
+                del users[user_id]
+                self._dirty_users.add(user_id)
+            if archived:
+                self.archived_ids.update(archived)
+                # A tuple is never modified, so snapshots don't need to copy it
+                self.data["archived_users"] = tuple(sorted(self.archived_ids))
+                self._rebuild_columns()
+            saved = self._request_save()
+        
+        await asyncio.shield(saved)
+        logger.info(
+            f"Compacted data: archived {len(archived)} users idle for {idle_days:g} days, "
+            f"dropped {cooldowns_dropped} expired cooldowns, {len(users)} users left"
+        )
+        return {"archived": len(archived), "cooldowns_dropped": cooldowns_dropped, "users": len(users)}
+    
+    def _drop_expired_cooldowns(self, now: float) -> int:
+        """Remove expired cooldowns from every user. Must be called with the lock held."""
+        dropped = 0
+        for user_id, user in self.data["users"].items():
+            cooldowns = getattr(user, "cooldowns", None)
+            if not cooldowns:
+                continue
+            expired = [command for command, expiry_time in cooldowns.items() if expiry_time <= now]
+            if not expired:
+                continue
+            remaining = {command: expiry_time for command, expiry_time in cooldowns.items() if expiry_time > now}
+            if remaining:
+                user["cooldowns"] = remaining
+            else:
+                del user["cooldowns"]
+            dropped += len(expired)
+            self._dirty_users.add(user_id)
+        return dropped
+    
+    def _rebuild_columns(self):
+        """Move the users' numeric fields to a new column store without the removed users' rows."""
+        users = list(self.data["users"].values())
+        columns = self.columns.take([user.row for user in users])
+        for row, user in enumerate(users):
+            user.rebind(columns, row)
+        self.columns = columns
+    
+    def _append_archive(self, users: Dict[str, Dict[str, Any]]):
+        """Append users to the archive file as a new gzip member (runs in a worker thread)."""
+        lines = b"".join(f"{user_id}\t{json.dumps(user)}\n".encode() for user_id, user in users.items())
+        with open(self.archive_path, 'ab') as raw:
+            with gzip.GzipFile(fileobj=raw, mode='wb') as f:
+                f.write(lines)
+            raw.flush()
+            os.fsync(raw.fileno())
+    
+    def _read_archived(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """Find the latest archived data of a user (runs in a worker thread)."""
+        prefix = f"{user_id}\t".encode()
+        found = None
+        try:
+            with gzip.open(self.archive_path, 'rb') as f:
+                for line in f:
+                    if line.startswith(prefix):
+                        found = line[len(prefix):]
+        except FileNotFoundError:
+            return None
+        except (EOFError, gzip.BadGzipFile) as e:
+            # An append was interrupted, the earlier members are still readable
+            logger.warning(f"Archive {self.archive_path} is truncated: {e}")
+        return json.loads(found) if found is not None else None
+    
+    async def _restore_user(self, user_id: str) -> Optional[UserRecord]:
+        """Move an archived user back into the data."""
+        data = await asyncio.to_thread(self._read_archived, user_id)
+        async with self._locked():
+            user = self.data["users"].get(user_id)
+            if user is not None:
+                # Restored meanwhile
+                return user
+            if user_id not in self.archived_ids:
+                return None
+            self.archived_ids.discard(user_id)
+            self.data["archived_users"] = tuple(sorted(self.archived_ids))
+            if data is None:
+                logger.error(f"User {user_id} is missing from the archive {self.archive_path}")
+                return None
+            user = self.data["users"][user_id] = UserRecord.from_dict(data, self.columns, user_id)
+            # Otherwise the next compaction would archive them again straight away
+            user["last_active"] = time.time()
+            self._dirty_users.add(user_id)
+            saved = self._request_save()
+        
+        # Until the save, the user is still in the archive
+        await self._commit(saved)
+        logger.info(f"Restored user {user_id} from the archive")
+        return user
+    
+    def snapshot_stats(self) -> Dict[str, Any]:
+        """Get the global stats without waiting for the lock (for the dashboard)."""
+        return dict(self.data.get("global_stats", {
+            "total_bets": 0,
+            "total_cash_won": 0,
+            "total_cash_lost": 0
+        }))
+    
+    def snapshot_leaderboard(self, field: str = "cash", limit: int = 10, user_ids: Optional[Iterable[str]] = None) -> List[Dict[str, Any]]:
+        """Get a leaderboard without waiting for the lock (for the dashboard)."""
+        return self._leaderboard(field, limit, user_ids)
+    
+    def snapshot_aggregates(self) -> Dict[str, Any]:
+        """Get the user count and the sum of each numeric user field (for the dashboard)."""
+        columns = self.columns
+        aggregates: Dict[str, Any] = {"users": len(columns), "archived_users": len(self.archived_ids)}
+        for field in STAT_COLUMNS:
+            aggregates[field] = columns.sum(field)
+        return aggregates
+    
+    def snapshot_histogram(self, field: str, bins: int = 10) -> Dict[str, List[float]]:
+        """
+        Get the distribution of a numeric user field (for the dashboard).
+        
+        Args:
+            field: One of the numeric user fields
+            bins: Number of equal-width bins
+        
+        Returns:
+            {"edges": bins + 1 bin edges, "counts": users per bin}
+        """
+        return self.columns.histogram(field, bins)
+
+def create_database(backend: Optional[str] = None, file_path: Optional[str] = None):
+    """
+    Create a database backend, by default the one selected in the environment.
+    
+    Args:
+        backend: "json" (single process), "sqlite" (safe across processes)
+            or "tiered" (hot cache over SQLite, single process)
+        file_path: Path of the data file
+    
+    Environment variables:
+        DATABASE_BACKEND: Default backend (default: json)
+        DATABASE_FILE: Default path of the data file (default: data.json, or data.sqlite3 for sqlite and tiered)
+        DATA_FORMAT: Encoding of the json backend's data file, json or msgpack (default: json)
+    """
+    backend = (backend or os.getenv("DATABASE_BACKEND", "json")).lower()
+    file_path = file_path or os.getenv("DATABASE_FILE")
+    
+    if backend == "sqlite":
+        from utils.sqlite_store import SQLiteDatabase
+        return SQLiteDatabase(file_path or "data.sqlite3")
+    
+    if backend == "tiered":
+        from utils.sqlite_store import SQLiteDatabase
+        from utils.tiered_store import TieredDatabase
+        return TieredDatabase(SQLiteDatabase(file_path or "data.sqlite3"))
+    
+    if backend != "json":
+        logger.warning(f"Unknown DATABASE_BACKEND '{backend}', using json")
+    
+    return Database(file_path or "data.json")
+
 # Create a global instance for use throughout the bot
-db = Database()
+db = create_database()
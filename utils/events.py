@@ -0,0 +1,179 @@
+"""
+In-process event bus for the side effects of commands.
+
+Commands publish a typed event once the user's new balance is committed
+(a settled bet, a claimed reward, a level-up) and reply straight away.
+Publishing only appends the event to a list. Every EVENT_BATCH_INTERVAL
+seconds the waiting events are delivered off the response path, each
+subscriber getting its events in one batch, in the order they were
+published, so a subscriber can write a whole batch at once (e.g. one stats
+update for a hundred bets).
+
+Events are only kept in memory, so on shutdown the bus must be flushed
+before the stores its subscribers write to.
+"""
+import os
+import time
+import asyncio
+import contextvars
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, Type
+from utils.metrics import counter, gauge, histogram
+
+logger = logging.getLogger(__name__)
+
+EVENTS_PUBLISHED = counter("events_published_total", "Events published on the event bus", ["type"])
+EVENT_HANDLER_ERRORS = counter("event_handler_errors_total", "Event subscribers that raised an error", ["handler"])
+EVENT_DISPATCH_SECONDS = histogram("event_dispatch_seconds", "Time taken to deliver a batch of events to every subscriber")
+EVENTS_PENDING = gauge("events_pending", "Events waiting to be delivered")
+
+class BetSettled:
+    """A game finished and its winnings (or loss) were applied to the user's cash."""
+
+    __slots__ = ("ts", "user_id", "guild_id", "economy", "account", "game", "bet", "amount", "balance", "outcome")
+
+    def __init__(
+        self,
+        user_id: str,
+        guild_id: Optional[int],
+        economy,
+        account: str,
+        game: str,
+        bet: int,
+        amount: int,
+        balance: int,
+        outcome: str,
+        ts: Optional[float] = None
+    ):
+        self.ts = time.time() if ts is None else ts
+        self.user_id = user_id
+        self.guild_id = guild_id
+        self.economy = economy
+        self.account = account
+        self.game = game
+        self.bet = bet
+        self.amount = amount
+        self.balance = balance
+        self.outcome = outcome
+
+    @property
+    def won(self) -> bool:
+        """Whether the user won cash (a push counts as a loss in the global stats)."""
+        return self.amount > 0
+
+    def __repr__(self) -> str:
+        return f"BetSettled({self.user_id!r}, {self.game!r}, bet={self.bet}, amount={self.amount}, {self.outcome!r})"
+
+class RewardClaimed:
+    """A user claimed a reward command's cash (work, daily or vote)."""
+
+    __slots__ = ("ts", "user_id", "guild_id", "economy", "account", "source", "amount", "balance")
+
+    def __init__(
+        self,
+        user_id: str,
+        guild_id: Optional[int],
+        economy,
+        account: str,
+        source: str,
+        amount: int,
+        balance: int,
+        ts: Optional[float] = None
+    ):
+        self.ts = time.time() if ts is None else ts
+        self.user_id = user_id
+        self.guild_id = guild_id
+        self.economy = economy
+        self.account = account
+        self.source = source
+        self.amount = amount
+        self.balance = balance
+
+    def __repr__(self) -> str:
+        return f"RewardClaimed({self.user_id!r}, {self.source!r}, amount={self.amount})"
+
+Handler = Callable[[List[Any]], Awaitable[None]]
+
+class EventBus:
+    """
+    Delivers published events to their subscribers in batches.
+
+    Environment variables:
+        EVENT_BATCH_INTERVAL: Maximum seconds an event waits before being delivered (default: 0.05)
+    """
+
+    def __init__(self, batch_interval: Optional[float] = None):
+        self.batch_interval = batch_interval or float(os.getenv("EVENT_BATCH_INTERVAL", "0.05"))
+        self._handlers: Dict[Type, List[Handler]] = {}
+        self._pending: List[Any] = []
+        self._dispatch_task: Optional[asyncio.Task] = None
+        self._dispatch_lock: Optional[asyncio.Lock] = None
+
+        EVENTS_PENDING.set_function(lambda: {(): len(self._pending)})
+
+    def subscribe(self, handler: Handler, *event_types: Type):
+        """
+        Call an async handler with each batch of events of the given types.
+
+        Subscribing a handler again does nothing, so setup code that runs more
+        than once (a bot logged in again) doesn't get each batch twice.
+
+        Args:
+            handler: Called with a list of events, oldest first
+            event_types: The event classes the handler receives
+        """
+        for event_type in event_types:
+            handlers = self._handlers.setdefault(event_type, [])
+            if handler not in handlers:
+                handlers.append(handler)
+
+    def publish(self, event: Any):
+        """Queue an event for its subscribers. Never waits, so it is safe on the response path."""
+        event_type = type(event)
+        EVENTS_PUBLISHED.inc(event_type.__name__)
+        if event_type not in self._handlers:
+            return
+        self._pending.append(event)
+        self._schedule_dispatch()
+
+    def _schedule_dispatch(self):
+        if self._dispatch_task is None or self._dispatch_task.done():
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                # No event loop (scripts), events are delivered by flush()
+                return
+            # A fresh context, so the batches aren't timed as part of the command that published first
+            self._dispatch_task = loop.create_task(self._dispatch_loop(), context=contextvars.Context())
+
+    async def _dispatch_loop(self):
+        """Deliver events every batch_interval seconds while there are any."""
+        while self._pending:
+            await asyncio.sleep(self.batch_interval)
+            await self.flush()
+
+    async def flush(self):
+        """Deliver every waiting event."""
+        if self._dispatch_lock is None:
+            self._dispatch_lock = asyncio.Lock()
+        async with self._dispatch_lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, []
+            # Each handler gets its events in one list, in publish order
+            batches: Dict[Handler, List[Any]] = {}
+            for event in batch:
+                for handler in self._handlers.get(type(event), ()):
+                    batches.setdefault(handler, []).append(event)
+            start = time.perf_counter()
+            handlers: List[Tuple[Handler, List[Any]]] = list(batches.items())
+            results = await asyncio.gather(*(handler(events) for handler, events in handlers), return_exceptions=True)
+            EVENT_DISPATCH_SECONDS.observe(time.perf_counter() - start)
+            for (handler, events), result in zip(handlers, results):
+                if isinstance(result, BaseException):
+                    name = getattr(handler, "__qualname__", repr(handler))
+                    EVENT_HANDLER_ERRORS.inc(name)
+                    logger.error(f"Error in event subscriber {name} ({len(events)} events): {result}")
+
+# Create a global instance for use throughout the bot
+bus = EventBus()
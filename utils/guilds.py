@@ -0,0 +1,158 @@
+"""
+Per-guild data, partitioned into one data file per guild.
+
+Each guild's partition holds its member index (the users who have played
+in it) and its settings. By default guilds share the global economy, and
+a guild leaderboard ranks only the members in the index. A guild can
+switch to a server economy, where its members have separate cash, levels
+and stats stored in its partition.
+
+Partitions are loaded on first use and saved independently, each with its
+own lock, so busy guilds don't wait on each other or on the global data. A
+guild is only ever served by the shard that owns it, so its partition is
+only used by one bot process, even in a cluster. Partitions always use the
+json backend (in any DATA_FORMAT), whatever DATABASE_BACKEND is.
+"""
+import os
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Set
+from utils.database import Database, db
+
+logger = logging.getLogger(__name__)
+
+ECONOMY_MODES = ("global", "server")
+
+class GuildPartition(Database):
+    """One guild's data file: its member index, its settings and its server economy users."""
+
+    def __init__(self, guild_id: str, file_path: str):
+        super().__init__(file_path)
+        self.guild_id = guild_id
+        self._members: Optional[Set[str]] = None
+
+    @property
+    def members(self) -> Set[str]:
+        """IDs of the users who have played in the guild."""
+        if self._members is None:
+            self._members = set(self.data.get("members", ()))
+        return self._members
+
+    @property
+    def member_ids(self) -> tuple:
+        """The member index as a tuple, which is never modified, so other threads can read it."""
+        return tuple(self.data.get("members", ()))
+
+    def add_member(self, user_id: str):
+        """Add a user to the member index."""
+        if user_id in self.members:
+            return
+        self.members.add(user_id)
+        # A tuple is never modified, so snapshots don't need to copy it
+        self.data["members"] = self.member_ids + (user_id,)
+        self._request_save()
+
+    @property
+    def settings(self) -> Dict[str, Any]:
+        """The guild's settings (replaced, never modified, when they change)."""
+        return self.data.get("settings", {})
+
+    @property
+    def server_economy(self) -> bool:
+        """Whether the guild has its own economy instead of the global one."""
+        return self.settings.get("economy") == "server"
+
+    async def set_setting(self, key: str, value: Any):
+        """Change one of the guild's settings and save it."""
+        await self.wait_until_loaded()
+        async with self._locked():
+            self.data["settings"] = {**self.settings, key: value}
+            saved = self._request_save()
+        await self._commit(saved)
+
+    async def set_economy(self, mode: str):
+        """
+        Switch the guild between the global economy and its own server economy.
+
+        Server economy users are kept when switching back to the global economy,
+        so switching again restores them.
+
+        Args:
+            mode: "global" or "server"
+        """
+        if mode not in ECONOMY_MODES:
+            raise ValueError(f"Unknown economy mode: {mode}")
+        await self.set_setting("economy", mode)
+
+class GuildEconomies:
+    """
+    The loaded guild partitions, and the economy each guild uses.
+
+    Environment variables:
+        GUILD_DATA_DIR: Directory of the guild data files (default: guilds)
+    """
+
+    def __init__(self, global_db, directory: Optional[str] = None):
+        self.global_db = global_db
+        self.directory = directory or os.getenv("GUILD_DATA_DIR", "guilds")
+        self.partitions: Dict[str, GuildPartition] = {}
+
+    async def partition(self, guild_id: Any) -> GuildPartition:
+        """Get a guild's partition, loading it if needed."""
+        guild_id = str(guild_id)
+        partition = self.partitions.get(guild_id)
+        if partition is None:
+            os.makedirs(self.directory, exist_ok=True)
+            partition = self.partitions[guild_id] = GuildPartition(guild_id, os.path.join(self.directory, f"{guild_id}.json"))
+        # Concurrent first uses share one load
+        await partition.wait_until_loaded()
+        return partition
+
+    async def economy(self, guild_id: Optional[Any], user_id: Optional[str] = None):
+        """
+        Get the database a guild's economy is stored in.
+
+        Args:
+            guild_id: The ID of the guild, or None outside guilds (the global economy)
+            user_id: A user playing in the guild, added to its member index
+
+        Returns:
+            The guild's partition for a server economy, otherwise the global database
+        """
+        if guild_id is None:
+            return self.global_db
+        partition = await self.partition(guild_id)
+        if user_id is not None:
+            partition.add_member(str(user_id))
+        return partition if partition.server_economy else self.global_db
+
+    async def get_leaderboard(self, guild_id: Any, field: str = "cash", limit: int = 10) -> List[Dict[str, Any]]:
+        """Get a guild's leaderboard, touching only its members."""
+        partition = await self.partition(guild_id)
+        if partition.server_economy:
+            return await partition.get_leaderboard(field, limit)
+        return await self.global_db.get_leaderboard(field, limit, partition.member_ids)
+
+    async def flush(self):
+        """Wait until every partition's requested saves have been written."""
+        await asyncio.gather(*(partition.flush() for partition in list(self.partitions.values())))
+
+    async def compact(self):
+        """Archive idle users of the loaded server economies."""
+        for partition in list(self.partitions.values()):
+            if partition.server_economy:
+                await partition.compact()
+
+    async def unload(self, guild_id: Any):
+        """Save a guild's partition and drop it from memory (e.g. after leaving the guild)."""
+        partition = self.partitions.pop(str(guild_id), None)
+        if partition is not None:
+            await partition.flush()
+
+def ledger_account(economy, user_id: str) -> str:
+    """Get a user's ledger account in an economy (server economies have their own accounts)."""
+    guild_id = getattr(economy, "guild_id", None)
+    return f"{guild_id}:{user_id}" if guild_id is not None else user_id
+
+# Create a global instance for use throughout the bot
+guild_economies = GuildEconomies(db)
@@ -0,0 +1,344 @@
+"""
+Append-only ledger of every change to a user's cash.
+
+Each entry is one double-entry transaction: the amount moves between the
+user's account and a contra account ("house" for games, "rewards" for work,
+daily and vote rewards), so the contra account balances are the house's
+profit and the cash paid out. Entries also record the user's balance after
+the change, the command that made it and, for games, the bet and outcome.
+
+Recording an entry only appends it to a list in memory. Entries are written
+to SQLite in batches on a worker thread, every LEDGER_FLUSH_INTERVAL seconds
+or as soon as LEDGER_BATCH_SIZE of them are waiting, so the bet path never
+waits on the disk. To inspect the ledger:
+
+    python -m utils.ledger history USER_ID [--limit 20]
+    python -m utils.ledger reconcile [--data data.json]
+"""
+import os
+import time
+import sqlite3
+import asyncio
+import contextvars
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+from utils.metrics import counter, gauge, histogram
+
+logger = logging.getLogger(__name__)
+
+LEDGER_ENTRIES = counter("ledger_entries_total", "Cash movements recorded in the ledger", ["source"])
+LEDGER_FLUSH_SECONDS = histogram("ledger_flush_seconds", "Time taken to write a batch of ledger entries")
+LEDGER_PENDING = gauge("ledger_pending_entries", "Ledger entries not yet written")
+
+# Contra accounts
+HOUSE = "house"
+REWARDS = "rewards"
+
+# SQLite integers are 64-bit, larger amounts are stored as text
+MAX_SQL_INT = 2**63 - 1
+
+# (ts, user_id, contra, amount, balance, source, bet, outcome)
+Entry = Tuple[float, str, str, Any, Any, str, Any, Optional[str]]
+
+COLUMNS = ("ts", "user_id", "contra", "amount", "balance", "source", "bet", "outcome")
+
+def _to_sql(value: Any) -> Any:
+    """Convert an amount to a value SQLite stores exactly."""
+    if value is None:
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    if isinstance(value, int) and abs(value) > MAX_SQL_INT:
+        return str(value)
+    return value
+
+def _from_sql(value: Any) -> Any:
+    return int(value) if isinstance(value, str) else value
+
+class Ledger:
+    """
+    Batched writer and reader for the ledger.
+
+    Environment variables:
+        LEDGER_FILE: SQLite file for the ledger (default: ledger.sqlite3)
+        LEDGER_FLUSH_INTERVAL: Maximum seconds an entry waits before being written (default: 1)
+        LEDGER_BATCH_SIZE: Number of waiting entries that triggers a write straight away (default: 1000)
+    """
+
+    def __init__(self, file_path: Optional[str] = None, flush_interval: Optional[float] = None, batch_size: Optional[int] = None):
+        self.file_path = file_path or os.getenv("LEDGER_FILE", "ledger.sqlite3")
+        self.flush_interval = flush_interval or float(os.getenv("LEDGER_FLUSH_INTERVAL", "1"))
+        self.batch_size = batch_size or int(os.getenv("LEDGER_BATCH_SIZE", "1000"))
+        self._pending: List[Entry] = []
+        self._local = threading.local()
+        # A single worker, so reads queued after a write see it
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ledger")
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._batch_full: Optional[asyncio.Event] = None
+
+        LEDGER_PENDING.set_function(lambda: {(): len(self._pending)})
+
+    def _conn(self) -> sqlite3.Connection:
+        """Get the connection for the current thread, creating the schema on first use."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.file_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            # Amounts have no declared type, so text amounts beyond 64 bits aren't converted to floats
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "id INTEGER PRIMARY KEY, ts REAL NOT NULL, user_id TEXT NOT NULL, contra TEXT NOT NULL, "
+                "amount NOT NULL, balance NOT NULL, source TEXT NOT NULL, bet, outcome TEXT)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_user_ts ON entries (user_id, ts)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_ts ON entries (ts)")
+            self._local.conn = conn
+        return conn
+
+    def record(
+        self,
+        user_id: str,
+        amount: int,
+        balance: int,
+        source: str,
+        contra: str = HOUSE,
+        bet: Optional[int] = None,
+        outcome: Optional[str] = None,
+        ts: Optional[float] = None
+    ):
+        """
+        Record a change to a user's cash, in the order the changes were made.
+
+        Args:
+            user_id: The ID of the user
+            amount: Cash credited to the user (negative for a debit)
+            balance: The user's cash after the change
+            source: The command that made the change
+            contra: The account the cash came from or went to
+            bet: The amount bet, for games
+            outcome: The outcome of the game ("win", "loss" or "push")
+            ts: When the change was made (default: now)
+        """
+        ts = time.time() if ts is None else ts
+        self._pending.append((ts, str(user_id), contra, amount, balance, source, bet, outcome))
+        LEDGER_ENTRIES.inc(source)
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        if self._flush_task is None or self._flush_task.done():
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                # No event loop (scripts), entries are written by flush()
+                return
+            self._batch_full = asyncio.Event()
+            # A fresh context, so the flushes aren't timed as part of the command that recorded first
+            self._flush_task = loop.create_task(self._flush_loop(), context=contextvars.Context())
+        elif len(self._pending) >= self.batch_size:
+            self._batch_full.set()
+
+    async def _flush_loop(self):
+        """Write entries every flush_interval seconds (or when a batch fills up) while there are any."""
+        while self._pending:
+            try:
+                await asyncio.wait_for(self._batch_full.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._batch_full.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Error writing ledger entries: {e}")
+
+    async def flush(self):
+        """Write every waiting entry."""
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, []
+            loop = asyncio.get_running_loop()
+            start = time.perf_counter()
+            try:
+                await loop.run_in_executor(self._executor, self._write, batch)
+            except BaseException:
+                # Put the batch back in front of anything recorded meanwhile
+                self._pending[:0] = batch
+                raise
+            finally:
+                LEDGER_FLUSH_SECONDS.observe(time.perf_counter() - start)
+
+    def _write(self, batch: List[Entry]):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                f"INSERT INTO entries ({', '.join(COLUMNS)}) VALUES ({', '.join('?' for _ in COLUMNS)})",
+                [(ts, user_id, contra, _to_sql(amount), _to_sql(balance), source, _to_sql(bet), outcome)
+                 for ts, user_id, contra, amount, balance, source, bet, outcome in batch]
+            )
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def flush_sync(self):
+        """Write every waiting entry from code without an event loop."""
+        batch, self._pending = self._pending, []
+        if batch:
+            self._write(batch)
+
+    @staticmethod
+    def _entry_to_dict(entry: Entry) -> Dict[str, Any]:
+        return dict(zip(COLUMNS, entry))
+
+    def _history(self, user_id: str, limit: int, before: Optional[float]) -> List[Dict[str, Any]]:
+        query = f"SELECT {', '.join(COLUMNS)} FROM entries WHERE user_id = ?"
+        params: List[Any] = [user_id]
+        if before is not None:
+            query += " AND ts < ?"
+            params.append(before)
+        query += " ORDER BY ts DESC, id DESC LIMIT ?"
+        params.append(limit)
+        entries = []
+        for row in self._conn().execute(query, params):
+            entry = dict(row)
+            for field in ("amount", "balance", "bet"):
+                entry[field] = _from_sql(entry[field])
+            entries.append(entry)
+        return entries
+
+    async def history(self, user_id: str, limit: int = 10, before: Optional[float] = None) -> List[Dict[str, Any]]:
+        """
+        Get a user's most recent entries, newest first.
+
+        Args:
+            user_id: The ID of the user
+            limit: Maximum number of entries
+            before: Only entries before this timestamp (for paging)
+
+        Returns:
+            Entries as dicts with the ts, user_id, contra, amount, balance, source, bet and outcome
+        """
+        user_id = str(user_id)
+        # Entries that are being written are committed before the query runs on the same
+        # worker, so only the waiting ones need adding (and nothing is counted twice)
+        pending = [
+            self._entry_to_dict(entry) for entry in reversed(self._pending)
+            if entry[1] == user_id and (before is None or entry[0] < before)
+        ][:limit]
+        loop = asyncio.get_running_loop()
+        stored = await loop.run_in_executor(self._executor, self._history, user_id, limit - len(pending), before)
+        return pending + stored
+
+    def _reconcile(self, balances: Optional[Mapping[str, Any]] = None) -> Dict[str, Any]:
+        entries = 0
+        users = 0
+        contra_balances: Dict[str, Any] = {}
+        breaks = []
+        mismatches = []
+
+        def check_final(user_id: str, balance: Any):
+            if balances is not None and user_id in balances and balances[user_id] != balance:
+                mismatches.append({"user_id": user_id, "ledger": balance, "cash": balances[user_id]})
+
+        last_user = None
+        last_balance = None
+        # The (user_id, ts) index gives each user's entries in order without sorting
+        for row in self._conn().execute("SELECT id, user_id, contra, amount, balance FROM entries ORDER BY user_id, ts, id"):
+            entries += 1
+            user_id = row["user_id"]
+            amount = _from_sql(row["amount"])
+            balance = _from_sql(row["balance"])
+            contra_balances[row["contra"]] = contra_balances.get(row["contra"], 0) - amount
+            if user_id != last_user:
+                if last_user is not None:
+                    check_final(last_user, last_balance)
+                users += 1
+            elif last_balance + amount != balance:
+                # Cash changed without an entry (or an entry is missing)
+                breaks.append({"id": row["id"], "user_id": user_id, "expected": last_balance + amount, "balance": balance})
+            last_user = user_id
+            last_balance = balance
+        if last_user is not None:
+            check_final(last_user, last_balance)
+
+        return {
+            "entries": entries,
+            "users": users,
+            "accounts": contra_balances,
+            "breaks": breaks,
+            "mismatches": mismatches
+        }
+
+    async def reconcile(self, balances: Optional[Mapping[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Check the ledger for consistency.
+
+        Each user's entries must chain (every balance is the previous balance plus
+        the amount), and the last balance must match the user's current cash.
+
+        Args:
+            balances: Current cash by user ID. Users not in it aren't compared (e.g. archived users).
+
+        Returns:
+            The number of entries and users, the contra account balances, and lists of
+            chain breaks and of users whose cash doesn't match the ledger
+        """
+        await self.flush()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._reconcile, balances)
+
+ledger = Ledger()
+
+def _load_balances(data_path: str) -> Dict[str, Any]:
+    """Read every user's cash from a data file (any format) or a SQLite database."""
+    if data_path.endswith((".sqlite3", ".sqlite", ".db")):
+        conn = sqlite3.connect(data_path)
+        return {user_id: cash for user_id, cash in conn.execute("SELECT user_id, cash FROM users")}
+    from utils.serializers import load_file
+    users = load_file(data_path).get("users", {})
+    return {user_id: user.get("cash", 0) for user_id, user in users.items()}
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect the cash ledger")
+    parser.add_argument("--ledger", default=None, help="Ledger file (default: LEDGER_FILE or ledger.sqlite3)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    history_parser = subparsers.add_parser("history", help="Show a user's most recent entries")
+    history_parser.add_argument("user_id")
+    history_parser.add_argument("--limit", type=int, default=20)
+    reconcile_parser = subparsers.add_parser("reconcile", help="Check the ledger against itself and the user data")
+    reconcile_parser.add_argument("--data", default=None, help="Data file or SQLite database to compare balances with")
+    args = parser.parse_args()
+
+    book = Ledger(args.ledger)
+    if args.command == "history":
+        for entry in book._history(args.user_id, args.limit, None):
+            when = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(entry["ts"]))
+            bet = f" bet {entry['bet']}" if entry["bet"] is not None else ""
+            outcome = f" {entry['outcome']}" if entry["outcome"] else ""
+            print(f"{when}  {entry['source']:<10} {entry['amount']:>+12} -> {entry['balance']:>12}  ({entry['contra']}{bet}{outcome})")
+        return
+
+    balances = _load_balances(args.data) if args.data else None
+    report = book._reconcile(balances)
+    print(f"{report['entries']:,} entries for {report['users']:,} users")
+    for account, balance in sorted(report["accounts"].items()):
+        print(f"  {account}: {balance:+,}")
+    print(f"{len(report['breaks']):,} chain breaks")
+    for item in report["breaks"][:20]:
+        print(f"  entry {item['id']} for {item['user_id']}: balance {item['balance']}, expected {item['expected']}")
+    if balances is not None:
+        print(f"{len(report['mismatches']):,} users whose cash doesn't match")
+        for item in report["mismatches"][:20]:
+            print(f"  {item['user_id']}: ledger {item['ledger']}, cash {item['cash']}")
+
+if __name__ == "__main__":
+    main()
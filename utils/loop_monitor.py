@@ -0,0 +1,106 @@
+import sys
+import time
+import asyncio
+import logging
+import threading
+import traceback
+from collections import deque
+from typing import Any, Dict, List, Optional
+from utils.metrics import counter, histogram
+
+logger = logging.getLogger(__name__)
+
+LOOP_LAG_SECONDS = histogram(
+    "event_loop_lag_seconds",
+    "How late the event loop ran a scheduled callback",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+)
+LOOP_BLOCKED_TOTAL = counter("event_loop_blocked_total", "Times the event loop was blocked longer than the threshold")
+
+class LoopMonitor:
+    """
+    Measures event loop lag and captures what is blocking the loop.
+
+    A task on the loop wakes up every `interval` seconds and records how late it
+    ran. A watchdog thread notices when those wake-ups stop, and if the loop has
+    been stuck for longer than `threshold` it captures the loop thread's stack,
+    which shows the blocking call while it is still running.
+    """
+
+    def __init__(self, interval: float = 0.5, threshold: float = 0.25, max_events: int = 20):
+        self.interval = interval
+        self.threshold = threshold
+        self.events: deque = deque(maxlen=max_events)
+        self.blocked_count = 0  # Every block, including the ones dropped from events
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self._last_tick = time.monotonic()
+        self._current_event: Optional[Dict[str, Any]] = None
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        """Start monitoring the running event loop."""
+        if self._task is not None:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._last_tick = time.monotonic()
+        self._task = asyncio.create_task(self._sample())
+        threading.Thread(target=self._watch, name="loop-monitor", daemon=True).start()
+
+    def stop(self):
+        """Stop monitoring."""
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _sample(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - expected)
+            self._last_tick = time.monotonic()
+
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            LOOP_LAG_SECONDS.observe(lag)
+
+            event = self._current_event
+            if event is not None:
+                # The blocking call has finished, so we now know how long it took
+                self._current_event = None
+                event["duration_ms"] = round(lag * 1000, 1)
+                logger.warning(f"Event loop was blocked for {lag * 1000:.0f}ms")
+
+    def _watch(self):
+        while not self._stopped.wait(self.threshold / 2):
+            stalled = time.monotonic() - self._last_tick - self.interval
+            if stalled < self.threshold or self._current_event is not None:
+                continue
+
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = traceback.format_stack(frame) if frame is not None else []
+            event = {
+                "time": time.time(),
+                "duration_ms": None,  # Filled in once the loop recovers
+                "stack": [line.rstrip() for line in stack]
+            }
+            self._current_event = event
+            self.events.append(event)
+            self.blocked_count += 1
+            LOOP_BLOCKED_TOTAL.inc()
+            logger.warning(
+                f"Event loop blocked for over {self.threshold * 1000:.0f}ms, loop thread stack:\n{''.join(stack)}"
+            )
+
+    def snapshot(self, max_events: int = 5) -> Dict[str, Any]:
+        """Get the current lag and the most recent blocking events, for the status API."""
+        events: List[Dict[str, Any]] = list(self.events)[-max_events:]
+        return {
+            "lag_ms": round(self.last_lag * 1000, 1),
+            "max_lag_ms": round(self.max_lag * 1000, 1),
+            "blocked_count": self.blocked_count,
+            "recent_blocks": events
+        }
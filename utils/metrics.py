@@ -0,0 +1,219 @@
+import time
+import threading
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Latency buckets in seconds, from 0.5ms to 10s
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+def _format_labels(labelnames: Sequence[str], labelvalues: Tuple[str, ...], *extra: str) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, labelvalues)]
+    pairs.extend(label for label in extra if label)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    """A value that only goes up, such as the number of commands run."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labelvalues: str, amount: float = 1):
+        """Increase the counter for the given label values."""
+        self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def collect(self, extra: str = "") -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, labels, extra)} {_format_value(value)}"
+            for labels, value in list(self._values.items())
+        ]
+
+class Gauge:
+    """A value that can go up and down, such as the gateway latency."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._callback: Optional[Callable[[], Dict[Tuple[str, ...], float]]] = None
+
+    def set(self, value: float, *labelvalues: str):
+        """Set the gauge for the given label values."""
+        self._values[labelvalues] = value
+
+    def set_function(self, callback: Callable[[], Dict[Tuple[str, ...], float]]):
+        """Compute the gauge's values when metrics are collected instead of storing them."""
+        self._callback = callback
+
+    def collect(self, extra: str = "") -> List[str]:
+        values = self._callback() if self._callback else dict(self._values)
+        return [
+            f"{self.name}{_format_labels(self.labelnames, labels, extra)} {_format_value(value)}"
+            for labels, value in values.items()
+        ]
+
+class Histogram:
+    """
+    Counts observations (such as latencies) in fixed buckets.
+
+    Observing a value is a bisect over the bucket bounds and two additions,
+    so it is cheap enough for every command.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [count per bucket..., count above the last bucket, sum]
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, *labelvalues: str):
+        """Record an observation for the given label values."""
+        series = self._series.get(labelvalues)
+        if series is None:
+            series = self._series[labelvalues] = [0] * (len(self.buckets) + 2)
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def time(self, *labelvalues: str) -> "_Timer":
+        """Time a block of code with `with histogram.time():`."""
+        return _Timer(self, labelvalues)
+
+    def collect(self, extra: str = "") -> List[str]:
+        lines = []
+        for labels, series in list(self._series.items()):
+            series = list(series)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series[:-1]):
+                cumulative += count
+                bucket_labels = _format_labels(self.labelnames, labels, extra, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            label_str = _format_labels(self.labelnames, labels, extra)
+            lines.append(f"{self.name}_sum{label_str} {_format_value(series[-1])}")
+            lines.append(f"{self.name}_count{label_str} {cumulative}")
+        return lines
+
+class _Timer:
+    def __init__(self, histogram: Histogram, labelvalues: Tuple[str, ...]):
+        self.histogram = histogram
+        self.labelvalues = labelvalues
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.elapsed = time.perf_counter() - self.start
+        self.histogram.observe(self.elapsed, *self.labelvalues)
+
+class Registry:
+    """A collection of metrics rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def families(self, extra: str = "") -> List[Tuple[str, str, str, List[str]]]:
+        """
+        Collect every metric as (name, documentation, kind, sample lines).
+
+        Args:
+            extra: A label added to every sample, such as 'cluster="0"'
+        """
+        return [
+            (metric.name, metric.documentation, metric.kind, metric.collect(extra))
+            for metric in list(self._metrics.values())
+        ]
+
+    def render(self) -> str:
+        return render_families([self.families()])
+
+def render_families(processes: Iterable[Iterable[Sequence]]) -> str:
+    """
+    Render the metric families of several processes as one Prometheus text page.
+
+    Each family is written once, with the samples of every process (which
+    should carry a label telling the processes apart).
+    """
+    merged: Dict[str, Tuple[str, str, List[str]]] = {}
+    for families in processes:
+        for name, documentation, kind, samples in families:
+            family = merged.get(name)
+            if family is None:
+                family = merged[name] = (documentation, kind, [])
+            family[2].extend(samples)
+    lines = []
+    for name, (documentation, kind, samples) in merged.items():
+        lines.append(f"# HELP {name} {documentation}")
+        lines.append(f"# TYPE {name} {kind}")
+        lines.extend(samples)
+    return "\n".join(lines) + "\n"
+
+# Global registry served at /metrics
+REGISTRY = Registry()
+
+def counter(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+    """Create and register a counter."""
+    return REGISTRY.register(Counter(name, documentation, labelnames))
+
+def gauge(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+    """Create and register a gauge."""
+    return REGISTRY.register(Gauge(name, documentation, labelnames))
+
+def histogram(name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+    """Create and register a histogram."""
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))
+
+class CommandTimer:
+    """Time spent in each phase (db, defer, send, ...) of one app command."""
+
+    __slots__ = ("command", "start", "phases")
+
+    def __init__(self, command: str):
+        self.command = command
+        self.start = time.perf_counter()
+        self.phases: Dict[str, float] = {}
+
+    def add(self, phase: str, seconds: float):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start
+
+# The timer of the app command running in the current task, if any
+current_command: ContextVar[Optional[CommandTimer]] = ContextVar("current_command", default=None)
+
+def add_phase_time(phase: str, seconds: float):
+    """Add time to a phase of the app command running in the current task."""
+    timer = current_command.get()
+    if timer is not None:
+        timer.add(phase, seconds)
@@ -0,0 +1,194 @@
+import os
+import json
+import time
+import random
+import asyncio
+import cProfile
+import logging
+import threading
+from contextlib import nullcontext
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+class Span:
+    """A timed step of an interaction, such as a database read or an HTTP request."""
+
+    __slots__ = ("name", "start", "end", "children")
+
+    def __init__(self, name: str, start: Optional[float] = None, end: Optional[float] = None):
+        self.name = name
+        self.start = time.perf_counter() if start is None else start
+        self.end = end
+        self.children: List["Span"] = []
+
+    def to_dict(self, origin: float) -> Dict[str, Any]:
+        end = self.end if self.end is not None else time.perf_counter()
+        return {
+            "name": self.name,
+            "start_ms": round((self.start - origin) * 1000, 3),
+            "duration_ms": round((end - self.start) * 1000, 3),
+            "children": [child.to_dict(origin) for child in self.children]
+        }
+
+# The innermost span of the interaction being profiled in the current task, if any
+current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+_NO_SPAN = nullcontext()
+
+class _SpanContext:
+    __slots__ = ("span", "token")
+
+    def __init__(self, parent: Span, name: str):
+        self.span = Span(name)
+        parent.children.append(self.span)
+
+    def __enter__(self):
+        self.token = current_span.set(self.span)
+        return self.span
+
+    def __exit__(self, *exc_info):
+        self.span.end = time.perf_counter()
+        current_span.reset(self.token)
+
+def span(name: str):
+    """
+    Time a block as a span of the interaction being profiled.
+
+    Does nothing (beyond one context variable lookup) when the current
+    interaction isn't being profiled.
+
+    Args:
+        name: The name of the step, e.g. "parse_bet"
+    """
+    parent = current_span.get()
+    if parent is None:
+        return _NO_SPAN
+    return _SpanContext(parent, name)
+
+def record_span(name: str, start: float, end: float):
+    """Add an already finished span (timed with time.perf_counter) to the interaction being profiled."""
+    parent = current_span.get()
+    if parent is not None:
+        parent.children.append(Span(name, start, end))
+
+class InteractionProfile:
+    """The span tree (and optionally a cProfile) of one profiled interaction."""
+
+    def __init__(self, command: str, interaction_id: int, profiler: Optional[cProfile.Profile]):
+        self.command = command
+        self.interaction_id = interaction_id
+        self.root = Span(command)
+        self.profiler = profiler
+        self.started_at = time.time()
+
+class InteractionProfiler:
+    """
+    Profiles a sample of app command interactions in production.
+
+    Each profiled interaction gets a span tree covering its database calls,
+    HTTP requests and the steps marked with span() in the cogs. With cProfile
+    enabled, a cProfile of the bot thread during the command is saved too;
+    it includes other tasks that ran meanwhile, so only one runs at a time.
+    Profiles are written to a directory that keeps the newest `keep` of them.
+
+    Environment variables:
+        PROFILE_SAMPLE_RATE: Fraction of interactions to profile (default: 0)
+        PROFILE_COMMANDS: Commands to always profile, e.g. "coinflip,slots"
+        PROFILE_CPROFILE: Also record a cProfile ("1" to enable)
+        PROFILE_DIR: Where to write profiles (default: profiles)
+        PROFILE_KEEP: How many profiles to keep (default: 50)
+    """
+
+    def __init__(
+        self,
+        sample_rate: float = 0.0,
+        commands: Optional[List[str]] = None,
+        use_cprofile: bool = False,
+        directory: str = "profiles",
+        keep: int = 50
+    ):
+        self.sample_rate = sample_rate
+        self.commands = set(commands or [])
+        self.use_cprofile = use_cprofile
+        self.directory = directory
+        self.keep = keep
+        self._cprofile_active = False
+        self._write_lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "InteractionProfiler":
+        commands = [name.strip() for name in os.getenv("PROFILE_COMMANDS", "").split(",") if name.strip()]
+        return cls(
+            sample_rate=float(os.getenv("PROFILE_SAMPLE_RATE", 0)),
+            commands=commands,
+            use_cprofile=os.getenv("PROFILE_CPROFILE", "").lower() in ("1", "true", "yes"),
+            directory=os.getenv("PROFILE_DIR", "profiles"),
+            keep=int(os.getenv("PROFILE_KEEP", 50))
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.sample_rate > 0 or bool(self.commands)
+
+    def should_profile(self, command: str) -> bool:
+        return command in self.commands or (self.sample_rate > 0 and random.random() < self.sample_rate)
+
+    def start(self, command: str, interaction_id: int) -> InteractionProfile:
+        """Start profiling an interaction in the current task."""
+        profiler = None
+        if self.use_cprofile and not self._cprofile_active:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+                self._cprofile_active = True
+            except ValueError:
+                # Another profiler is already running on this thread
+                profiler = None
+
+        profile = InteractionProfile(command, interaction_id, profiler)
+        current_span.set(profile.root)
+        return profile
+
+    def finish(self, profile: InteractionProfile, outcome: str):
+        """Stop profiling an interaction and write its profile in the background."""
+        profile.root.end = time.perf_counter()
+        if profile.profiler is not None:
+            profile.profiler.disable()
+            self._cprofile_active = False
+
+        loop = asyncio.get_running_loop()
+        loop.run_in_executor(None, self._write, profile, outcome)
+
+    def _write(self, profile: InteractionProfile, outcome: str):
+        timestamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(profile.started_at))
+        base = os.path.join(self.directory, f"{timestamp}-{profile.command}-{profile.interaction_id}")
+        try:
+            with self._write_lock:
+                os.makedirs(self.directory, exist_ok=True)
+                with open(f"{base}.json", 'w') as f:
+                    json.dump({
+                        "command": profile.command,
+                        "interaction_id": profile.interaction_id,
+                        "started_at": profile.started_at,
+                        "outcome": outcome,
+                        "spans": profile.root.to_dict(profile.root.start)
+                    }, f, indent=2)
+                if profile.profiler is not None:
+                    profile.profiler.dump_stats(f"{base}.prof")
+                self._rotate()
+        except Exception as e:
+            logger.error(f"Failed to write profile for {profile.command}: {e}")
+
+    def _rotate(self):
+        """Delete the oldest profiles beyond the number to keep."""
+        profiles = sorted(
+            (entry for entry in os.scandir(self.directory) if entry.name.endswith(".json")),
+            key=lambda entry: entry.stat().st_mtime
+        )
+        for entry in profiles[:max(0, len(profiles) - self.keep)]:
+            base = entry.path[:-len(".json")]
+            for path in (entry.path, f"{base}.prof"):
+                if os.path.exists(path):
+                    os.remove(path)
@@ -0,0 +1,168 @@
+"""
+Experience, levels and rewards.
+
+Levels come from a level curve: the total XP needed for each level,
+precomputed up to max_level, so finding the level for an amount of XP is a
+bisect (O(log levels)) and a reward that crosses several levels at once is
+handled like any other. The curve is chosen with LEVEL_CURVE, so changing
+it doesn't touch the cogs.
+
+Level-ups are returned to the command (for its reply) and published on
+the event bus, whose subscribers (the level-up announcements) get them in
+batches off the response path.
+"""
+import os
+import logging
+from bisect import bisect_right
+from typing import Dict, List, Optional, Tuple
+from utils.events import EventBus, bus as default_bus
+from utils.metrics import counter
+
+logger = logging.getLogger(__name__)
+
+LEVEL_UPS = counter("level_ups_total", "Level-ups, by the command that caused them", ["source"])
+
+# Cash (base, extra per level) and XP given by reward commands
+REWARDS: Dict[str, Tuple[int, int, int]] = {
+    "work": (100, 50, 5),
+    "daily": (1000, 500, 20)
+}
+
+# XP given for playing each game
+GAME_XP = {
+    "coinflip": 1,
+    "slots": 3,
+    "blackjack": 5
+}
+
+class LevelCurve:
+    """Total XP needed for each level, with levels beyond the table continuing at the last step."""
+
+    def __init__(self, thresholds: List[int]):
+        if len(thresholds) < 2 or thresholds[0] != 0 or any(b <= a for a, b in zip(thresholds, thresholds[1:])):
+            raise ValueError("Level thresholds must start at 0 and increase")
+        self.thresholds = thresholds
+        self.max_level = len(thresholds) - 1
+        self._last_step = thresholds[-1] - thresholds[-2]
+
+    @classmethod
+    def linear(cls, xp_per_level: int = 100, max_level: int = 1000) -> "LevelCurve":
+        """The same XP for every level (the original curve, 100 XP per level)."""
+        return cls([level * xp_per_level for level in range(max_level + 1)])
+
+    @classmethod
+    def power(cls, base: int = 100, exponent: float = 1.5, max_level: int = 1000) -> "LevelCurve":
+        """Level n needs base * n ** exponent XP in total, so levels get harder."""
+        thresholds = [0]
+        for level in range(1, max_level + 1):
+            # At least one XP per level, so the thresholds keep increasing
+            thresholds.append(max(int(base * level ** exponent), thresholds[-1] + 1))
+        return cls(thresholds)
+
+    def level_for(self, xp: int) -> int:
+        """Get the level reached with an amount of XP."""
+        if xp >= self.thresholds[-1]:
+            return self.max_level + int((xp - self.thresholds[-1]) // self._last_step)
+        return bisect_right(self.thresholds, xp) - 1
+
+    def xp_for(self, level: int) -> int:
+        """Get the total XP needed to reach a level."""
+        if level > self.max_level:
+            return self.thresholds[-1] + (level - self.max_level) * self._last_step
+        return self.thresholds[max(level, 0)]
+
+def curve_from_env() -> LevelCurve:
+    """
+    Create the level curve selected in the environment.
+
+    Environment variables:
+        LEVEL_CURVE: linear or power (default: linear)
+        LEVEL_XP: XP per level (linear), or for level 1 (power) (default: 100)
+        LEVEL_EXPONENT: Exponent of the power curve (default: 1.5)
+        LEVEL_MAX: Levels in the precomputed table (default: 1000)
+    """
+    kind = os.getenv("LEVEL_CURVE", "linear").lower()
+    xp = int(os.getenv("LEVEL_XP", "100"))
+    max_level = int(os.getenv("LEVEL_MAX", "1000"))
+    if kind == "power":
+        return LevelCurve.power(xp, float(os.getenv("LEVEL_EXPONENT", "1.5")), max_level)
+    if kind != "linear":
+        logger.warning(f"Unknown LEVEL_CURVE '{kind}', using linear")
+    return LevelCurve.linear(xp, max_level)
+
+class LevelUp:
+    """A user reaching a new level (possibly several at once)."""
+
+    __slots__ = ("user_id", "old_level", "new_level", "source", "guild_id")
+
+    def __init__(self, user_id: str, old_level: int, new_level: int, source: str, guild_id: Optional[int] = None):
+        self.user_id = user_id
+        self.old_level = old_level
+        self.new_level = new_level
+        self.source = source
+        self.guild_id = guild_id
+
+    @property
+    def message(self) -> str:
+        """The level-up line shown to the user."""
+        gained = self.new_level - self.old_level
+        jump = f" (+{gained} levels)" if gained > 1 else ""
+        return f"🎉 Level up! You are now level {self.new_level}{jump}!"
+
+    def __repr__(self) -> str:
+        return f"LevelUp({self.user_id!r}, {self.old_level} -> {self.new_level}, {self.source!r})"
+
+class Progression:
+    """Applies XP and rewards to users, and publishes level-ups on the event bus."""
+
+    def __init__(self, curve: Optional[LevelCurve] = None, bus: Optional[EventBus] = None):
+        self.curve = curve or curve_from_env()
+        self.bus = bus or default_bus
+
+    def add_xp(self, user, user_id: str, xp: int, source: str, guild_id: Optional[int] = None) -> Optional[LevelUp]:
+        """
+        Give a user XP, raising their level if they reached a new one.
+
+        Args:
+            user: The user's data, changed in place
+            user_id: The ID of the user
+            xp: XP to add
+            source: The command giving the XP
+            guild_id: The guild the command was used in
+
+        Returns:
+            The level-up, or None if the user stayed at their level
+        """
+        user['xp'] += xp
+        old_level = user['level']
+        new_level = self.curve.level_for(user['xp'])
+        if new_level <= old_level:
+            return None
+        user['level'] = new_level
+        level_up = LevelUp(user_id, old_level, new_level, source, guild_id)
+        LEVEL_UPS.inc(source)
+        self.bus.publish(level_up)
+        return level_up
+
+    def reward_amount(self, user, source: str) -> int:
+        """Get the cash a reward command gives a user at their level."""
+        base, per_level, _ = REWARDS[source]
+        return base + user['level'] * per_level
+
+    def reward(self, user, user_id: str, source: str, guild_id: Optional[int] = None) -> Tuple[int, Optional[LevelUp]]:
+        """
+        Give a user a reward command's cash and XP.
+
+        Returns:
+            The cash given, and the level-up (or None)
+        """
+        earnings = self.reward_amount(user, source)
+        user['cash'] += earnings
+        user['total_cash_won'] += earnings
+        return earnings, self.add_xp(user, user_id, REWARDS[source][2], source, guild_id)
+
+    def play(self, user, user_id: str, game: str, guild_id: Optional[int] = None) -> Optional[LevelUp]:
+        """Give a user the XP for playing a game."""
+        return self.add_xp(user, user_id, GAME_XP[game], game, guild_id)
+
+progression = Progression()
@@ -0,0 +1,248 @@
+from collections.abc import MutableMapping
+from typing import Any, Dict, Iterator, Optional
+from utils.columns import MAX_EXACT_FLOAT, NUMERIC_COLUMNS, ColumnStore
+
+# Default value of every user field. Containers are created when first used.
+USER_DEFAULTS: Dict[str, Any] = {
+    "cash": 1000,
+    "level": 0,
+    "xp": 0,
+    "games_played": 0,
+    "wins": 0,
+    "losses": 0,
+    "total_cash_won": 0,
+    "total_cash_lost": 0,
+    "items": None,
+    "boosts": None,
+    "cooldowns": None,
+    "vote_streak": 0,
+    "last_vote": None,
+    "mine": None,
+    "last_active": 0
+}
+
+# Container fields and the type created on first access
+CONTAINER_FIELDS = {
+    "items": list,
+    "boosts": list,
+    "cooldowns": dict
+}
+
+_FIELDS = frozenset(USER_DEFAULTS)
+_SLOT_FIELDS = tuple(field for field in USER_DEFAULTS if field not in NUMERIC_COLUMNS)
+_FLOAT_FIELDS = frozenset(field for field, code in NUMERIC_COLUMNS.items() if code == "d")
+
+class UserRecord(MutableMapping):
+    """
+    Compact storage for one user's data that behaves like the old user dict.
+
+    The numeric fields live in a row of a ColumnStore shared by all users, so
+    the record is a view onto that row. The other fields live in __slots__
+    and are only stored once they differ from the default, and the items,
+    boosts and cooldowns containers are only created when first accessed.
+    Unknown keys go in a small extra dict, so cogs can keep treating users
+    as dicts.
+
+    Every field always reads as present (with its default if unset), and
+    deleting a field resets it to its default.
+    
+    The record's own dicts (extra keys, exact amounts) are replaced rather
+    than modified, and so are stored containers by the database, so a save
+    thread can read a record while the event loop changes it.
+    """
+
+    __slots__ = ("_columns", "_row") + _SLOT_FIELDS + ("_extra", "_exact", "__weakref__")
+
+    def __init__(self, data: Dict[str, Any] = None, store: Optional[ColumnStore] = None, user_id: Optional[str] = None):
+        """
+        Args:
+            data: Initial field values
+            store: The column store to add the user's row to (default: a private one)
+            user_id: The ID of the user, for store lookups
+        """
+        if store is None:
+            store = ColumnStore()
+        self._columns = store.columns
+        self._row = store.add_row(user_id, data)
+        if data:
+            for key, value in data.items():
+                if key in NUMERIC_COLUMNS:
+                    # Already in the row, except for the exact value of huge amounts
+                    if key in _FLOAT_FIELDS and type(value) is int and not -MAX_EXACT_FLOAT < value < MAX_EXACT_FLOAT:
+                        self._set_number(key, value)
+                elif key in _FIELDS:
+                    setattr(self, key, value)
+                else:
+                    self[key] = value
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any], store: Optional[ColumnStore] = None, user_id: Optional[str] = None) -> "UserRecord":
+        """Create a record from a (possibly sparse) user dict."""
+        return cls(data, store, user_id)
+
+    @property
+    def row(self) -> int:
+        """The record's row in its column store."""
+        return self._row
+
+    def move_to(self, store: ColumnStore, user_id: Optional[str] = None):
+        """Move the numeric fields to a new row in another store."""
+        values = {key: self._columns[key][self._row] for key in NUMERIC_COLUMNS}
+        self._row = store.add_row(user_id, values)
+        self._columns = store.columns
+
+    def rebind(self, store: ColumnStore, row: int):
+        """Point the record at a row of another store that already holds its values (see ColumnStore.take)."""
+        self._columns = store.columns
+        self._row = row
+
+    def _get_number(self, key: str, columns: Optional[Dict[str, Any]] = None, row: Optional[int] = None) -> Any:
+        if columns is None:
+            value = self._columns[key][self._row]
+        else:
+            value = columns[key][row]
+        if key in _FLOAT_FIELDS and value.is_integer():
+            if -MAX_EXACT_FLOAT < value < MAX_EXACT_FLOAT:
+                return int(value)
+            # Huge integer amounts keep their exact value next to the column's approximation
+            try:
+                exact = self._exact[key]
+            except (AttributeError, KeyError):
+                return int(value)
+            if float(exact) == value:
+                return exact
+            return int(value)
+        return value
+
+    def _set_number(self, key: str, value: Any):
+        if key in _FLOAT_FIELDS and type(value) is int and not -MAX_EXACT_FLOAT < value < MAX_EXACT_FLOAT:
+            try:
+                self._exact = {**self._exact, key: value}
+            except AttributeError:
+                self._exact = {key: value}
+        try:
+            self._columns[key][self._row] = value
+        except TypeError:
+            # Counter columns only take ints
+            self._columns[key][self._row] = int(value)
+
+    def __getitem__(self, key: str) -> Any:
+        if key in NUMERIC_COLUMNS:
+            return self._get_number(key)
+        if key in _FIELDS:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                factory = CONTAINER_FIELDS.get(key)
+                if factory is None:
+                    return USER_DEFAULTS[key]
+                # The caller may mutate the container, so it has to be stored
+                value = factory()
+                setattr(self, key, value)
+                return value
+        try:
+            return self._extra[key]
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def get(self, key: str, default: Any = None) -> Any:
+        # Same as Mapping.get, without the extra call
+        if key in NUMERIC_COLUMNS:
+            return self._get_number(key)
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __setitem__(self, key: str, value: Any):
+        if key in NUMERIC_COLUMNS:
+            self._set_number(key, value)
+            return
+        if key in _FIELDS:
+            setattr(self, key, value)
+            return
+        try:
+            self._extra = {**self._extra, key: value}
+        except AttributeError:
+            self._extra = {key: value}
+
+    def __delitem__(self, key: str):
+        if key in NUMERIC_COLUMNS:
+            self._set_number(key, USER_DEFAULTS[key])
+            return
+        if key in _FIELDS:
+            try:
+                delattr(self, key)
+            except AttributeError:
+                pass
+            return
+        try:
+            extra = dict(self._extra)
+        except AttributeError:
+            raise KeyError(key) from None
+        del extra[key]
+        self._extra = extra
+
+    def __contains__(self, key: object) -> bool:
+        if key in _FIELDS:
+            return True
+        try:
+            return key in self._extra
+        except AttributeError:
+            return False
+
+    def __iter__(self) -> Iterator[str]:
+        yield from USER_DEFAULTS
+        try:
+            yield from list(self._extra)
+        except AttributeError:
+            pass
+
+    def __len__(self) -> int:
+        try:
+            return len(USER_DEFAULTS) + len(self._extra)
+        except AttributeError:
+            return len(USER_DEFAULTS)
+
+    def __repr__(self) -> str:
+        return f"UserRecord({self.to_dict()!r})"
+
+    def update(self, other=(), **kwargs):
+        # Cogs pass the record itself back to Database.update_user
+        if other is self and not kwargs:
+            return
+        super().update(other, **kwargs)
+
+    def to_dict(self, sparse: bool = True, columns: Optional[Dict[str, Any]] = None, row: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Convert the record to a plain dict.
+
+        Args:
+            sparse: Leave out fields that still have their default value (and empty containers)
+            columns: Read the numeric fields from this copy of the store's columns instead
+            row: The record's row in the copy
+        """
+        data = {}
+        for key, default in USER_DEFAULTS.items():
+            if key in NUMERIC_COLUMNS:
+                value = self._get_number(key, columns, row)
+                if sparse and value == default:
+                    continue
+                data[key] = value
+                continue
+            try:
+                value = getattr(self, key)
+            except AttributeError:
+                if sparse:
+                    continue
+                factory = CONTAINER_FIELDS.get(key)
+                value = factory() if factory else default
+            else:
+                if sparse and (value == default or (key in CONTAINER_FIELDS and not value)):
+                    continue
+            data[key] = value
+        try:
+            data.update(self._extra)
+        except AttributeError:
+            pass
+        return data
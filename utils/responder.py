@@ -0,0 +1,97 @@
+"""
+Adaptive interaction responses.
+
+Discord needs a response to an interaction within 3 seconds. Deferring
+straight away and sending the result as a followup always meets the
+deadline, but costs two HTTP requests. Most commands finish well within the
+deadline, so a Responder answers with the result itself (one request), and
+only defers if the command is still working when its budget runs out.
+"""
+import os
+import asyncio
+import logging
+from typing import Any, Optional
+from utils.metrics import counter
+
+logger = logging.getLogger(__name__)
+
+INTERACTION_RESPONSES = counter(
+    "interaction_responses_total", "Initial interaction responses, sent directly or deferred because the budget ran out", ["kind"]
+)
+
+# Seconds a command may work before its interaction is deferred (leaving time for the defer to arrive)
+RESPONSE_BUDGET = float(os.getenv("RESPONSE_BUDGET", "1.5"))
+
+class Responder:
+    """
+    Sends a command's responses, deferring the interaction only if the command runs past its budget.
+
+    Create it where the command used to defer, then use send() where it used
+    followup.send(). Everything after the first send is a followup. If the
+    command ends without sending anything (it raised), cancel() stops the
+    pending defer, which the command tree does for every command.
+
+    Environment variables:
+        RESPONSE_BUDGET: Seconds before an unanswered interaction is deferred (default: 1.5)
+    """
+
+    def __init__(self, interaction, ephemeral: bool = False, budget: Optional[float] = None):
+        """
+        Args:
+            interaction: The interaction to respond to
+            ephemeral: Whether a deferred response is only shown to the user
+            budget: Seconds before deferring (default: RESPONSE_BUDGET)
+        """
+        self.interaction = interaction
+        self.ephemeral = ephemeral
+        self._deferring: Optional[asyncio.Task] = None
+        self._timer = asyncio.get_running_loop().call_later(
+            RESPONSE_BUDGET if budget is None else budget, self._start_defer
+        )
+        # So the command tree can cancel the defer when the command ends
+        interaction.extras["responder"] = self
+
+    def cancel(self):
+        """Don't defer the interaction (a defer already sent stays)."""
+        self._timer.cancel()
+
+    def _start_defer(self):
+        if not self.interaction.response.is_done():
+            self._deferring = asyncio.create_task(self._defer())
+
+    async def _defer(self):
+        INTERACTION_RESPONSES.inc("deferred")
+        try:
+            await self.interaction.response.defer(ephemeral=self.ephemeral, thinking=True)
+        except Exception as e:
+            # The followup will fail too, so the command's error handling reports it
+            logger.warning(f"Couldn't defer interaction {self.interaction.id}: {e}")
+
+    async def send(self, content: Optional[str] = None, **kwargs: Any):
+        """
+        Send a response: the initial response if there isn't one yet, otherwise a followup.
+
+        Takes the arguments of followup.send (content, embed, view, ephemeral, ...).
+
+        Returns:
+            The message sent
+        """
+        self._timer.cancel()
+        if self._deferring is not None:
+            await self._deferring
+        if self.interaction.response.is_done():
+            return await self.interaction.followup.send(content, **kwargs)
+
+        INTERACTION_RESPONSES.inc("direct")
+        callback = await self.interaction.response.send_message(content, **kwargs)
+        message = getattr(callback, "resource", None)
+        if message is None or not hasattr(message, "edit"):
+            # The callback didn't include the message, so fetch it
+            message = await self.interaction.original_response()
+        return message
+
+def cancel_defer(interaction):
+    """Cancel the pending defer of a finished command's Responder, if it has one."""
+    responder = interaction.extras.pop("responder", None)
+    if responder is not None:
+        responder.cancel()
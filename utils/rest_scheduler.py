@@ -0,0 +1,329 @@
+"""
+Scheduler for outbound Discord REST requests.
+
+Requests are queued by priority: requests a command's reply waits for (such
+as the names on a leaderboard) first, then background requests nobody waits
+for (level-up announcements). Only REST_BACKGROUND_CONCURRENCY background
+requests run at once, so they never take every slot from the others.
+Interaction responses don't go through the scheduler: they have a 3 second
+deadline, Discord exempts them from the global rate limit, and Responder
+sends them straight away.
+
+Rate limits are respected before sending rather than after a 429: every
+request takes a token from the global bucket and from its route's bucket,
+and waits in the queue while either is empty. Requests are also coalesced: identical
+requests (the same user fetched twice) share one call, and batched requests
+(announcements to the same channel) are merged into one call while they
+wait.
+"""
+import os
+import time
+import heapq
+import asyncio
+import contextvars
+import logging
+from collections import OrderedDict
+from enum import IntEnum
+from itertools import count
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, List, Optional, Set, Tuple
+from utils.metrics import counter, gauge, histogram
+
+logger = logging.getLogger(__name__)
+
+REST_REQUESTS = counter("rest_requests_total", "Outbound REST requests run by the scheduler", ["priority", "outcome"])
+REST_COALESCED = counter("rest_coalesced_total", "Requests merged into another request instead of being sent", ["priority"])
+REST_QUEUE_SECONDS = histogram("rest_queue_seconds", "Time requests waited in the scheduler's queue", ["priority"])
+REST_QUEUED = gauge("rest_queued_requests", "Requests waiting in the scheduler's queue")
+
+class Priority(IntEnum):
+    USER = 0  # Requests a command's reply waits for
+    BACKGROUND = 1  # Requests nobody waits for
+
+# Requests allowed per period for each kind of bucket, as (requests, seconds)
+RATE_LIMITS: Dict[str, Tuple[int, float]] = {
+    "global": (50, 1.0),
+    "channel_messages": (5, 5.0),
+    "users": (30, 1.0)  # Discord doesn't publish this one, so it is kept well under the global limit
+}
+
+GLOBAL_BUCKET = ("global",)
+
+class TokenBucket:
+    """Allows up to `requests` requests in a burst, refilled at `requests` per `per` seconds."""
+
+    __slots__ = ("capacity", "rate", "tokens", "updated")
+
+    def __init__(self, requests: int, per: float):
+        self.capacity = requests
+        self.rate = requests / per
+        self.tokens = float(requests)
+        self.updated = time.monotonic()
+
+    def wait_time(self, now: float) -> float:
+        """Get the seconds until a token is available (0 if one is)."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+class _Request:
+    __slots__ = ("priority", "seq", "call", "buckets", "key", "batch_key", "future", "queued_at")
+
+    def __init__(self, priority: Priority, seq: int, call: Callable[[], Awaitable[Any]], buckets: List[Tuple], key: Optional[Hashable]):
+        self.priority = priority
+        self.seq = seq
+        self.call = call
+        self.buckets = buckets
+        self.key = key
+        self.batch_key: Optional[Hashable] = None
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.queued_at = time.monotonic()
+
+    def __lt__(self, other: "_Request") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+def _log_failure(future: asyncio.Future):
+    """Log a background request that failed (nobody awaits its future)."""
+    if not future.cancelled() and future.exception() is not None:
+        logger.warning(f"Background REST request failed: {future.exception()}")
+
+class RestScheduler:
+    """
+    Priority queue of outbound REST requests with proactive rate limiting.
+
+    Environment variables:
+        REST_CONCURRENCY: Maximum requests running at once (default: 8)
+        REST_BACKGROUND_CONCURRENCY: Maximum background requests running at once (default: 2)
+        USER_NAME_CACHE_SIZE: Number of fetched user names to remember (default: 10000)
+    """
+
+    def __init__(self, concurrency: Optional[int] = None, background_concurrency: Optional[int] = None):
+        self.concurrency = concurrency or int(os.getenv("REST_CONCURRENCY", "8"))
+        self.background_concurrency = background_concurrency or int(os.getenv("REST_BACKGROUND_CONCURRENCY", "2"))
+        self.name_cache_size = int(os.getenv("USER_NAME_CACHE_SIZE", "10000"))
+        self._queue: List[_Request] = []
+        self._buckets: Dict[Tuple, TokenBucket] = {}
+        self._by_key: Dict[Hashable, _Request] = {}  # Queued or running requests that identical ones share
+        self._batches: Dict[Hashable, Tuple[_Request, List[Any]]] = {}  # Queued batched requests and their items
+        self._seq = count()
+        self._running = 0
+        self._background_running = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._dispatch_task: Optional[asyncio.Task] = None
+        self._tasks: Set[asyncio.Task] = set()  # Running requests (the loop only keeps weak references)
+        self._names: "OrderedDict[str, str]" = OrderedDict()
+
+        REST_QUEUED.set_function(lambda: {(): len(self._queue)})
+
+    def submit(
+        self,
+        call: Callable[[], Awaitable[Any]],
+        priority: Priority = Priority.USER,
+        bucket: Optional[Tuple] = None,
+        key: Optional[Hashable] = None
+    ) -> asyncio.Future:
+        """
+        Queue a request.
+
+        Args:
+            call: Makes the request when called
+            priority: The request's priority
+            bucket: The route's rate limit bucket, as (kind, id) with kind in RATE_LIMITS
+            key: Identifies identical requests, which share one call while it is queued or running
+
+        Returns:
+            A future with the request's result (background failures are logged, so it needn't be awaited)
+        """
+        if key is not None:
+            existing = self._by_key.get(key)
+            if existing is not None:
+                REST_COALESCED.inc(priority.name.lower())
+                return existing.future
+        request = self._enqueue(call, priority, bucket)
+        if key is not None:
+            request.key = key
+            self._by_key[key] = request
+        return request.future
+
+    async def request(
+        self,
+        call: Callable[[], Awaitable[Any]],
+        priority: Priority = Priority.USER,
+        bucket: Optional[Tuple] = None,
+        key: Optional[Hashable] = None
+    ) -> Any:
+        """Queue a request and wait for its result."""
+        return await asyncio.shield(self.submit(call, priority, bucket, key))
+
+    def submit_batched(
+        self,
+        key: Hashable,
+        item: Any,
+        send: Callable[[List[Any]], Awaitable[Any]],
+        bucket: Optional[Tuple] = None,
+        max_items: int = 20,
+        priority: Priority = Priority.BACKGROUND
+    ):
+        """
+        Queue an item to be sent in the background, merged with the items queued with the same key.
+
+        Args:
+            key: Items with the same key are sent together
+            item: The item to send
+            send: Sends a list of items in one request
+            bucket: The route's rate limit bucket
+            max_items: Most items sent in one request
+            priority: The request's priority
+        """
+        batch = self._batches.get(key)
+        if batch is not None and len(batch[1]) < max_items:
+            batch[1].append(item)
+            REST_COALESCED.inc(priority.name.lower())
+            return
+        items = [item]
+        request = self._enqueue(lambda: send(items), priority, bucket)
+        request.batch_key = key
+        self._batches[key] = (request, items)
+
+    def _enqueue(self, call: Callable[[], Awaitable[Any]], priority: Priority, bucket: Optional[Tuple]) -> _Request:
+        buckets = [GLOBAL_BUCKET]
+        if bucket is not None:
+            buckets.append(bucket)
+        request = _Request(priority, next(self._seq), call, buckets, None)
+        if priority == Priority.BACKGROUND:
+            request.future.add_done_callback(_log_failure)
+        heapq.heappush(self._queue, request)
+        self._schedule_dispatch()
+        return request
+
+    def _bucket(self, key: Tuple) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(*RATE_LIMITS[key[0]])
+        return bucket
+
+    def _schedule_dispatch(self):
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        self._wakeup.set()
+        if self._dispatch_task is None or self._dispatch_task.done():
+            # A fresh context, so requests aren't timed as part of the command that queued the first one
+            self._dispatch_task = asyncio.get_running_loop().create_task(self._dispatch_loop(), context=contextvars.Context())
+
+    def _has_slot(self, request: _Request) -> bool:
+        if self._running >= self.concurrency:
+            return False
+        return request.priority != Priority.BACKGROUND or self._background_running < self.background_concurrency
+
+    def _next_ready(self) -> Tuple[Optional[_Request], Optional[float]]:
+        """
+        Take the highest priority request that can start now.
+
+        Returns:
+            The request, or None and the seconds until a rate limit allows one (None to wait for a slot)
+        """
+        now = time.monotonic()
+        skipped = []
+        ready = None
+        wait: Optional[float] = None
+        while self._queue:
+            request = heapq.heappop(self._queue)
+            if self._has_slot(request):
+                request_wait = max((self._bucket(key).wait_time(now) for key in request.buckets), default=0.0)
+                if request_wait == 0:
+                    ready = request
+                    break
+                wait = request_wait if wait is None else min(wait, request_wait)
+            skipped.append(request)
+        for request in skipped:
+            heapq.heappush(self._queue, request)
+        return ready, wait
+
+    async def _dispatch_loop(self):
+        """Start queued requests as slots and rate limits allow."""
+        while self._queue:
+            self._wakeup.clear()
+            request, wait = self._next_ready()
+            if request is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self._start(request)
+
+    def _start(self, request: _Request):
+        batch = self._batches.get(request.batch_key)
+        if batch is not None and batch[0] is request:
+            # Items queued from now on go in a new request
+            del self._batches[request.batch_key]
+        for key in request.buckets:
+            self._bucket(key).take()
+        self._running += 1
+        if request.priority == Priority.BACKGROUND:
+            self._background_running += 1
+        REST_QUEUE_SECONDS.observe(time.monotonic() - request.queued_at, request.priority.name.lower())
+        task = asyncio.get_running_loop().create_task(self._run(request), context=contextvars.Context())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, request: _Request):
+        priority = request.priority.name.lower()
+        try:
+            result = await request.call()
+        except Exception as e:
+            REST_REQUESTS.inc(priority, "error")
+            if not request.future.done():
+                request.future.set_exception(e)
+        else:
+            REST_REQUESTS.inc(priority, "ok")
+            if not request.future.done():
+                request.future.set_result(result)
+        finally:
+            self._running -= 1
+            if request.priority == Priority.BACKGROUND:
+                self._background_running -= 1
+            if request.key is not None and self._by_key.get(request.key) is request:
+                del self._by_key[request.key]
+            if self._queue:
+                self._schedule_dispatch()
+
+    async def user_names(self, client, user_ids: Iterable[str]) -> Dict[str, str]:
+        """
+        Get users' display names, from the client's cache, the name cache, or fetched (coalesced).
+
+        Users who couldn't be fetched are left out.
+        """
+        names: Dict[str, str] = {}
+        missing = []
+        get_user = getattr(client, "get_user", None)
+        for user_id in user_ids:
+            user_id = str(user_id)
+            name = self._names.get(user_id)
+            if name is not None:
+                self._names.move_to_end(user_id)
+            elif get_user is not None:
+                user = get_user(int(user_id))
+                name = user.display_name if user is not None else None
+            if name is not None:
+                names[user_id] = name
+            else:
+                missing.append(user_id)
+
+        fetched = await asyncio.gather(
+            *(self.request(lambda user_id=user_id: client.fetch_user(int(user_id)), Priority.USER, ("users", None), ("fetch_user", user_id)) for user_id in missing),
+            return_exceptions=True
+        )
+        for user_id, user in zip(missing, fetched):
+            if isinstance(user, BaseException):
+                logger.debug(f"Couldn't fetch user {user_id}: {user}")
+                continue
+            names[user_id] = self._names[user_id] = user.display_name
+        while len(self._names) > self.name_cache_size:
+            self._names.popitem(last=False)
+        return names
+
+# Create a global instance for use throughout the bot
+rest = RestScheduler()
@@ -0,0 +1,164 @@
+"""
+Encodings for the data file.
+
+The format is picked with the DATA_FORMAT environment variable when saving,
+and detected from the file contents when loading, so switching formats needs
+no conversion step: the next save writes the new format. To convert a file
+directly:
+
+    python -m utils.serializers data.json data.msgpack --format msgpack
+"""
+import os
+import json
+import logging
+import argparse
+from typing import Any, Callable, Dict, Optional
+
+try:
+    import orjson
+except ImportError:  # Optional, the stdlib json module is used without it
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # Optional, only needed for DATA_FORMAT=msgpack
+    msgpack = None
+
+logger = logging.getLogger(__name__)
+
+Default = Optional[Callable[[Any], Any]]
+
+class Serializer:
+    """Encodes the database contents to bytes and back."""
+
+    name = ""
+    magic = b""  # Prefix identifying files in this format
+
+    def dumps(self, data: Any, default: Default = None) -> bytes:
+        """
+        Encode data.
+
+        Args:
+            data: The data to encode
+            default: Called for objects the format can't encode, returning an encodable value
+        """
+        raise NotImplementedError
+
+    def loads(self, raw: bytes) -> Any:
+        """Decode data encoded by dumps."""
+        raise NotImplementedError
+
+class JSONSerializer(Serializer):
+    """Compact JSON, encoded with orjson when it's installed."""
+
+    name = "json"
+
+    def __init__(self, indent: Optional[int] = None):
+        # indent=2 is the original data.json layout, kept for comparisons
+        self.indent = indent
+
+    def dumps(self, data: Any, default: Default = None) -> bytes:
+        if orjson is not None:
+            try:
+                option = orjson.OPT_INDENT_2 if self.indent else 0
+                return orjson.dumps(data, default=default, option=option)
+            except orjson.JSONEncodeError:
+                # orjson only handles 64-bit integers, so huge amounts need the json module.
+                # The leading newline tells loads not to use orjson, which reads them as floats.
+                pass
+        separators = None if self.indent else (",", ":")
+        return b"\n" + json.dumps(data, default=default, indent=self.indent, separators=separators).encode()
+
+    def loads(self, raw: bytes) -> Any:
+        # Only compact files were written by orjson. Anything else (like the original
+        # indented data.json) may have integers beyond 64 bits.
+        if orjson is not None and raw.startswith(b'{"'):
+            return orjson.loads(raw)
+        return json.loads(raw)
+
+class MessagePackSerializer(Serializer):
+    """MessagePack, which needs the msgpack package."""
+
+    name = "msgpack"
+    magic = b"RGDB\x01msgpack\n"
+
+    def dumps(self, data: Any, default: Default = None) -> bytes:
+        if msgpack is None:
+            raise RuntimeError("DATA_FORMAT=msgpack needs the msgpack package (pip install .[msgpack])")
+
+        def fallback(obj: Any) -> Any:
+            # msgpack passes integers beyond 64 bits to default too
+            if isinstance(obj, int):
+                raise OverflowError("Integer too large for MessagePack")
+            if default is None:
+                raise TypeError(f"Object of type {type(obj).__name__} is not serializable")
+            return default(obj)
+
+        try:
+            return self.magic + msgpack.packb(data, default=fallback, use_bin_type=True)
+        except OverflowError:
+            # MessagePack only handles 64-bit integers. JSON files load just the same.
+            logger.warning("Data has integers too large for MessagePack, saving as JSON")
+            return SERIALIZERS["json"].dumps(data, default)
+
+    def loads(self, raw: bytes) -> Any:
+        if msgpack is None:
+            raise RuntimeError("The data file is MessagePack, which needs the msgpack package (pip install .[msgpack])")
+        return msgpack.unpackb(memoryview(raw)[len(self.magic):], raw=False, strict_map_key=False)
+
+SERIALIZERS: Dict[str, Serializer] = {
+    "json": JSONSerializer(),
+    "msgpack": MessagePackSerializer()
+}
+
+def get_serializer(name: Optional[str] = None) -> Serializer:
+    """
+    Get a serializer by name, by default the one selected in the environment.
+
+    Environment variables:
+        DATA_FORMAT: Format of the data file, json or msgpack (default: json)
+    """
+    name = (name or os.getenv("DATA_FORMAT", "json")).lower()
+    serializer = SERIALIZERS.get(name)
+    if serializer is None:
+        logger.warning(f"Unknown DATA_FORMAT '{name}', using json")
+        return SERIALIZERS["json"]
+    if name == "msgpack" and msgpack is None:
+        logger.warning("DATA_FORMAT=msgpack needs the msgpack package, using json")
+        return SERIALIZERS["json"]
+    return serializer
+
+def detect(raw: bytes) -> Serializer:
+    """Get the serializer that wrote raw, from its magic prefix (files without one are JSON)."""
+    for serializer in SERIALIZERS.values():
+        if serializer.magic and raw.startswith(serializer.magic):
+            return serializer
+    return SERIALIZERS["json"]
+
+def loads(raw: bytes) -> Any:
+    """Decode data in any supported format."""
+    return detect(raw).loads(raw)
+
+def load_file(file_path: str) -> Any:
+    """Read and decode a data file in any supported format."""
+    with open(file_path, 'rb') as f:
+        return loads(f.read())
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert a data file to another format")
+    parser.add_argument("source", help="Data file to read (any format)")
+    parser.add_argument("destination", help="Data file to write")
+    parser.add_argument("--format", default="json", choices=sorted(SERIALIZERS), help="Format to write")
+    args = parser.parse_args()
+
+    with open(args.source, 'rb') as f:
+        raw = f.read()
+    source_format = detect(raw).name
+    data = loads(raw)
+    encoded = SERIALIZERS[args.format].dumps(data)
+    with open(args.destination, 'wb') as f:
+        f.write(encoded)
+    print(f"Converted {args.source} ({source_format}, {len(raw):,} bytes) to {args.destination} ({detect(encoded).name}, {len(encoded):,} bytes)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,368 @@
+import os
+import json
+import time
+import sqlite3
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, Any, Iterable, List, Optional
+from utils.database import DB_OPERATION_SECONDS, new_user
+from utils.metrics import add_phase_time
+
+logger = logging.getLogger(__name__)
+
+# User fields stored in their own (indexed) columns; everything else goes in `extra`
+NUMERIC_FIELDS = (
+    "cash",
+    "level",
+    "xp",
+    "games_played",
+    "wins",
+    "losses",
+    "total_cash_won",
+    "total_cash_lost",
+    "vote_streak"
+)
+
+# Fields that get an index for fast leaderboard queries
+INDEXED_FIELDS = ("cash", "level", "wins", "total_cash_won")
+
+# Counters that commands only add to, so concurrent updates are combined by adding their changes
+ADDITIVE_FIELDS = ("cash", "xp", "games_played", "wins", "losses", "total_cash_won", "total_cash_lost")
+
+class StoredUser(dict):
+    """A user's data as read from the store, remembering the values read so an update only applies its changes."""
+
+    __slots__ = ("base",)
+
+    def __init__(self, data: Dict[str, Any], base: Dict[str, Any]):
+        super().__init__(data)
+        self.base = base
+
+class SQLiteDatabase:
+    """
+    SQLite-backed database that is safe to share between processes.
+
+    Used when several bot processes run side by side (see cluster.py). It has
+    the same interface as Database. Queries run on a single worker thread so the
+    event loop never waits on the disk or on another process holding the lock.
+    """
+
+    def __init__(self, file_path: str = "data.sqlite3"):
+        self.file_path = file_path
+        self._local = threading.local()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-store")
+        # Identifies sessions claimed by this process
+        self._owner = f"{os.getpid()}:{id(self)}"
+        self._create_schema()
+        logger.info(f"Using SQLite database at {self.file_path}")
+
+    @property
+    def loaded(self) -> bool:
+        """SQLite is queried on demand, so there is nothing to load up front."""
+        return True
+
+    def start_loading(self):
+        """Nothing to load (kept for compatibility with Database)."""
+
+    async def wait_until_loaded(self):
+        """Nothing to load (kept for compatibility with Database)."""
+
+    async def flush(self):
+        """Writes are committed immediately (kept for compatibility with Database)."""
+
+    def _conn(self) -> sqlite3.Connection:
+        """Get the connection for the current thread."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.file_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        """Run a block in a write transaction that other processes wait for."""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    async def _run(self, func, *args):
+        """Run a blocking function on the store's worker thread."""
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        try:
+            return await loop.run_in_executor(self._executor, func, *args)
+        finally:
+            elapsed = time.perf_counter() - start
+            DB_OPERATION_SECONDS.observe(elapsed, func.__name__.lstrip("_"))
+            add_phase_time("db", elapsed)
+
+    def _create_schema(self):
+        columns = ", ".join(f"{field} NUMERIC NOT NULL DEFAULT 0" for field in NUMERIC_FIELDS)
+        with self._transaction() as conn:
+            conn.execute(f"CREATE TABLE IF NOT EXISTS users (user_id TEXT PRIMARY KEY, {columns}, extra TEXT NOT NULL)")
+            for field in INDEXED_FIELDS:
+                conn.execute(f"CREATE INDEX IF NOT EXISTS idx_users_{field} ON users ({field} DESC)")
+            conn.execute("CREATE TABLE IF NOT EXISTS global_stats (key TEXT PRIMARY KEY, value NUMERIC NOT NULL)")
+            for key in ("total_bets", "total_cash_won", "total_cash_lost"):
+                conn.execute("INSERT OR IGNORE INTO global_stats (key, value) VALUES (?, 0)", (key,))
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "user_id TEXT NOT NULL, kind TEXT NOT NULL, owner TEXT NOT NULL, expires_at REAL NOT NULL, "
+                "PRIMARY KEY (user_id, kind))"
+            )
+
+    @staticmethod
+    def _row_to_user(row: sqlite3.Row) -> Dict[str, Any]:
+        user = json.loads(row["extra"])
+        for field in NUMERIC_FIELDS:
+            user[field] = row[field]
+        return user
+
+    @classmethod
+    def _row_to_stored_user(cls, row: sqlite3.Row) -> StoredUser:
+        # Parsed twice, so changes to nested values (e.g. cooldowns) don't change the base
+        return StoredUser(cls._row_to_user(row), cls._row_to_user(row))
+
+    @staticmethod
+    def _apply_changes(user: Dict[str, Any], data: Dict[str, Any], base: Dict[str, Any]):
+        """
+        Apply the fields a command changed since it read the user, keeping changes made meanwhile.
+
+        Counters get the command's change added (two bets placed at once both
+        count), the level never goes down, and other changed fields are replaced.
+        """
+        for key, value in data.items():
+            old = base.get(key)
+            if value == old:
+                continue
+            if key in ADDITIVE_FIELDS and isinstance(value, (int, float)) and isinstance(old, (int, float)):
+                user[key] = user.get(key, 0) + (value - old)
+            elif key == "level":
+                user[key] = max(user.get(key, 0), value)
+            else:
+                user[key] = value
+
+    @staticmethod
+    def _write_user(conn: sqlite3.Connection, user_id: str, user: Dict[str, Any]):
+        extra = {key: value for key, value in user.items() if key not in NUMERIC_FIELDS}
+        values = [user.get(field, 0) for field in NUMERIC_FIELDS]
+        placeholders = ", ".join("?" for _ in range(len(NUMERIC_FIELDS) + 2))
+        updates = ", ".join(f"{field} = excluded.{field}" for field in NUMERIC_FIELDS)
+        conn.execute(
+            f"INSERT INTO users (user_id, {', '.join(NUMERIC_FIELDS)}, extra) VALUES ({placeholders}) "
+            f"ON CONFLICT (user_id) DO UPDATE SET {updates}, extra = excluded.extra",
+            (user_id, *values, json.dumps(extra))
+        )
+
+    def _load_user(self, conn: sqlite3.Connection, user_id: str) -> Dict[str, Any]:
+        """Load a user, creating them if they don't exist. Must run in a transaction."""
+        row = conn.execute("SELECT * FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        if row is None:
+            user = new_user()
+            self._write_user(conn, user_id, user)
+            return user
+        return self._row_to_user(row)
+
+    def _get_user(self, user_id: str) -> Dict[str, Any]:
+        row = self._conn().execute("SELECT * FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        if row is not None:
+            return self._row_to_stored_user(row)
+        # Users who are only looked up aren't stored until they are updated
+        return StoredUser(new_user(), new_user())
+
+    def _update_user(self, user_id: str, data: Dict[str, Any], base: Optional[Dict[str, Any]]):
+        with self._transaction() as conn:
+            # Read in the write transaction, so no other process changes the user in between
+            user = self._load_user(conn, user_id)
+            if base is None:
+                user.update(data)
+            else:
+                self._apply_changes(user, data, base)
+            self._write_user(conn, user_id, user)
+
+    def _write_users(self, users: Dict[str, Dict[str, Any]]):
+        with self._transaction() as conn:
+            for user_id, user in users.items():
+                self._write_user(conn, user_id, user)
+
+    def _leaderboard(self, field: str, limit: int, user_ids: Optional[Iterable[str]] = None) -> List[Dict[str, Any]]:
+        conn = self._conn()
+        where = ""
+        params: List[Any] = []
+        if user_ids is not None:
+            # Looked up by primary key, so only these users' rows are read
+            where = "WHERE user_id IN (SELECT value FROM json_each(?))"
+            params.append(json.dumps(list(user_ids)))
+        if field in NUMERIC_FIELDS:
+            rows = conn.execute(f"SELECT * FROM users {where} ORDER BY {field} DESC LIMIT ?", (*params, limit)).fetchall()
+            return [{"id": row["user_id"], **self._row_to_user(row)} for row in rows]
+
+        # Not a column, so sort in Python
+        users = [(row["user_id"], self._row_to_user(row)) for row in conn.execute(f"SELECT * FROM users {where}", params)]
+        users.sort(key=lambda x: x[1].get(field, 0), reverse=True)
+        return [{"id": user_id, **user_data} for user_id, user_data in users[:limit]]
+
+    def _add_stats(self, bets: int, cash_won: int, cash_lost: int):
+        with self._transaction() as conn:
+            conn.executemany(
+                "UPDATE global_stats SET value = value + ? WHERE key = ?",
+                [(bets, "total_bets"), (cash_won, "total_cash_won"), (cash_lost, "total_cash_lost")]
+            )
+
+    def _set_cooldown(self, user_id: str, command: str, expiry_time: float):
+        with self._transaction() as conn:
+            user = self._load_user(conn, user_id)
+            user.setdefault("cooldowns", {})[command] = expiry_time
+            self._write_user(conn, user_id, user)
+
+    def _claim_session(self, user_id: str, kind: str, ttl: float) -> bool:
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                "DELETE FROM sessions WHERE user_id = ? AND kind = ? AND expires_at <= ?",
+                (user_id, kind, now)
+            )
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO sessions (user_id, kind, owner, expires_at) VALUES (?, ?, ?, ?)",
+                (user_id, kind, self._owner, now + ttl)
+            )
+            return cursor.rowcount == 1
+
+    def _release_session(self, user_id: str, kind: str):
+        with self._transaction() as conn:
+            conn.execute(
+                "DELETE FROM sessions WHERE user_id = ? AND kind = ? AND owner = ?",
+                (user_id, kind, self._owner)
+            )
+
+    async def get_user(self, user_id: str) -> Dict[str, Any]:
+        """Get user data, with default values if they don't exist."""
+        return await self._run(self._get_user, str(user_id))
+
+    async def update_user(self, user_id: str, data: Dict[str, Any]):
+        """
+        Update user data.
+
+        Data from get_user only applies what changed since it was read, so
+        concurrent updates of the same user (in any process) are all kept.
+        Other data replaces the user's fields.
+        """
+        await self._run(self._update_user, str(user_id), dict(data), getattr(data, "base", None))
+
+    async def write_users(self, users: Dict[str, Dict[str, Any]]):
+        """Replace the data of several users in one transaction."""
+        await self._run(self._write_users, users)
+
+    async def get_leaderboard(self, field: str = "cash", limit: int = 10, user_ids: Optional[Iterable[str]] = None) -> List[Dict[str, Any]]:
+        """Get a sorted leaderboard based on a specific field, optionally of only some users."""
+        return await self._run(self._leaderboard, field, limit, user_ids)
+
+    async def update_stats(self, bet_amount: int, result: bool):
+        """Update global stats for a bet."""
+        await self.add_stats(1, bet_amount if result else 0, 0 if result else bet_amount)
+
+    async def add_stats(self, bets: int, cash_won: int, cash_lost: int):
+        """Add a batch of bets to the global stats."""
+        await self._run(self._add_stats, bets, cash_won, cash_lost)
+
+    async def get_all_cooldowns(self, user_id: str) -> Dict[str, Any]:
+        """Get all cooldowns for a user."""
+        user = await self.get_user(user_id)
+        return user.get("cooldowns", {})
+
+    async def set_cooldown(self, user_id: str, command: str, expiry_time: float):
+        """Set a cooldown for a specific command."""
+        await self._run(self._set_cooldown, str(user_id), command, expiry_time)
+
+    async def claim_session(self, user_id: str, kind: str, ttl: float = 600) -> bool:
+        """
+        Claim an exclusive session (e.g. an active blackjack game) for a user.
+
+        Sessions are shared by every process using the same database file.
+
+        Args:
+            user_id: The ID of the user
+            kind: The kind of session
+            ttl: Seconds after which an unreleased session expires
+
+        Returns:
+            True if the session was claimed, False if the user already has one
+        """
+        return await self._run(self._claim_session, str(user_id), kind, ttl)
+
+    async def release_session(self, user_id: str, kind: str):
+        """Release a session claimed with claim_session."""
+        await self._run(self._release_session, str(user_id), kind)
+
+    def snapshot_stats(self) -> Dict[str, Any]:
+        """Get the global stats (for the dashboard)."""
+        rows = self._conn().execute("SELECT key, value FROM global_stats").fetchall()
+        return {row["key"]: row["value"] for row in rows}
+
+    def snapshot_leaderboard(self, field: str = "cash", limit: int = 10, user_ids: Optional[Iterable[str]] = None) -> List[Dict[str, Any]]:
+        """Get a leaderboard (for the dashboard)."""
+        return self._leaderboard(field, limit, user_ids)
+
+    def snapshot_aggregates(self) -> Dict[str, Any]:
+        """Get the user count and the sum of each numeric user field (for the dashboard)."""
+        sums = ", ".join(f"COALESCE(SUM({field}), 0) AS {field}" for field in NUMERIC_FIELDS)
+        row = self._conn().execute(f"SELECT COUNT(*) AS users, {sums} FROM users").fetchone()
+        return dict(row)
+
+    def snapshot_histogram(self, field: str, bins: int = 10) -> Dict[str, List[float]]:
+        """
+        Get the distribution of a numeric user field (for the dashboard).
+
+        Args:
+            field: One of the numeric user fields
+            bins: Number of equal-width bins
+
+        Returns:
+            {"edges": bins + 1 bin edges, "counts": users per bin}
+        """
+        if field not in NUMERIC_FIELDS:
+            raise ValueError(f"Not a numeric user field: {field}")
+        conn = self._conn()
+        low, high = conn.execute(f"SELECT MIN({field}), MAX({field}) FROM users").fetchone()
+        if low is None:
+            return {"edges": [], "counts": []}
+        width = (high - low) / bins or 1
+        counts = [0] * bins
+        rows = conn.execute(
+            f"SELECT MIN(CAST(({field} - ?) / ? AS INTEGER), ?) AS bin, COUNT(*) AS count FROM users GROUP BY bin",
+            (low, width, bins - 1)
+        )
+        for row in rows:
+            counts[row["bin"]] += row["count"]
+        return {"edges": [low + width * index for index in range(bins + 1)], "counts": counts}
+
+    def import_data(self, data: Dict[str, Any]):
+        """
+        Import the contents of a JSON data file into this database.
+
+        Args:
+            data: Data in the format used by Database
+        """
+        with self._transaction() as conn:
+            for user_id, user in data.get("users", {}).items():
+                merged = new_user()
+                merged.update(user)
+                self._write_user(conn, str(user_id), merged)
+            for key, value in data.get("global_stats", {}).items():
+                conn.execute(
+                    "INSERT INTO global_stats (key, value) VALUES (?, ?) "
+                    "ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+                    (key, value)
+                )
+        logger.info(f"Imported {len(data.get('users', {}))} users into {self.file_path}")
@@ -0,0 +1,46 @@
+"""
+The bot's default event subscribers: global stats, the ledger and the
+gameplay statistics, each fed a batch of events at a time.
+"""
+from typing import Dict, List, Tuple
+from utils.events import BetSettled, EventBus, RewardClaimed
+from utils.ledger import REWARDS, ledger
+from utils.timeseries import timeseries
+
+async def update_global_stats(events: List[BetSettled]):
+    """Add a batch of bets to the global stats, with one update per economy."""
+    totals: Dict[int, Tuple[object, List[int]]] = {}
+    for event in events:
+        entry = totals.get(id(event.economy))
+        if entry is None:
+            entry = totals[id(event.economy)] = (event.economy, [0, 0, 0])
+        counts = entry[1]
+        counts[0] += 1
+        if event.won:
+            counts[1] += event.bet
+        else:
+            counts[2] += event.bet
+    for economy, (bets, cash_won, cash_lost) in totals.values():
+        await economy.add_stats(bets, cash_won, cash_lost)
+
+async def record_ledger_entries(events: List[object]):
+    """Record the cash movements in the ledger, stamped with when they happened."""
+    for event in events:
+        if isinstance(event, BetSettled):
+            ledger.record(event.account, event.amount, event.balance, event.game, bet=event.bet, outcome=event.outcome, ts=event.ts)
+        else:
+            ledger.record(event.account, event.amount, event.balance, event.source, contra=REWARDS, ts=event.ts)
+
+async def record_activity(events: List[object]):
+    """Count the bets and active users in the gameplay statistics."""
+    for event in events:
+        if isinstance(event, BetSettled):
+            timeseries.record_bet(event.game, event.user_id, event.bet, event.amount, now=event.ts)
+        else:
+            timeseries.record_active(event.user_id, now=event.ts)
+
+def subscribe_defaults(bus: EventBus):
+    """Subscribe the default handlers to a bus."""
+    bus.subscribe(update_global_stats, BetSettled)
+    bus.subscribe(record_ledger_entries, BetSettled, RewardClaimed)
+    bus.subscribe(record_activity, BetSettled, RewardClaimed)
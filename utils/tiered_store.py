@@ -0,0 +1,232 @@
+import os
+import time
+import asyncio
+import contextvars
+import logging
+from collections import OrderedDict
+from typing import Dict, Any, Iterable, List, Optional
+from utils.database import _detach
+from utils.metrics import counter, gauge, histogram
+from utils.sqlite_store import SQLiteDatabase
+
+logger = logging.getLogger(__name__)
+
+CACHE_REQUESTS = counter("user_cache_requests_total", "User lookups in the hot cache", ["result"])
+CACHE_EVICTIONS = counter("user_cache_evictions_total", "Users evicted from the hot cache")
+CACHE_WRITE_BACK_SECONDS = histogram("user_cache_write_back_seconds", "Time taken to write changed users to the cold store")
+CACHE_SIZE = gauge("user_cache_size", "Users held in the hot cache")
+CACHE_DIRTY = gauge("user_cache_dirty", "Changed users not yet written to the cold store")
+
+class TieredDatabase:
+    """
+    Hot cache of recently active users over a cold SQLite store.
+
+    Most users are inactive, so instead of keeping every user in memory only
+    the most recently used ones are, in an LRU cache of bounded size. Other
+    users are loaded from the cold store on first access. Changes are written
+    back to the cold store in batches, every few seconds and when the cache
+    is flushed, and users evicted with unwritten changes are kept until then.
+
+    Has the same interface as Database. Leaderboards flush the changes first
+    so they see up-to-date values. The dashboard snapshots read the cold
+    store, so they can lag by up to the write-back interval. The cache isn't
+    shared between processes, so this is for a single bot process (clusters
+    use the sqlite backend).
+
+    Environment variables:
+        USER_CACHE_SIZE: Number of users to keep in the hot cache (default: 10000)
+        WRITE_BACK_INTERVAL: Seconds between writes of changed users (default: 5)
+    """
+
+    def __init__(self, cold: SQLiteDatabase, cache_size: Optional[int] = None, write_back_interval: Optional[float] = None):
+        self.cold = cold
+        self.cache_size = cache_size or int(os.getenv("USER_CACHE_SIZE", "10000"))
+        self.write_back_interval = write_back_interval or float(os.getenv("WRITE_BACK_INTERVAL", "5"))
+        self.hot: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._dirty: set = set()  # Changed users in the hot cache
+        self._evicted: Dict[str, Dict[str, Any]] = {}  # Changed users evicted before being written
+        self._loading: Dict[str, asyncio.Future] = {}
+        self._write_back_task: Optional[asyncio.Task] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self.hits = 0
+        self.misses = 0
+
+        CACHE_SIZE.set_function(lambda: {(): len(self.hot)})
+        CACHE_DIRTY.set_function(lambda: {(): len(self._dirty) + len(self._evicted)})
+
+    @property
+    def loaded(self) -> bool:
+        """Users are loaded on demand, so there is nothing to load up front."""
+        return True
+
+    def start_loading(self):
+        """Nothing to load (kept for compatibility with Database)."""
+
+    async def wait_until_loaded(self):
+        """Nothing to load (kept for compatibility with Database)."""
+
+    def hit_rate(self) -> Optional[float]:
+        """Get the share of lookups served from the hot cache."""
+        if self.hits + self.misses == 0:
+            return None
+        return self.hits / (self.hits + self.misses)
+
+    async def get_user(self, user_id: str) -> Dict[str, Any]:
+        """Get user data, with default values if they don't exist."""
+        user_id = str(user_id)
+        user = self.hot.get(user_id)
+        if user is not None:
+            self.hits += 1
+            CACHE_REQUESTS.inc("hit")
+            self.hot.move_to_end(user_id)
+            return user
+
+        # Evicted with unwritten changes, so the cold store is out of date
+        user = self._evicted.pop(user_id, None)
+        if user is not None:
+            self.hits += 1
+            CACHE_REQUESTS.inc("hit")
+            self._insert(user_id, user)
+            self._dirty.add(user_id)
+            return user
+
+        self.misses += 1
+        CACHE_REQUESTS.inc("miss")
+        # Concurrent lookups of the same user share one load, so they get the same dict
+        loading = self._loading.get(user_id)
+        if loading is not None:
+            return await asyncio.shield(loading)
+        loading = self._loading[user_id] = asyncio.get_running_loop().create_future()
+        try:
+            user = await self.cold.get_user(user_id)
+        except BaseException as e:
+            loading.set_exception(e)
+            # Retrieve it, so an exception nobody else waited for isn't logged
+            loading.exception()
+            raise
+        finally:
+            del self._loading[user_id]
+        self._insert(user_id, user)
+        loading.set_result(user)
+        return user
+
+    def _insert(self, user_id: str, user: Dict[str, Any]):
+        """Add a user to the hot cache, evicting the least recently used ones."""
+        self.hot[user_id] = user
+        while len(self.hot) > self.cache_size:
+            evicted_id, evicted = self.hot.popitem(last=False)
+            CACHE_EVICTIONS.inc()
+            if evicted_id in self._dirty:
+                self._dirty.discard(evicted_id)
+                self._evicted[evicted_id] = evicted
+
+    def _mark_dirty(self, user_id: str):
+        self._dirty.add(user_id)
+        if self._write_back_task is None or self._write_back_task.done():
+            # A fresh context, so the writes aren't timed as part of the command that changed the first user
+            self._write_back_task = asyncio.create_task(self._write_back_loop(), context=contextvars.Context())
+
+    async def _write_back_loop(self):
+        """Write changed users every write_back_interval seconds while there are any."""
+        while self._dirty or self._evicted:
+            await asyncio.sleep(self.write_back_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Error writing users to the cold store: {e}")
+
+    async def flush(self):
+        """Write every changed user to the cold store."""
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            if not self._dirty and not self._evicted:
+                return
+            # Copy on the loop, so the users can keep changing while the batch is written
+            batch = {user_id: _detach(self.hot[user_id]) for user_id in self._dirty}
+            for user_id, user in self._evicted.items():
+                batch[user_id] = _detach(user)
+            self._dirty.clear()
+            self._evicted.clear()
+            start = time.perf_counter()
+            try:
+                await self.cold.write_users(batch)
+            except BaseException:
+                # Keep the changes that weren't written (unless they changed again meanwhile)
+                for user_id, user in batch.items():
+                    if user_id not in self.hot:
+                        self._evicted.setdefault(user_id, user)
+                    elif user_id not in self._dirty:
+                        self._dirty.add(user_id)
+                raise
+            finally:
+                CACHE_WRITE_BACK_SECONDS.observe(time.perf_counter() - start)
+
+    async def update_user(self, user_id: str, data: Dict[str, Any]):
+        """Update user data."""
+        user_id = str(user_id)
+        user = await self.get_user(user_id)
+        if user is not data:
+            user.update(data)
+        self._mark_dirty(user_id)
+
+    async def get_leaderboard(self, field: str = "cash", limit: int = 10, user_ids: Optional[Iterable[str]] = None) -> List[Dict[str, Any]]:
+        """Get a sorted leaderboard based on a specific field, optionally of only some users."""
+        await self.flush()
+        return await self.cold.get_leaderboard(field, limit, user_ids)
+
+    async def update_stats(self, bet_amount: int, result: bool):
+        """Update global stats for a bet."""
+        await self.cold.update_stats(bet_amount, result)
+
+    async def add_stats(self, bets: int, cash_won: int, cash_lost: int):
+        """Add a batch of bets to the global stats."""
+        await self.cold.add_stats(bets, cash_won, cash_lost)
+
+    async def get_all_cooldowns(self, user_id: str) -> Dict[str, Any]:
+        """Get all cooldowns for a user."""
+        user = await self.get_user(user_id)
+        return user.get("cooldowns", {})
+
+    async def set_cooldown(self, user_id: str, command: str, expiry_time: float):
+        """Set a cooldown for a specific command."""
+        user = await self.get_user(user_id)
+        user.setdefault("cooldowns", {})[command] = expiry_time
+        self._mark_dirty(str(user_id))
+
+    async def claim_session(self, user_id: str, kind: str, ttl: float = 600) -> bool:
+        """
+        Claim an exclusive session (e.g. an active blackjack game) for a user.
+
+        Args:
+            user_id: The ID of the user
+            kind: The kind of session
+            ttl: Seconds after which an unreleased session expires
+
+        Returns:
+            True if the session was claimed, False if the user already has one
+        """
+        return await self.cold.claim_session(user_id, kind, ttl)
+
+    async def release_session(self, user_id: str, kind: str):
+        """Release a session claimed with claim_session."""
+        await self.cold.release_session(user_id, kind)
+
+    def snapshot_stats(self) -> Dict[str, Any]:
+        """Get the global stats (for the dashboard)."""
+        return self.cold.snapshot_stats()
+
+    def snapshot_leaderboard(self, field: str = "cash", limit: int = 10, user_ids: Optional[Iterable[str]] = None) -> List[Dict[str, Any]]:
+        """Get a leaderboard from the cold store (for the dashboard)."""
+        return self.cold.snapshot_leaderboard(field, limit, user_ids)
+
+    def snapshot_aggregates(self) -> Dict[str, Any]:
+        """Get the user count and the sum of each numeric user field from the cold store (for the dashboard)."""
+        aggregates = self.cold.snapshot_aggregates()
+        aggregates["cache_size"] = len(self.hot)
+        aggregates["cache_hit_rate"] = self.hit_rate()
+        return aggregates
+
+    def snapshot_histogram(self, field: str, bins: int = 10) -> Dict[str, List[float]]:
+        """Get the distribution of a numeric user field from the cold store (for the dashboard)."""
+        return self.cold.snapshot_histogram(field, bins)
@@ -0,0 +1,292 @@
+"""
+Gameplay statistics rolled up into minute, hour and day buckets.
+
+Every bet adds to its game's bucket (number of bets, volume bet and house
+profit) and to the all-games bucket, which also counts distinct active
+users. Bets only update counters in memory: the changes since the last
+flush are added to SQLite every TIMESERIES_FLUSH_INTERVAL seconds, as one
+upsert per bucket, so reads never scan the users or the ledger. Old minute
+and hour buckets are pruned after MINUTE_RETENTION and HOUR_RETENTION.
+
+Bot processes in a cluster add to the same buckets. A user active in
+several processes in the same bucket is counted once per process.
+"""
+import os
+import time
+import sqlite3
+import asyncio
+import contextvars
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+from utils.metrics import histogram
+
+logger = logging.getLogger(__name__)
+
+TIMESERIES_FLUSH_SECONDS = histogram("timeseries_flush_seconds", "Time taken to write gameplay statistics buckets")
+
+# Bucket size in seconds by resolution
+RESOLUTIONS = {
+    "minute": 60,
+    "hour": 3600,
+    "day": 86400
+}
+
+# Seconds to keep buckets for (days are kept forever)
+MINUTE_RETENTION = 2 * 86400
+HOUR_RETENTION = 90 * 86400
+
+# Game name of the all-games buckets
+ALL_GAMES = "*"
+
+MAX_SQL_INT = 2**63 - 1
+
+# Index of each counter in a bucket
+BETS, VOLUME, PROFIT = range(3)
+
+def _to_sql(value: Any) -> Any:
+    """SQLite integers are 64-bit, so larger sums are stored as floats."""
+    return float(value) if isinstance(value, int) and abs(value) > MAX_SQL_INT else value
+
+class TimeSeries:
+    """
+    In-memory counters for the current buckets, flushed to SQLite.
+
+    Environment variables:
+        TIMESERIES_FILE: SQLite file for the buckets (default: timeseries.sqlite3)
+        TIMESERIES_FLUSH_INTERVAL: Seconds between writes of the counters (default: 10)
+    """
+
+    def __init__(self, file_path: Optional[str] = None, flush_interval: Optional[float] = None):
+        self.file_path = file_path or os.getenv("TIMESERIES_FILE", "timeseries.sqlite3")
+        self.flush_interval = flush_interval or float(os.getenv("TIMESERIES_FLUSH_INTERVAL", "10"))
+        # Changes since the last flush, by (minute, game). Hours and days are summed from them when flushing.
+        self._deltas: Dict[Tuple[int, str], List[Any]] = {}
+        # Users seen in the current bucket of each resolution, and how many of them are new since the last flush
+        self._active: Dict[str, Tuple[int, set]] = {}
+        self._new_users: Dict[Tuple[str, int], int] = {}
+        # The batch being written, which reads still add, and the number of batches
+        # written so far (both guarded by _read_lock, which is never held during a query)
+        self._writing: Optional[Tuple[Dict, Dict]] = None
+        self._written = 0
+        self._read_lock = threading.Lock()
+        self._local = threading.local()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="timeseries")
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+
+    def _conn(self) -> sqlite3.Connection:
+        """Get the connection for the current thread, creating the schema on first use."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.file_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets ("
+                "resolution TEXT NOT NULL, start INTEGER NOT NULL, game TEXT NOT NULL, "
+                "bets INTEGER NOT NULL DEFAULT 0, volume NUMERIC NOT NULL DEFAULT 0, "
+                "profit NUMERIC NOT NULL DEFAULT 0, users INTEGER NOT NULL DEFAULT 0, "
+                "PRIMARY KEY (resolution, start, game)) WITHOUT ROWID"
+            )
+            self._local.conn = conn
+        return conn
+
+    def record_bet(self, game: str, user_id: str, bet: int, amount: int, now: Optional[float] = None):
+        """
+        Count a bet.
+
+        Args:
+            game: The game played
+            user_id: The ID of the user who bet
+            bet: The amount bet
+            amount: Cash the user won (negative if they lost), so the house profit is -amount
+            now: Time of the bet (default: now)
+        """
+        now = time.time() if now is None else now
+        minute = int(now // 60) * 60
+        for key in ((minute, game), (minute, ALL_GAMES)):
+            counters = self._deltas.get(key)
+            if counters is None:
+                counters = self._deltas[key] = [0, 0, 0]
+            counters[BETS] += 1
+            counters[VOLUME] += bet
+            counters[PROFIT] -= amount
+        self.record_active(user_id, now)
+
+    def record_active(self, user_id: str, now: Optional[float] = None):
+        """Count a user as active (they bet or earned cash)."""
+        now = time.time() if now is None else now
+        for resolution, size in RESOLUTIONS.items():
+            start = int(now // size) * size
+            active = self._active.get(resolution)
+            if active is None or active[0] != start:
+                active = self._active[resolution] = (start, set())
+            if user_id not in active[1]:
+                active[1].add(user_id)
+                key = (resolution, start)
+                self._new_users[key] = self._new_users.get(key, 0) + 1
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        if self._flush_task is None or self._flush_task.done():
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                # No event loop (scripts), the counters are written by flush_sync()
+                return
+            # A fresh context, so the flushes aren't timed as part of the command that recorded first
+            self._flush_task = loop.create_task(self._flush_loop(), context=contextvars.Context())
+
+    async def _flush_loop(self):
+        """Write the counters every flush_interval seconds while they change."""
+        while self._deltas or self._new_users:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Error writing gameplay statistics: {e}")
+
+    def _take_batch(self) -> Tuple[Dict, Dict]:
+        """Swap the counters for empty ones, keeping the old ones readable until they are written."""
+        with self._read_lock:
+            batch = self._writing = (self._deltas, self._new_users)
+            self._deltas = {}
+            self._new_users = {}
+        return batch
+
+    async def flush(self):
+        """Add the changes since the last flush to the stored buckets."""
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            if not self._deltas and not self._new_users:
+                return
+            # Swapped on the event loop, so no bet is half counted
+            batch = self._take_batch()
+            loop = asyncio.get_running_loop()
+            start = time.perf_counter()
+            try:
+                await loop.run_in_executor(self._executor, self._write, batch)
+            except BaseException:
+                with self._read_lock:
+                    self._writing = None
+                    self._merge_back(batch)
+                raise
+            finally:
+                TIMESERIES_FLUSH_SECONDS.observe(time.perf_counter() - start)
+
+    def _merge_back(self, batch: Tuple[Dict, Dict]):
+        """Add a batch that couldn't be written back to the counters."""
+        deltas, new_users = batch
+        for key, values in deltas.items():
+            counters = self._deltas.setdefault(key, [0, 0, 0])
+            for i, value in enumerate(values):
+                counters[i] += value
+        for key, count in new_users.items():
+            self._new_users[key] = self._new_users.get(key, 0) + count
+
+    def flush_sync(self):
+        """Write the counters from code without an event loop."""
+        self._write(self._take_batch())
+
+    @staticmethod
+    def _rollup(deltas: Dict[Tuple[int, str], List[Any]], new_users: Dict[Tuple[str, int], int]) -> Dict[Tuple[str, int, str], List[Any]]:
+        """Sum minute changes into every resolution, as [bets, volume, profit, users] by (resolution, start, game)."""
+        rows: Dict[Tuple[str, int, str], List[Any]] = {}
+        for (minute, game), values in deltas.items():
+            for resolution, size in RESOLUTIONS.items():
+                row = rows.setdefault((resolution, minute // size * size, game), [0, 0, 0, 0])
+                for i, value in enumerate(values):
+                    row[i] += value
+        for (resolution, start), count in new_users.items():
+            rows.setdefault((resolution, start, ALL_GAMES), [0, 0, 0, 0])[3] += count
+        return rows
+
+    def _write(self, batch: Tuple[Dict, Dict]):
+        rows = self._rollup(*batch)
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT INTO buckets (resolution, start, game, bets, volume, profit, users) VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (resolution, start, game) DO UPDATE SET bets = bets + excluded.bets, "
+                "volume = volume + excluded.volume, profit = profit + excluded.profit, users = users + excluded.users",
+                [(resolution, start, game, *(_to_sql(value) for value in row)) for (resolution, start, game), row in rows.items()]
+            )
+            conn.execute("DELETE FROM buckets WHERE resolution = 'minute' AND start < ?", (now - MINUTE_RETENTION,))
+            conn.execute("DELETE FROM buckets WHERE resolution = 'hour' AND start < ?", (now - HOUR_RETENTION,))
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        # The batch moves from _writing to the table at once, as far as snapshot can tell
+        with self._read_lock:
+            conn.execute("COMMIT")
+            self._writing = None
+            self._written += 1
+
+    def snapshot(self, resolution: str = "minute", points: int = 60, game: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Get the most recent buckets, oldest first, including changes not yet written.
+
+        Safe to call from any thread (for the dashboard).
+
+        Args:
+            resolution: minute, hour or day
+            points: Number of buckets, counting back from the current one
+            game: Only this game (default: all games, with a breakdown by game)
+
+        Returns:
+            One dict per bucket with its start, bets, volume, profit, and for all games the
+            active users and a "games" dict of each game's bets, volume and profit. Buckets
+            without any bets are included, with zeros.
+        """
+        size = RESOLUTIONS[resolution]
+        current = int(time.time() // size) * size
+        first = current - (points - 1) * size
+        query = "SELECT start, game, bets, volume, profit, users FROM buckets WHERE resolution = ? AND start >= ?"
+        params: List[Any] = [resolution, first]
+        if game is not None:
+            query += " AND game = ?"
+            params.append(game)
+        while True:
+            # Copy the unwritten counters, then query without the lock (which the event loop takes).
+            # If a batch was written meanwhile, it may be in both, so read again.
+            with self._read_lock:
+                written = self._written
+                pending = [self._writing] if self._writing is not None else []
+                pending.append((dict(self._deltas), dict(self._new_users)))
+            rows: Dict[Tuple[str, int, str], List[Any]] = {}
+            for row in self._conn().execute(query, params):
+                rows[(resolution, row["start"], row["game"])] = [row["bets"], row["volume"], row["profit"], row["users"]]
+            with self._read_lock:
+                if self._written == written:
+                    break
+        for batch in pending:
+            for key, values in self._rollup(*batch).items():
+                if key[0] != resolution or key[1] < first or (game is not None and key[2] != game):
+                    continue
+                row = rows.setdefault(key, [0, 0, 0, 0])
+                for i, value in enumerate(values):
+                    row[i] += value
+
+        games: Dict[int, Dict[str, Dict[str, Any]]] = {}
+        if game is None:
+            for (_, start, name), values in rows.items():
+                if name != ALL_GAMES:
+                    games.setdefault(start, {})[name] = {"bets": values[BETS], "volume": values[VOLUME], "profit": values[PROFIT]}
+
+        buckets = []
+        for start in range(first, current + 1, size):
+            bets, volume, profit, users = rows.get((resolution, start, game or ALL_GAMES), (0, 0, 0, 0))
+            bucket = {"start": start, "bets": bets, "volume": volume, "profit": profit}
+            if game is None:
+                bucket["users"] = users
+                bucket["games"] = games.get(start, {})
+            buckets.append(bucket)
+        return buckets
+
+timeseries = TimeSeries()